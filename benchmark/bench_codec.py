@@ -0,0 +1,60 @@
+import argparse
+import timeit
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+import maxwell.protocol.maxwell_protocol as protocol
+from maxwell.service import codec as codecs
+
+
+def build_candles(length):
+    candles = []
+    for i in range(0, length):
+        candles.append(
+            {
+                "ts": i,
+                "open": i + 1,
+                "high": i + 2,
+                "low": i + 3,
+                "close": i + 4,
+                "volume": i + 5,
+            }
+        )
+    return candles
+
+
+def encode_rep(codec, payload):
+    rep = protocol_types.req_rep_t()
+    rep.payload = codecs.encode(codec, payload)
+    rep.conn0_ref = 1
+    rep.ref = 1
+    return protocol.encode_msg(rep)
+
+
+def run(length, number):
+    candles = build_candles(length)
+    encoded_candles = codecs.encode("json", candles)
+    cases = [("json", candles), ("orjson", candles), ("msgspec", candles)]
+    cases.append(("raw", encoded_candles))
+
+    baseline = None
+    print("candles: %s, number: %s" % (length, number))
+    for codec, payload in cases:
+        try:
+            codecs.check_codec(codec)
+        except ValueError as e:
+            print("%-8s skipped: %s" % (codec, e))
+            continue
+        elapsed = timeit.timeit(lambda: encode_rep(codec, payload), number=number)
+        per_call_ms = elapsed / number * 1000
+        if baseline is None:
+            baseline = per_call_ms
+        print(
+            "%-8s %10.3f ms/rep %8.2fx" % (codec, per_call_ms, baseline / per_call_ms)
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--length", type=int, default=30000, help="Candles per rep.")
+    parser.add_argument("--number", type=int, default=20, help="Reps per codec.")
+    args = parser.parse_args()
+    run(args.length, args.number)
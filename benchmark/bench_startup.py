@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import time
+
+from .fake_master import FakeMaster
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def get_unused_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def get(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def wait_for_serving(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if await get(port, "/ping") == 200:
+                return time.monotonic()
+        except OSError:
+            pass
+        await asyncio.sleep(0.001)
+    raise TimeoutError(f"Service wasn't serving in {timeout}s")
+
+
+# Returns the seconds from spawning the process until it served the first
+# request, and until the master got to know its routes.
+async def measure(master, registrar_mode, timeout):
+    port = get_unused_port()
+    env = dict(os.environ)
+    env.setdefault(
+        "SERVICE_CFG_FILE", os.path.join(ROOT_DIR, "config", "service.template.toml")
+    )
+    env.update(
+        {
+            "master_endpoints": master.endpoint(),
+            "port": str(port),
+            "registrar_mode": registrar_mode,
+            "endpoint_snapshot_file": "",
+        }
+    )
+    master.set_routes_reqs.clear()
+    start_at = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "benchmark.startup_service",
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        served_at = await wait_for_serving(port, timeout)
+        registered_at = await master.wait_for_path("/ping", timeout)
+        return served_at - start_at, registered_at - start_at
+    finally:
+        process.terminate()
+        await process.wait()
+
+
+async def run(rounds, timeout):
+    master = await FakeMaster().start()
+    try:
+        print("rounds: %s" % rounds)
+        for registrar_mode in ("thread", "loop"):
+            results = [
+                await measure(master, registrar_mode, timeout) for _ in range(rounds)
+            ]
+            print(
+                "%-8s first request: %8.1f ms, routes registered: %8.1f ms"
+                % (
+                    registrar_mode,
+                    statistics.median(served for served, _ in results) * 1000,
+                    statistics.median(registered for _, registered in results) * 1000,
+                )
+            )
+    finally:
+        await master.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the time from process start to the first request."
+    )
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(run(args.rounds, args.timeout))
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from .bench_startup import ROOT_DIR, get_unused_port, wait_for_serving
+from .fake_gateway import FakeGateway
+from .fake_master import FakeMaster
+
+DISPATCH_CASES = [
+    "/v0/sync",
+    "/v0/async",
+    "/v1/sync/small",
+    "/v1/async/small",
+    "/v1/sync/large",
+    "/v1/async/large",
+]
+PUBLISH_CASES = ["publish", "publish_nowait", "publish_many"]
+
+
+def summarize(latencies, elapsed):
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p90_ms": quantiles[89] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+
+
+# The median of every metric over the rounds, so one noisy round doesn't
+# decide the result.
+def median_of(rounds):
+    return {key: statistics.median(round[key] for round in rounds) for key in rounds[0]}
+
+
+async def start_service(master, timeout):
+    port = get_unused_port()
+    env = dict(os.environ)
+    env.setdefault(
+        "SERVICE_CFG_FILE", os.path.join(ROOT_DIR, "config", "service.template.toml")
+    )
+    env.update(
+        {
+            "master_endpoints": master.endpoint(),
+            "port": str(port),
+            "workers": "0",
+            "endpoint_snapshot_file": "",
+            "trace_sample_rate": "0",
+        }
+    )
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "benchmark.dispatch_service",
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    await wait_for_serving(port, timeout)
+    return process, port
+
+
+async def bench_dispatch(master, args):
+    results = {}
+    process, port = await start_service(master, args.timeout)
+    try:
+        gateway = await FakeGateway(f"127.0.0.1:{port}", args.connections).start()
+        try:
+            for path in DISPATCH_CASES:
+                await gateway.run(path, "{}", args.concurrency, args.warmup)
+                rounds = []
+                for _ in range(args.rounds):
+                    latencies, elapsed = await gateway.run(
+                        path, "{}", args.concurrency, args.duration
+                    )
+                    rounds.append(summarize(latencies, elapsed))
+                results["dispatch " + path] = median_of(rounds)
+                print_result("dispatch " + path, results["dispatch " + path])
+        finally:
+            await gateway.stop()
+    finally:
+        process.terminate()
+        await process.wait()
+    return results
+
+
+async def publish_msgs(publisher, case, count, concurrency):
+    latencies = []
+    value = b"x" * 64
+
+    async def publish_one(index):
+        started_at = time.perf_counter()
+        if case == "publish":
+            await publisher.publish(f"topic-{index % 16}", value)
+        else:
+            await publisher.publish_nowait(f"topic-{index % 16}", value)
+        latencies.append(time.perf_counter() - started_at)
+
+    # Every msg of a publish_many call gets the latency of the whole call.
+    async def publish_many(indexes):
+        started_at = time.perf_counter()
+        await publisher.publish_many(
+            [(f"topic-{index % 16}", value) for index in indexes]
+        )
+        latencies.extend([time.perf_counter() - started_at] * len(indexes))
+
+    started_at = time.perf_counter()
+    for offset in range(0, count, concurrency):
+        indexes = range(offset, min(offset + concurrency, count))
+        if case == "publish_many":
+            await publish_many(indexes)
+        else:
+            await asyncio.gather(*[publish_one(index) for index in indexes])
+    await publisher.flush()
+    return latencies, time.perf_counter() - started_at
+
+
+async def bench_publish(master, args):
+    # Read by the Config singleton, before anything here creates it.
+    os.environ["master_endpoints"] = master.endpoint()
+    os.environ["endpoint_snapshot_file"] = ""
+    os.environ["trace_sample_rate"] = "0"
+    os.environ.setdefault(
+        "SERVICE_CFG_FILE", os.path.join(ROOT_DIR, "config", "service.template.toml")
+    )
+    from maxwell.service.publisher import Publisher
+
+    results = {}
+    publisher = Publisher(options={}, loop=asyncio.get_running_loop())
+    try:
+        for case in PUBLISH_CASES:
+            await publish_msgs(publisher, case, args.concurrency * 4, args.concurrency)
+            rounds = []
+            for _ in range(args.rounds):
+                latencies, elapsed = await publish_msgs(
+                    publisher, case, args.publish_count, args.concurrency
+                )
+                rounds.append(summarize(latencies, elapsed))
+            results["publish " + case] = median_of(rounds)
+            print_result("publish " + case, results["publish " + case])
+    finally:
+        await publisher.close()
+    return results
+
+
+def print_result(name, result):
+    print(
+        "%-26s %10.0f req/s  p50 %8.3f ms  p90 %8.3f ms  p99 %8.3f ms"
+        % (name, result["rps"], result["p50_ms"], result["p90_ms"], result["p99_ms"])
+    )
+
+
+def get_env():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+# Returns the regressions against the baseline: throughput below or p99
+# latency above it by more than the thresholds.
+def compare(results, baseline, max_throughput_drop, max_latency_rise):
+    regressions = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if result["rps"] < base["rps"] * (1 - max_throughput_drop):
+            regressions.append(
+                "%s: %.0f req/s, baseline %.0f req/s"
+                % (name, result["rps"], base["rps"])
+            )
+        if result["p99_ms"] > base["p99_ms"] * (1 + max_latency_rise):
+            regressions.append(
+                "%s: p99 %.3f ms, baseline %.3f ms"
+                % (name, result["p99_ms"], base["p99_ms"])
+            )
+    return regressions
+
+
+async def run(args):
+    master = await FakeMaster().start()
+    try:
+        print(
+            "rounds: %s, duration: %ss, connections: %s, concurrency: %s"
+            % (args.rounds, args.duration, args.connections, args.concurrency)
+        )
+        results = {}
+        if args.suite in ("all", "dispatch"):
+            results.update(await bench_dispatch(master, args))
+        if args.suite in ("all", "publish"):
+            results.update(await bench_publish(master, args))
+    finally:
+        await master.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure ws dispatch and publish throughput and latencies."
+    )
+    parser.add_argument(
+        "--suite", choices=("all", "dispatch", "publish"), default="all"
+    )
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=2, help="Seconds a round.")
+    parser.add_argument("--warmup", type=float, default=0.5, help="Seconds a case.")
+    parser.add_argument("--connections", type=int, default=2)
+    parser.add_argument(
+        "--concurrency", type=int, default=64, help="Requests in flight a connection."
+    )
+    parser.add_argument("--publish-count", type=int, default=5000)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="Write the results to this json file.")
+    parser.add_argument("--baseline", help="Compare with the results in this file.")
+    parser.add_argument("--max-throughput-drop", type=float, default=0.15)
+    parser.add_argument("--max-latency-rise", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "wt") as output_file:
+            json.dump({"env": get_env(), "results": results}, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "rt") as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("env") != get_env():
+            print(
+                "Warning: the baseline was taken in another env: %s" % baseline["env"]
+            )
+        regressions = compare(
+            results, baseline, args.max_throughput_drop, args.max_latency_rise
+        )
+        for regression in regressions:
+            print("Regression: %s" % regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against %s." % args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from maxwell.service.server import Server
+from maxwell.service.service import Reply, Service
+
+service = Service()
+
+SMALL = {"ok": True}
+LARGE = [
+    {"ts": i, "open": i + 1, "high": i + 2, "low": i + 3, "close": i + 4}
+    for i in range(1000)
+]
+ENCODED_SMALL = '{"ok":true}'
+
+
+@service.ws("/v0/sync")
+def v0_sync(req):
+    return ENCODED_SMALL
+
+
+@service.ws("/v0/async")
+async def v0_async(req):
+    return ENCODED_SMALL
+
+
+@service.add_ws_route("/v1/sync/small")
+def v1_sync_small(req):
+    return Reply(payload=SMALL)
+
+
+@service.add_ws_route("/v1/async/small")
+async def v1_async_small(req):
+    return Reply(payload=SMALL)
+
+
+@service.add_ws_route("/v1/sync/large")
+def v1_sync_large(req):
+    return Reply(payload=LARGE)
+
+
+@service.add_ws_route("/v1/async/large")
+async def v1_async_large(req):
+    return Reply(payload=LARGE)
+
+
+@service.get("/ping")
+def ping():
+    return "pong"
+
+
+if __name__ == "__main__":
+    Server(f"{__name__}:service").run()
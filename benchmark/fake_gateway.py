@@ -0,0 +1,75 @@
+import asyncio
+import time
+import websockets
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+import maxwell.protocol.maxwell_protocol as protocol
+
+
+# Drives a service's /$ws the way the gateway does: req_req_t frames over a
+# few connections, with many requests in flight on each.
+class FakeGateway(object):
+    def __init__(self, endpoint, connections=1):
+        self.endpoint = endpoint
+        self.connections = connections
+        self.__websockets = []
+        self.__next_ref = 0
+
+    async def start(self):
+        for _ in range(self.connections):
+            self.__websockets.append(
+                await websockets.connect(
+                    f"ws://{self.endpoint}/$ws", max_size=None, ping_interval=None
+                )
+            )
+        return self
+
+    async def stop(self):
+        for websocket in self.__websockets:
+            await websocket.close()
+        self.__websockets = []
+
+    # Keeps concurrency requests in flight on every connection until the
+    # duration is over. Returns the latencies of the requests in seconds, and
+    # the seconds it took until the last reply arrived.
+    async def run(self, path, payload, concurrency, duration):
+        deadline = time.perf_counter() + duration
+        started_at = time.perf_counter()
+        results = await asyncio.gather(
+            *[
+                self.__drive(websocket, path, payload, concurrency, deadline)
+                for websocket in self.__websockets
+            ]
+        )
+        elapsed = time.perf_counter() - started_at
+        latencies = []
+        for connection_latencies, errors in results:
+            if errors:
+                raise RuntimeError(f"Got {errors} error replies from {path}")
+            latencies.extend(connection_latencies)
+        return latencies, elapsed
+
+    async def __drive(self, websocket, path, payload, concurrency, deadline):
+        sent_at = {}  # ref => time
+        latencies = []
+        errors = 0
+
+        async def send():
+            self.__next_ref += 1
+            req = protocol_types.req_req_t()
+            req.path = path
+            req.payload = payload
+            req.conn0_ref = 1
+            req.ref = self.__next_ref
+            sent_at[req.ref] = time.perf_counter()
+            await websocket.send(protocol.encode_msg(req))
+
+        for _ in range(concurrency):
+            await send()
+        while sent_at:
+            rep = protocol.decode_msg(await websocket.recv())
+            latencies.append(time.perf_counter() - sent_at.pop(rep.ref))
+            if rep.__class__ != protocol_types.req_rep_t:
+                errors += 1
+            if time.perf_counter() < deadline:
+                await send()
+        return latencies, errors
@@ -0,0 +1,72 @@
+import asyncio
+import time
+import websockets
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+import maxwell.protocol.maxwell_protocol as protocol
+
+
+# Just enough of a master to register services and locate topics, recording
+# when each kind of request arrived. Topics are located to itself, so it also
+# acks the pushes of publishers.
+class FakeMaster(object):
+    def __init__(self, host="127.0.0.1", port=0, checksum=1):
+        self.host = host
+        self.port = port
+        self.checksum = checksum
+        self.counts = {}
+        self.first_received_at = {}
+        self.set_routes_reqs = []
+        self.__server = None
+
+    async def start(self):
+        self.__server = await websockets.serve(
+            self.__handle, self.host, self.port, max_size=None
+        )
+        self.port = self.__server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.__server.close()
+        await self.__server.wait_closed()
+
+    def endpoint(self):
+        return f"{self.host}:{self.port}"
+
+    async def wait_for_path(self, path, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for received_at, req in self.set_routes_reqs:
+                if path in req.get_paths or path in req.ws_paths:
+                    return received_at
+            await asyncio.sleep(0.001)
+        raise TimeoutError(f"Path {path} wasn't registered in {timeout}s")
+
+    async def __handle(self, websocket):
+        try:
+            async for data in websocket:
+                req = protocol.decode_msg(data)
+                rep = self.__build_rep(req)
+                if rep is not None:
+                    rep.ref = req.ref
+                    await websocket.send(protocol.encode_msg(rep))
+        except websockets.ConnectionClosed:
+            pass
+
+    def __build_rep(self, req):
+        name = type(req).__name__
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.first_received_at.setdefault(name, time.monotonic())
+        if name == "register_service_req_t":
+            return protocol_types.register_service_rep_t()
+        elif name == "set_routes_req_t":
+            self.set_routes_reqs.append((time.monotonic(), req))
+            return protocol_types.set_routes_rep_t()
+        elif name == "locate_topic_req_t":
+            return protocol_types.locate_topic_rep_t(endpoint=self.endpoint())
+        elif name == "get_topic_dist_checksum_req_t":
+            return protocol_types.get_topic_dist_checksum_rep_t(checksum=self.checksum)
+        elif name == "push_req_t":
+            return protocol_types.push_rep_t()
+        elif name == "ping_req_t":
+            return protocol_types.ping_rep_t()
+        return None
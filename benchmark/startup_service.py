@@ -0,0 +1,13 @@
+from maxwell.service.server import Server
+from maxwell.service.service import Service
+
+service = Service()
+
+
+@service.get("/ping")
+def ping():
+    return "pong"
+
+
+if __name__ == "__main__":
+    Server(f"{__name__}:service").run()
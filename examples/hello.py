@@ -10,6 +10,7 @@ from maxwell.utils.logger import get_logger
 from maxwell.service.server import Server
 from maxwell.service.service import Service, Request, Reply
 from maxwell.service.publisher import Publisher
+from maxwell.service.result_cache import ResultCache
 
 logger = get_logger(__name__)
 
@@ -114,6 +115,26 @@ async def get_candles(req):
     return json.dumps(build_candles())
 
 
+@service.ws("/get_cached_candles", cache=ResultCache(ttl=5))
+async def get_cached_candles(req):
+    logger.debug(" %s ", req)
+    return json.dumps(build_candles())
+
+
+@service.add_ws_route("/stream_candles")
+async def stream_candles(req):
+    logger.debug(" %s ", req)
+    candles = build_candles()
+    for i in range(0, len(candles), 1000):
+        yield candles[i : i + 1000]
+
+
+@service.ws("/get_candles_in_thread", executor="thread")
+def get_candles_in_thread(req):
+    logger.debug(" %s ", req)
+    return json.dumps(build_candles())
+
+
 # ************************************************
 # publisher
 # ************************************************
@@ -0,0 +1,58 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+CODECS = ("json", "orjson", "msgspec", "raw")
+
+
+def check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError("Unknown codec: %s, must be one of %s" % (codec, CODECS))
+    if codec == "orjson" and orjson is None:
+        raise ValueError("The orjson codec requires orjson to be installed.")
+    if codec == "msgspec" and msgspec is None:
+        raise ValueError("The msgspec codec requires msgspec to be installed.")
+
+
+def encode(codec, payload):
+    return _ENCODERS[codec](payload)
+
+
+def _encode_json(payload):
+    return json.dumps(payload)
+
+
+def _encode_orjson(payload):
+    return orjson.dumps(payload)
+
+
+_msgspec_encoder = msgspec.json.Encoder() if msgspec is not None else None
+
+
+def _encode_msgspec(payload):
+    return _msgspec_encoder.encode(payload)
+
+
+def _encode_raw(payload):
+    if isinstance(payload, (str, bytes)):
+        return payload
+    raise TypeError(
+        "The raw codec only accepts str or bytes payload, got: %s" % type(payload)
+    )
+
+
+_ENCODERS = {
+    "json": _encode_json,
+    "orjson": _encode_orjson,
+    "msgspec": _encode_msgspec,
+    "raw": _encode_raw,
+}
@@ -46,6 +46,47 @@ class Config:
             self.__save_port_to_config_file(port)
         return port
 
+    # 0: serve in this process, N: serve from N supervised worker processes.
+    def get_workers(self):
+        workers = os.environ.get("workers")
+        if workers is not None:
+            return int(workers)
+        workers = self.__service_config.get("workers")
+        if workers is None or workers < 0:
+            return 0
+        else:
+            return workers
+
+    def get_worker_restart_delay(self):
+        worker_restart_delay = os.environ.get("worker_restart_delay")
+        if worker_restart_delay is not None:
+            return float(worker_restart_delay)
+        worker_restart_delay = self.__service_config.get("worker_restart_delay")
+        if worker_restart_delay is None or worker_restart_delay < 0:
+            return 1
+        else:
+            return worker_restart_delay
+
+    def get_drain_timeout(self):
+        drain_timeout = os.environ.get("drain_timeout")
+        if drain_timeout is not None:
+            return float(drain_timeout)
+        drain_timeout = self.__service_config.get("drain_timeout")
+        if drain_timeout is None or drain_timeout < 0:
+            return 30
+        else:
+            return drain_timeout
+
+    def get_reload_timeout(self):
+        reload_timeout = os.environ.get("reload_timeout")
+        if reload_timeout is not None:
+            return float(reload_timeout)
+        reload_timeout = self.__service_config.get("reload_timeout")
+        if reload_timeout is None or reload_timeout <= 0:
+            return 60
+        else:
+            return reload_timeout
+
     def get_set_routes_delay(self):
         set_routes_delay = os.environ.get("set_routes_delay")
         if set_routes_delay is not None:
@@ -56,6 +97,29 @@ class Config:
         else:
             return set_routes_delay
 
+    def get_set_routes_quiet_period(self):
+        set_routes_quiet_period = os.environ.get("set_routes_quiet_period")
+        if set_routes_quiet_period is not None:
+            return float(set_routes_quiet_period)
+        set_routes_quiet_period = self.__service_config.get("set_routes_quiet_period")
+        if set_routes_quiet_period is None or set_routes_quiet_period < 0:
+            return 0.05
+        else:
+            return set_routes_quiet_period
+
+    # "thread": the registrar runs in its own thread and loop.
+    # "loop": the registrar runs on the serving loop, driven by the lifespan.
+    def get_registrar_mode(self):
+        registrar_mode = os.environ.get("registrar_mode")
+        if registrar_mode is None:
+            registrar_mode = self.__service_config.get("registrar_mode")
+        if registrar_mode is None:
+            return "thread"
+        elif registrar_mode in ("thread", "loop"):
+            return registrar_mode
+        else:
+            raise ValueError(f"Unknown registrar_mode: {registrar_mode}")
+
     def get_proc_name(self):
         proc_name = os.environ.get("proc_name")
         if proc_name is not None:
@@ -76,6 +140,47 @@ class Config:
         else:
             return master_endpoints
 
+    def get_master_eject_threshold(self):
+        master_eject_threshold = os.environ.get("master_eject_threshold")
+        if master_eject_threshold is not None:
+            return int(master_eject_threshold)
+        master_eject_threshold = self.__service_config.get("master_eject_threshold")
+        if master_eject_threshold is None or master_eject_threshold <= 0:
+            return 3
+        else:
+            return master_eject_threshold
+
+    def get_master_eject_duration(self):
+        master_eject_duration = os.environ.get("master_eject_duration")
+        if master_eject_duration is not None:
+            return float(master_eject_duration)
+        master_eject_duration = self.__service_config.get("master_eject_duration")
+        if master_eject_duration is None or master_eject_duration <= 0:
+            return 30
+        else:
+            return master_eject_duration
+
+    # 0 disables hedging.
+    def get_master_hedge_percentile(self):
+        master_hedge_percentile = os.environ.get("master_hedge_percentile")
+        if master_hedge_percentile is not None:
+            return float(master_hedge_percentile)
+        master_hedge_percentile = self.__service_config.get("master_hedge_percentile")
+        if master_hedge_percentile is None or master_hedge_percentile <= 0:
+            return 0
+        else:
+            return min(master_hedge_percentile, 100)
+
+    def get_master_hedge_min_delay(self):
+        master_hedge_min_delay = os.environ.get("master_hedge_min_delay")
+        if master_hedge_min_delay is not None:
+            return float(master_hedge_min_delay)
+        master_hedge_min_delay = self.__service_config.get("master_hedge_min_delay")
+        if master_hedge_min_delay is None or master_hedge_min_delay <= 0:
+            return 0.005
+        else:
+            return master_hedge_min_delay
+
     def get_connection_slot_size(self):
         connection_slot_size = os.environ.get("connection_slot_size")
         if connection_slot_size is not None:
@@ -86,6 +191,55 @@ class Config:
         else:
             return connection_slot_size
 
+    def get_connection_slot_grow_threshold(self):
+        connection_slot_grow_threshold = os.environ.get(
+            "connection_slot_grow_threshold"
+        )
+        if connection_slot_grow_threshold is not None:
+            return int(connection_slot_grow_threshold)
+        connection_slot_grow_threshold = self.__service_config.get(
+            "connection_slot_grow_threshold"
+        )
+        if (
+            connection_slot_grow_threshold is None
+            or connection_slot_grow_threshold <= 0
+        ):
+            return 32
+        else:
+            return connection_slot_grow_threshold
+
+    def get_connection_slot_idle_timeout(self):
+        connection_slot_idle_timeout = os.environ.get("connection_slot_idle_timeout")
+        if connection_slot_idle_timeout is not None:
+            return float(connection_slot_idle_timeout)
+        connection_slot_idle_timeout = self.__service_config.get(
+            "connection_slot_idle_timeout"
+        )
+        if connection_slot_idle_timeout is None or connection_slot_idle_timeout <= 0:
+            return 60
+        else:
+            return connection_slot_idle_timeout
+
+    def get_publish_window_size(self):
+        publish_window_size = os.environ.get("publish_window_size")
+        if publish_window_size is not None:
+            return int(publish_window_size)
+        publish_window_size = self.__service_config.get("publish_window_size")
+        if publish_window_size is None or publish_window_size <= 0:
+            return 1024
+        else:
+            return publish_window_size
+
+    def get_publish_window_bytes(self):
+        publish_window_bytes = os.environ.get("publish_window_bytes")
+        if publish_window_bytes is not None:
+            return int(publish_window_bytes)
+        publish_window_bytes = self.__service_config.get("publish_window_bytes")
+        if publish_window_bytes is None or publish_window_bytes <= 0:
+            return 16777216
+        else:
+            return publish_window_bytes
+
     def get_endpoint_cache_size(self):
         endpoint_cache_size = os.environ.get("endpoint_cache_size")
         if endpoint_cache_size is not None:
@@ -106,6 +260,72 @@ class Config:
         else:
             return endpoint_cache_ttl
 
+    def get_endpoint_negative_cache_ttl(self):
+        endpoint_negative_cache_ttl = os.environ.get("endpoint_negative_cache_ttl")
+        if endpoint_negative_cache_ttl is not None:
+            return float(endpoint_negative_cache_ttl)
+        endpoint_negative_cache_ttl = self.__service_config.get(
+            "endpoint_negative_cache_ttl"
+        )
+        if endpoint_negative_cache_ttl is None or endpoint_negative_cache_ttl < 0:
+            return 1
+        else:
+            return endpoint_negative_cache_ttl
+
+    def get_endpoint_snapshot_file(self):
+        endpoint_snapshot_file = os.environ.get("endpoint_snapshot_file")
+        if endpoint_snapshot_file is None:
+            endpoint_snapshot_file = self.__service_config.get("endpoint_snapshot_file")
+        if endpoint_snapshot_file is None or endpoint_snapshot_file == "":
+            return None
+        elif os.path.isabs(endpoint_snapshot_file):
+            return endpoint_snapshot_file
+        else:
+            return os.path.join(self.__get_root_dir(), endpoint_snapshot_file)
+
+    def get_endpoint_snapshot_interval(self):
+        endpoint_snapshot_interval = os.environ.get("endpoint_snapshot_interval")
+        if endpoint_snapshot_interval is not None:
+            return float(endpoint_snapshot_interval)
+        endpoint_snapshot_interval = self.__service_config.get(
+            "endpoint_snapshot_interval"
+        )
+        if endpoint_snapshot_interval is None or endpoint_snapshot_interval <= 0:
+            return 60
+        else:
+            return endpoint_snapshot_interval
+
+    # How long lookups wait for the master to verify a loaded snapshot, before
+    # they go to the master themselves.
+    def get_endpoint_snapshot_verify_timeout(self):
+        endpoint_snapshot_verify_timeout = os.environ.get(
+            "endpoint_snapshot_verify_timeout"
+        )
+        if endpoint_snapshot_verify_timeout is not None:
+            return float(endpoint_snapshot_verify_timeout)
+        endpoint_snapshot_verify_timeout = self.__service_config.get(
+            "endpoint_snapshot_verify_timeout"
+        )
+        if (
+            endpoint_snapshot_verify_timeout is None
+            or endpoint_snapshot_verify_timeout < 0
+        ):
+            return 1
+        else:
+            return endpoint_snapshot_verify_timeout
+
+    def get_topic_dist_checksum_interval(self):
+        topic_dist_checksum_interval = os.environ.get("topic_dist_checksum_interval")
+        if topic_dist_checksum_interval is not None:
+            return float(topic_dist_checksum_interval)
+        topic_dist_checksum_interval = self.__service_config.get(
+            "topic_dist_checksum_interval"
+        )
+        if topic_dist_checksum_interval is None or topic_dist_checksum_interval <= 0:
+            return 10
+        else:
+            return topic_dist_checksum_interval
+
     def get_max_continuous_disconnected_times(self):
         max_continuous_disconnected_times = self.__service_config.get(
             "max_continuous_disconnected_times"
@@ -115,6 +335,262 @@ class Config:
         else:
             return max_continuous_disconnected_times
 
+    def get_ws_max_inflight_per_connection(self):
+        ws_max_inflight_per_connection = os.environ.get(
+            "ws_max_inflight_per_connection"
+        )
+        if ws_max_inflight_per_connection is not None:
+            return int(ws_max_inflight_per_connection)
+        ws_max_inflight_per_connection = self.__service_config.get(
+            "ws_max_inflight_per_connection"
+        )
+        if (
+            ws_max_inflight_per_connection is None
+            or ws_max_inflight_per_connection <= 0
+        ):
+            return 1024
+        else:
+            return ws_max_inflight_per_connection
+
+    def get_ws_max_inflight(self):
+        ws_max_inflight = os.environ.get("ws_max_inflight")
+        if ws_max_inflight is not None:
+            return int(ws_max_inflight)
+        ws_max_inflight = self.__service_config.get("ws_max_inflight")
+        if ws_max_inflight is None or ws_max_inflight <= 0:
+            return 8192
+        else:
+            return ws_max_inflight
+
+    def get_ws_max_inflight_bytes(self):
+        ws_max_inflight_bytes = os.environ.get("ws_max_inflight_bytes")
+        if ws_max_inflight_bytes is not None:
+            return int(ws_max_inflight_bytes)
+        ws_max_inflight_bytes = self.__service_config.get("ws_max_inflight_bytes")
+        if ws_max_inflight_bytes is None or ws_max_inflight_bytes <= 0:
+            return 268435456
+        else:
+            return ws_max_inflight_bytes
+
+    def get_ws_max_inflight_bytes_per_connection(self):
+        ws_max_inflight_bytes_per_connection = os.environ.get(
+            "ws_max_inflight_bytes_per_connection"
+        )
+        if ws_max_inflight_bytes_per_connection is not None:
+            return int(ws_max_inflight_bytes_per_connection)
+        ws_max_inflight_bytes_per_connection = self.__service_config.get(
+            "ws_max_inflight_bytes_per_connection"
+        )
+        if (
+            ws_max_inflight_bytes_per_connection is None
+            or ws_max_inflight_bytes_per_connection <= 0
+        ):
+            return 33554432
+        else:
+            return ws_max_inflight_bytes_per_connection
+
+    def get_ws_overload_policy(self):
+        ws_overload_policy = os.environ.get("ws_overload_policy")
+        if ws_overload_policy is None:
+            ws_overload_policy = self.__service_config.get("ws_overload_policy")
+        if ws_overload_policy is None:
+            return "pause"
+        elif ws_overload_policy in ("pause", "reject"):
+            return ws_overload_policy
+        else:
+            raise ValueError(
+                "Unknown ws_overload_policy: %s, must be pause or reject"
+                % ws_overload_policy
+            )
+
+    def get_ws_writer_high_water_mark(self):
+        ws_writer_high_water_mark = os.environ.get("ws_writer_high_water_mark")
+        if ws_writer_high_water_mark is not None:
+            return int(ws_writer_high_water_mark)
+        ws_writer_high_water_mark = self.__service_config.get(
+            "ws_writer_high_water_mark"
+        )
+        if ws_writer_high_water_mark is None or ws_writer_high_water_mark <= 0:
+            return 16777216
+        else:
+            return ws_writer_high_water_mark
+
+    def get_ws_writer_low_water_mark(self):
+        ws_writer_low_water_mark = os.environ.get("ws_writer_low_water_mark")
+        if ws_writer_low_water_mark is not None:
+            return int(ws_writer_low_water_mark)
+        ws_writer_low_water_mark = self.__service_config.get("ws_writer_low_water_mark")
+        if ws_writer_low_water_mark is None or ws_writer_low_water_mark < 0:
+            return self.get_ws_writer_high_water_mark() // 4
+        else:
+            return ws_writer_low_water_mark
+
+    def get_ws_codec(self):
+        ws_codec = os.environ.get("ws_codec")
+        if ws_codec is not None:
+            return ws_codec
+        ws_codec = self.__service_config.get("ws_codec")
+        if ws_codec is None:
+            return "json"
+        else:
+            return ws_codec
+
+    def get_ws_cache_ttl(self):
+        ws_cache_ttl = os.environ.get("ws_cache_ttl")
+        if ws_cache_ttl is not None:
+            return float(ws_cache_ttl)
+        ws_cache_ttl = self.__service_config.get("ws_cache_ttl")
+        if ws_cache_ttl is None or ws_cache_ttl <= 0:
+            return 5
+        else:
+            return ws_cache_ttl
+
+    def get_ws_cache_max_entries(self):
+        ws_cache_max_entries = os.environ.get("ws_cache_max_entries")
+        if ws_cache_max_entries is not None:
+            return int(ws_cache_max_entries)
+        ws_cache_max_entries = self.__service_config.get("ws_cache_max_entries")
+        if ws_cache_max_entries is None or ws_cache_max_entries <= 0:
+            return 1024
+        else:
+            return ws_cache_max_entries
+
+    def get_ws_cache_max_bytes(self):
+        ws_cache_max_bytes = os.environ.get("ws_cache_max_bytes")
+        if ws_cache_max_bytes is not None:
+            return int(ws_cache_max_bytes)
+        ws_cache_max_bytes = self.__service_config.get("ws_cache_max_bytes")
+        if ws_cache_max_bytes is None or ws_cache_max_bytes <= 0:
+            return 67108864
+        else:
+            return ws_cache_max_bytes
+
+    def get_executor_thread_pool_size(self):
+        executor_thread_pool_size = os.environ.get("executor_thread_pool_size")
+        if executor_thread_pool_size is not None:
+            return int(executor_thread_pool_size)
+        executor_thread_pool_size = self.__service_config.get(
+            "executor_thread_pool_size"
+        )
+        if executor_thread_pool_size is None or executor_thread_pool_size <= 0:
+            return min(32, (os.cpu_count() or 1) + 4)
+        else:
+            return executor_thread_pool_size
+
+    def get_executor_process_pool_size(self):
+        executor_process_pool_size = os.environ.get("executor_process_pool_size")
+        if executor_process_pool_size is not None:
+            return int(executor_process_pool_size)
+        executor_process_pool_size = self.__service_config.get(
+            "executor_process_pool_size"
+        )
+        if executor_process_pool_size is None or executor_process_pool_size <= 0:
+            return os.cpu_count() or 1
+        else:
+            return executor_process_pool_size
+
+    def get_executor_shm_threshold(self):
+        executor_shm_threshold = os.environ.get("executor_shm_threshold")
+        if executor_shm_threshold is not None:
+            return int(executor_shm_threshold)
+        executor_shm_threshold = self.__service_config.get("executor_shm_threshold")
+        if executor_shm_threshold is None or executor_shm_threshold < 0:
+            return 1048576
+        else:
+            return executor_shm_threshold
+
+    def get_loop_lag_threshold(self):
+        loop_lag_threshold = os.environ.get("loop_lag_threshold")
+        if loop_lag_threshold is not None:
+            return float(loop_lag_threshold)
+        loop_lag_threshold = self.__service_config.get("loop_lag_threshold")
+        if loop_lag_threshold is None or loop_lag_threshold <= 0:
+            return 0.1
+        else:
+            return loop_lag_threshold
+
+    def get_loop_monitor_interval(self):
+        loop_monitor_interval = os.environ.get("loop_monitor_interval")
+        if loop_monitor_interval is not None:
+            return float(loop_monitor_interval)
+        loop_monitor_interval = self.__service_config.get("loop_monitor_interval")
+        if loop_monitor_interval is None or loop_monitor_interval <= 0:
+            return 0.05
+        else:
+            return loop_monitor_interval
+
+    def get_profile_dir(self):
+        profile_dir = os.environ.get("profile_dir")
+        if profile_dir is None:
+            profile_dir = self.__service_config.get("profile_dir")
+        if profile_dir is None or profile_dir == "":
+            return self.__get_log_dir()
+        elif os.path.isabs(profile_dir):
+            return profile_dir
+        else:
+            return os.path.join(self.__get_root_dir(), profile_dir)
+
+    def get_profile_duration(self):
+        profile_duration = os.environ.get("profile_duration")
+        if profile_duration is not None:
+            return float(profile_duration)
+        profile_duration = self.__service_config.get("profile_duration")
+        if profile_duration is None or profile_duration <= 0:
+            return 30
+        else:
+            return profile_duration
+
+    def get_profile_sample_interval(self):
+        profile_sample_interval = os.environ.get("profile_sample_interval")
+        if profile_sample_interval is not None:
+            return float(profile_sample_interval)
+        profile_sample_interval = self.__service_config.get("profile_sample_interval")
+        if profile_sample_interval is None or profile_sample_interval <= 0:
+            return 0.005
+        else:
+            return profile_sample_interval
+
+    def get_trace_sample_rate(self):
+        trace_sample_rate = os.environ.get("trace_sample_rate")
+        if trace_sample_rate is not None:
+            return float(trace_sample_rate)
+        trace_sample_rate = self.__service_config.get("trace_sample_rate")
+        if trace_sample_rate is None or trace_sample_rate < 0:
+            return 0
+        else:
+            return min(trace_sample_rate, 1)
+
+    def get_trace_buffer_size(self):
+        trace_buffer_size = os.environ.get("trace_buffer_size")
+        if trace_buffer_size is not None:
+            return int(trace_buffer_size)
+        trace_buffer_size = self.__service_config.get("trace_buffer_size")
+        if trace_buffer_size is None or trace_buffer_size <= 0:
+            return 1024
+        else:
+            return trace_buffer_size
+
+    def get_trace_file(self):
+        trace_file = os.environ.get("trace_file")
+        if trace_file is None:
+            trace_file = self.__service_config.get("trace_file")
+        if trace_file is None or trace_file == "":
+            return None
+        elif os.path.isabs(trace_file):
+            return trace_file
+        else:
+            return os.path.join(self.__get_root_dir(), trace_file)
+
+    def get_trace_queue_size(self):
+        trace_queue_size = os.environ.get("trace_queue_size")
+        if trace_queue_size is not None:
+            return int(trace_queue_size)
+        trace_queue_size = self.__service_config.get("trace_queue_size")
+        if trace_queue_size is None or trace_queue_size <= 0:
+            return 1024
+        else:
+            return trace_queue_size
+
     def get_log_config(self):
         return self.__log_config
 
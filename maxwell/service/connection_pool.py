@@ -0,0 +1,121 @@
+import asyncio
+import random
+import time
+from maxwell.utils.connection import Connection, Event
+from maxwell.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Slot(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.outstanding = 0
+        self.requests = 0
+        self.last_used_at = time.monotonic()
+
+
+class ConnectionPool(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(
+        self, endpoint, options, loop, max_size, grow_threshold, on_disconnected
+    ):
+        self.__endpoint = endpoint
+        self.__options = options
+        self.__loop = loop
+        self.__max_size = max_size
+        self.__grow_threshold = grow_threshold
+        self.__on_disconnected = on_disconnected
+
+        self.__slots = []
+
+    async def close(self):
+        slots = self.__slots
+        self.__slots = []
+        for slot in slots:
+            await self.__close_slot(slot)
+
+    def endpoint(self):
+        return self.__endpoint
+
+    async def request(self, msg):
+        slot = self.__pick_slot()
+        slot.outstanding += 1
+        slot.requests += 1
+        try:
+            await slot.connection.wait_open()
+            return await slot.connection.request(msg)
+        finally:
+            slot.outstanding -= 1
+            slot.last_used_at = time.monotonic()
+
+    async def reap_idle_slots(self, idle_timeout):
+        now = time.monotonic()
+        idle_slots = [
+            slot
+            for slot in self.__slots
+            if slot.outstanding == 0 and now - slot.last_used_at >= idle_timeout
+        ]
+        for slot in idle_slots:
+            self.__slots.remove(slot)
+        for slot in idle_slots:
+            logger.info("Reaping idle slot: endpoint: %s", self.__endpoint)
+            await self.__close_slot(slot)
+        return len(idle_slots)
+
+    def size(self):
+        return len(self.__slots)
+
+    def get_stats(self):
+        now = time.monotonic()
+        return [
+            {
+                "outstanding": slot.outstanding,
+                "requests": slot.requests,
+                "idle": now - slot.last_used_at if slot.outstanding == 0 else 0,
+            }
+            for slot in self.__slots
+        ]
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __pick_slot(self):
+        # Power of two choices: the less loaded one of two random slots, and a new
+        # slot is only opened once even that one is busy enough.
+        slots = self.__slots
+        if len(slots) == 0:
+            return self.__open_slot()
+        if len(slots) == 1:
+            slot = slots[0]
+        else:
+            slot0, slot1 = random.sample(slots, 2)
+            slot = slot0 if slot0.outstanding <= slot1.outstanding else slot1
+        if slot.outstanding >= self.__grow_threshold and len(slots) < self.__max_size:
+            return self.__open_slot()
+        return slot
+
+    def __open_slot(self):
+        connection = Connection(
+            endpoint=self.__endpoint, options=self.__options, loop=self.__loop
+        )
+        connection.add_listener(
+            event=Event.ON_DISCONNECTED, callback=self.__on_disconnected
+        )
+        slot = Slot(connection)
+        self.__slots.append(slot)
+        logger.info(
+            "Opened slot: endpoint: %s, size: %s", self.__endpoint, len(self.__slots)
+        )
+        return slot
+
+    async def __close_slot(self, slot):
+        slot.connection.delete_listener(
+            event=Event.ON_DISCONNECTED, callback=self.__on_disconnected
+        )
+        try:
+            await slot.connection.close()
+        except Exception as e:
+            logger.warning("Failed to close slot: %s", e)
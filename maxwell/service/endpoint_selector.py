@@ -0,0 +1,123 @@
+import collections
+import math
+import time
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.rtt = None  # ewma, in seconds
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0
+
+
+class EndpointSelector(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, endpoints, eject_threshold, eject_duration, alpha=0.2):
+        self.__endpoints = endpoints
+        self.__eject_threshold = eject_threshold
+        self.__eject_duration = eject_duration
+        self.__alpha = alpha
+
+        self.__stats = {endpoint: EndpointStats() for endpoint in endpoints}
+        self.__rtts = collections.deque(maxlen=256)
+        self.__next_index = 0
+
+    # Picks the healthy endpoint with the lowest rtt. Endpoints never measured
+    # yet are tried first, in the configured order, to get to know them.
+    def pick(self, exclude=None):
+        now = time.monotonic()
+        candidates = [
+            endpoint
+            for endpoint in self.__endpoints
+            if endpoint != exclude and self.__stats[endpoint].ejected_until <= now
+        ]
+        if len(candidates) == 0:
+            # Everything is ejected, fall back to round robin rather than stall.
+            candidates = [
+                endpoint for endpoint in self.__endpoints if endpoint != exclude
+            ]
+            if len(candidates) == 0:
+                return None
+            endpoint = candidates[self.__next_index % len(candidates)]
+            self.__next_index += 1
+            return endpoint
+        return min(
+            candidates,
+            key=lambda endpoint: (
+                self.__stats[endpoint].rtt is not None,
+                self.__stats[endpoint].rtt or 0,
+            ),
+        )
+
+    def record_success(self, endpoint, rtt):
+        stats = self.__stats.get(endpoint)
+        if stats is None:
+            return
+        stats.requests += 1
+        stats.consecutive_failures = 0
+        if stats.rtt is None:
+            stats.rtt = rtt
+        else:
+            stats.rtt += self.__alpha * (rtt - stats.rtt)
+        self.__rtts.append(rtt)
+
+    # A request given up on after elapsed seconds took at least that long, which
+    # is all that is known about it.
+    def record_abandoned(self, endpoint, elapsed):
+        stats = self.__stats.get(endpoint)
+        if stats is None:
+            return
+        if stats.rtt is None:
+            stats.rtt = elapsed
+        elif elapsed > stats.rtt:
+            stats.rtt += self.__alpha * (elapsed - stats.rtt)
+
+    def record_failure(self, endpoint):
+        stats = self.__stats.get(endpoint)
+        if stats is None:
+            return
+        stats.requests += 1
+        stats.failures += 1
+        stats.consecutive_failures += 1
+        if stats.consecutive_failures >= self.__eject_threshold:
+            self.eject(endpoint)
+
+    def eject(self, endpoint):
+        stats = self.__stats.get(endpoint)
+        if stats is None:
+            return
+        stats.consecutive_failures = 0
+        stats.ejected_until = time.monotonic() + self.__eject_duration
+
+    def is_ejected(self, endpoint):
+        stats = self.__stats.get(endpoint)
+        return stats is not None and stats.ejected_until > time.monotonic()
+
+    # Only endpoints which were both measured are compared.
+    def is_much_faster(self, endpoint, other_endpoint, factor=2):
+        rtt = self.__stats[endpoint].rtt
+        other_rtt = self.__stats[other_endpoint].rtt
+        return rtt is not None and other_rtt is not None and rtt * factor < other_rtt
+
+    def get_rtt_percentile(self, percentile):
+        if len(self.__rtts) == 0:
+            return None
+        rtts = sorted(self.__rtts)
+        index = min(len(rtts) - 1, math.ceil(len(rtts) * percentile / 100) - 1)
+        return rtts[max(index, 0)]
+
+    def get_stats(self):
+        now = time.monotonic()
+        return {
+            endpoint: {
+                "rtt": stats.rtt,
+                "requests": stats.requests,
+                "failures": stats.failures,
+                "ejected": stats.ejected_until > now,
+            }
+            for endpoint, stats in self.__stats.items()
+        }
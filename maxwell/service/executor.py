@@ -0,0 +1,165 @@
+import asyncio
+import contextvars
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from maxwell.utils.logger import get_logger
+
+from .config import Config
+
+logger = get_logger(__name__)
+
+
+MODES = ("thread", "process")
+
+
+class SharedMemoryRef(object):
+    def __init__(self, name, size, is_str):
+        self.name = name
+        self.size = size
+        self.is_str = is_str
+
+
+class Executor(object):
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self):
+        self.__thread_pool = None
+        self.__process_pool = None
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def singleton():
+        with Executor.__instance_lock:
+            if Executor.__instance is None:
+                Executor.__instance = Executor()
+            return Executor.__instance
+
+    @staticmethod
+    def check_mode(mode):
+        if mode is not None and mode not in MODES:
+            raise ValueError("Unknown executor: %s, must be one of %s" % (mode, MODES))
+
+    async def run(self, mode, func, *args):
+        loop = asyncio.get_running_loop()
+        if mode == "thread":
+            # Like asyncio.to_thread, so e.g. the current trace is seen by func.
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(
+                self.__get_thread_pool(), context.run, func, *args
+            )
+        elif mode == "process":
+            result = await loop.run_in_executor(
+                self.__get_process_pool(),
+                _run_in_process,
+                func,
+                args,
+                Config.singleton().get_executor_shm_threshold(),
+            )
+            return _unpack(result)
+        else:
+            raise ValueError("Unknown executor: %s" % mode)
+
+    def shutdown(self, wait=True):
+        with self.__lock:
+            thread_pool, self.__thread_pool = self.__thread_pool, None
+            process_pool, self.__process_pool = self.__process_pool, None
+        if thread_pool is not None:
+            thread_pool.shutdown(wait=wait, cancel_futures=True)
+        if process_pool is not None:
+            process_pool.shutdown(wait=wait, cancel_futures=True)
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __get_thread_pool(self):
+        if self.__thread_pool is None:
+            with self.__lock:
+                if self.__thread_pool is None:
+                    self.__thread_pool = ThreadPoolExecutor(
+                        max_workers=Config.singleton().get_executor_thread_pool_size(),
+                        thread_name_prefix="ws-executor",
+                    )
+        return self.__thread_pool
+
+    def __get_process_pool(self):
+        if self.__process_pool is None:
+            with self.__lock:
+                if self.__process_pool is None:
+                    # Forking a process which runs an event loop and other threads
+                    # is unsafe, so always spawn fresh interpreters.
+                    self.__process_pool = ProcessPoolExecutor(
+                        max_workers=Config.singleton().get_executor_process_pool_size(),
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self.__process_pool
+
+
+# ===========================================
+# process side helpers
+# ===========================================
+def _run_in_process(func, args, shm_threshold):
+    return _pack(func(*args), shm_threshold)
+
+
+def _pack(value, shm_threshold):
+    if isinstance(value, tuple):
+        return tuple(_pack(item, shm_threshold) for item in value)
+    if isinstance(value, str):
+        # Up to 4 bytes per char, only the longer ones are worth encoding to
+        # compare their size in bytes.
+        if len(value) * 4 < shm_threshold:
+            return value
+        data = value.encode("utf-8")
+        if len(data) < shm_threshold:
+            return value
+        return _write_to_shm(data, True)
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) < shm_threshold:
+            return value
+        return _write_to_shm(value, False)
+    return value
+
+
+def _write_to_shm(data, is_str):
+    shm = _create_untracked_shm(max(len(data), 1))
+    try:
+        shm.buf[: len(data)] = data
+        return SharedMemoryRef(shm.name, len(data), is_str)
+    finally:
+        shm.close()
+
+
+# The parent owns the segment once it is written, and unlinks it after reading.
+# So the pool worker mustn't track it, or its resource tracker would warn about
+# a leak and unlink the segment again when the worker exits.
+def _create_untracked_shm(size):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unpack(value):
+    if isinstance(value, tuple):
+        return tuple(_unpack(item) for item in value)
+    if isinstance(value, SharedMemoryRef):
+        return _read_from_shm(value)
+    return value
+
+
+def _read_from_shm(ref):
+    shm = shared_memory.SharedMemory(name=ref.name)
+    try:
+        data = bytes(shm.buf[: ref.size])
+    finally:
+        shm.close()
+        shm.unlink()
+    return data.decode("utf-8") if ref.is_str else data
@@ -0,0 +1,74 @@
+import asyncio
+import collections
+
+
+class InflightLimiter(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, max_count, max_bytes):
+        self.__max_count = max_count
+        self.__max_bytes = max_bytes
+
+        self.__count = 0
+        self.__bytes = 0
+        self.__waiters = collections.deque()  # [(future, size), ...]
+
+    def try_acquire(self, size):
+        if self.__waiters or not self.__has_room(size):
+            return False
+        self.__count += 1
+        self.__bytes += size
+        return True
+
+    async def acquire(self, size):
+        if self.try_acquire(size):
+            return
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, size)
+        self.__waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(size)
+            else:
+                self.__waiters.remove(waiter)
+            raise
+
+    def release(self, size):
+        self.__count -= 1
+        self.__bytes -= size
+        self.__wake_up_waiters()
+
+    def get_count(self):
+        return self.__count
+
+    def get_bytes(self):
+        return self.__bytes
+
+    def get_waiting_count(self):
+        return len(self.__waiters)
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __has_room(self, size):
+        if self.__count >= self.__max_count:
+            return False
+        # A single oversized msg is still admitted when nothing else is in flight,
+        # otherwise it could never be handled.
+        return self.__count == 0 or self.__bytes + size <= self.__max_bytes
+
+    def __wake_up_waiters(self):
+        while self.__waiters:
+            future, size = self.__waiters[0]
+            if future.done():
+                self.__waiters.popleft()
+                continue
+            if not self.__has_room(size):
+                break
+            self.__waiters.popleft()
+            self.__count += 1
+            self.__bytes += size
+            future.set_result(None)
@@ -0,0 +1,157 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from maxwell.utils.logger import get_logger
+
+from .metrics import Metrics
+from .profiler import UNTAGGED
+
+logger = get_logger(__name__)
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+loop_lag = Metrics.singleton().histogram(
+    "maxwell_loop_lag_seconds",
+    "How late the serving loop woke up for a scheduled tick.",
+    buckets=LAG_BUCKETS,
+)
+loop_blocked = Metrics.singleton().counter(
+    "maxwell_loop_blocked_total",
+    "Times the serving loop was blocked beyond loop_lag_threshold, by the ws "
+    "path or http route running.",
+    ("path",),
+)
+slow_handlers = Metrics.singleton().counter(
+    "maxwell_slow_handler_total",
+    "Sync ws handler calls which ran inline beyond loop_lag_threshold, by path.",
+    ("path",),
+)
+
+
+class LoopMonitor(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    # The tag_frame(frame) returns the ws path or http route which the frame
+    # is handling, or None.
+    def __init__(self, interval, threshold, tag_frame=lambda frame: None):
+        self.__interval = interval
+        self.__threshold = threshold
+        self.__tag_frame = tag_frame
+
+        self.__loop = None
+        self.__thread_id = None
+        self.__beat_at = 0
+        self.__reported_beat_at = None
+        self.__beat_task = None
+        self.__watchdog = None
+        self.__stop_event = threading.Event()
+
+        self.__lag = loop_lag.labels()
+        self.__max_lag = 0
+        self.__blocked = 0
+        self.__slow_handlers = 0
+
+    # Starts monitoring the calling loop.
+    def start(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__thread_id = threading.get_ident()
+        self.__beat_at = time.monotonic()
+        self.__stop_event.clear()
+        self.__beat_task = self.__loop.create_task(self.__repeat_beat())
+        self.__watchdog = threading.Thread(
+            target=self.__repeat_watch, name="loop-watchdog", daemon=True
+        )
+        self.__watchdog.start()
+
+    async def stop(self):
+        self.__stop_event.set()
+        if self.__beat_task is not None:
+            self.__beat_task.cancel()
+            try:
+                await self.__beat_task
+            except asyncio.CancelledError:
+                pass
+            self.__beat_task = None
+        if self.__watchdog is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.__watchdog.join)
+            self.__watchdog = None
+
+    # Called after a sync handler ran inline on the loop.
+    def check_handler(self, path, duration):
+        if duration < self.__threshold:
+            return
+        self.__slow_handlers += 1
+        slow_handlers.labels(path).inc()
+        logger.warning(
+            "Slow handler blocked the loop: path: %s, duration: %.3fs",
+            path,
+            duration,
+            extra={"event": "slow_handler", "path": path, "duration": duration},
+        )
+
+    def get_stats(self):
+        return {
+            "max_lag": self.__max_lag,
+            "blocked": self.__blocked,
+            "slow_handlers": self.__slow_handlers,
+        }
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    async def __repeat_beat(self):
+        while True:
+            expected_at = time.monotonic() + self.__interval
+            await asyncio.sleep(self.__interval)
+            now = time.monotonic()
+            self.__beat_at = now
+            lag = max(now - expected_at, 0)
+            self.__lag.observe(lag)
+            if lag > self.__max_lag:
+                self.__max_lag = lag
+
+    def __repeat_watch(self):
+        while not self.__stop_event.wait(self.__interval / 2):
+            beat_at = self.__beat_at
+            blocked_for = time.monotonic() - beat_at - self.__interval
+            # Reports each stall once, while the blocking code is still on the
+            # loop thread's stack.
+            if blocked_for < self.__threshold or beat_at == self.__reported_beat_at:
+                continue
+            self.__reported_beat_at = beat_at
+            frame = sys._current_frames().get(self.__thread_id)
+            if frame is None:
+                continue
+            self.__report_blocked(frame, blocked_for)
+
+    def __report_blocked(self, frame, blocked_for):
+        path = self.__find_tag(frame)
+        stack = "".join(traceback.format_stack(frame))
+        self.__blocked += 1
+        loop_blocked.labels(path).inc()
+        logger.warning(
+            "Loop blocked: path: %s, blocked_for: %.3fs, stack:\n%s",
+            path,
+            blocked_for,
+            stack,
+            extra={
+                "event": "loop_blocked",
+                "path": path,
+                "blocked_for": blocked_for,
+                "stack": stack,
+            },
+        )
+
+    def __find_tag(self, frame):
+        while frame is not None:
+            try:
+                tag = self.__tag_frame(frame)
+            except Exception:
+                tag = None
+            if tag is not None:
+                return tag
+            frame = frame.f_back
+        return UNTAGGED
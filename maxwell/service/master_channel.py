@@ -0,0 +1,422 @@
+import asyncio
+import collections
+import threading
+import time
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+from maxwell.utils.connection import (
+    Connection,
+    Error,
+    ErrorCode,
+    Event,
+    MultiAltEndpointsConnection,
+)
+from maxwell.utils.logger import get_logger
+
+from .config import Config
+from .endpoint_selector import EndpointSelector
+
+logger = get_logger(__name__)
+
+# Reads which are safe to send to two masters at once.
+HEDGEABLE_MSG_TYPES = (
+    protocol_types.locate_topic_req_t,
+    protocol_types.get_topic_dist_checksum_req_t,
+)
+
+# How long requests still in flight on a switched away connection may take.
+SWITCH_GRACE_PERIOD = 10
+
+
+class MasterChannel(object):
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, endpoints, options):
+        self.__endpoints = endpoints
+        self.__options = options
+
+        self.__ref_count = 0
+        self.__clients = set()
+
+        self.__selector = EndpointSelector(
+            endpoints,
+            Config.singleton().get_master_eject_threshold(),
+            Config.singleton().get_master_eject_duration(),
+        )
+        self.__hedge_percentile = Config.singleton().get_master_hedge_percentile()
+        self.__hedge_min_delay = Config.singleton().get_master_hedge_min_delay()
+        self.__hedge_connection = None
+        self.__hedged = 0
+        self.__hedge_wins = 0
+        self.__switches = 0
+
+        # The connection lives on a loop of its own, so it can be shared by the
+        # components running on any other loop or thread.
+        self.__loop = asyncio.new_event_loop()
+        self.__connection = None
+        self.__retired_connections = set()
+        self.__is_open = False
+        # event => [(callback, loop), ...]
+        self.__listeners = collections.OrderedDict()
+        self.__requests = {}  # caller's future => task
+        self.__started_event = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run, name="master-channel", daemon=True
+        )
+        self.__thread.start()
+        self.__started_event.wait()
+
+    @staticmethod
+    def acquire(endpoints, options, client):
+        with MasterChannel.__instance_lock:
+            if MasterChannel.__instance is None:
+                MasterChannel.__instance = MasterChannel(endpoints, options)
+            channel = MasterChannel.__instance
+            # The channel is shared, a client can't have masters of its own.
+            if endpoints != channel.__endpoints or options != channel.__options:
+                logger.warning(
+                    "Ignored master channel args: endpoints: %s, options: %s, "
+                    "in use: endpoints: %s, options: %s",
+                    endpoints,
+                    options,
+                    channel.__endpoints,
+                    channel.__options,
+                )
+            channel.__ref_count += 1
+            channel.__clients.add(client)
+            return channel
+
+    async def release(self, client):
+        with MasterChannel.__instance_lock:
+            self.__clients.discard(client)
+            self.__ref_count -= 1
+            if self.__ref_count > 0:
+                return
+            if MasterChannel.__instance is self:
+                MasterChannel.__instance = None
+        await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self.__close(), self.__loop)
+        )
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+    # The callback is called on the given loop. An event is handed over to
+    # each loop once, for all of its callbacks.
+    def add_connection_listener(self, event, callback, loop):
+        self.__loop.call_soon_threadsafe(
+            self.__add_connection_listener, event, callback, loop
+        )
+
+    def delete_connection_listener(self, event, callback, loop):
+        self.__loop.call_soon_threadsafe(
+            self.__delete_connection_listener, event, callback, loop
+        )
+
+    # Returns a future of the given loop. The request is handed over to the
+    # channel's loop, and its result back, without another future in between.
+    # Cancelling the future cancels the request.
+    def request(self, msg, loop):
+        future = loop.create_future()
+        future.add_done_callback(self.__on_request_done)
+        self.__loop.call_soon_threadsafe(self.__start_request, msg, future, loop)
+        return future
+
+    # Snapshots the stats on the channel's loop, can be awaited from any loop.
+    async def get_stats(self):
+        with MasterChannel.__instance_lock:
+            clients = list(self.__clients)
+        stats = await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self.__get_stats(), self.__loop)
+        )
+        stats["clients"] = [client.get_stats() for client in clients]
+        return stats
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __run(self):
+        asyncio.set_event_loop(self.__loop)
+        self.__connection = self.__open_connection()
+        self.__loop.call_soon(self.__started_event.set)
+        try:
+            self.__loop.run_forever()
+        finally:
+            self.__loop.close()
+            logger.info("Closed master channel.")
+
+    async def __close(self):
+        await self.__connection.close()
+        for connection in list(self.__retired_connections):
+            await self.__close_retired_connection(connection)
+        if self.__hedge_connection is not None:
+            await self.__hedge_connection.close()
+            self.__hedge_connection = None
+        # Requests nobody waits for any more, e.g. ones a master never answered.
+        tasks = asyncio.all_tasks(self.__loop) - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __get_stats(self):
+        return {
+            "endpoint": self.__connection.endpoint(),
+            "is_open": self.__is_open,
+            "ref_count": self.__ref_count,
+            "requests": len(self.__requests),
+            "switches": self.__switches,
+            "hedged": self.__hedged,
+            "hedge_wins": self.__hedge_wins,
+            "endpoints": self.__selector.get_stats(),
+        }
+
+    def __start_request(self, msg, future, loop):
+        if future.cancelled():
+            return
+        task = self.__loop.create_task(self.__request(msg))
+        self.__requests[future] = task
+        task.add_done_callback(lambda task: self.__finish_request(task, future, loop))
+
+    def __finish_request(self, task, future, loop):
+        self.__requests.pop(future, None)
+        try:
+            loop.call_soon_threadsafe(_copy_result, task, future)
+        except RuntimeError as e:
+            logger.warning("Failed to hand over the reply: %s", e)
+
+    # Called on the caller's loop.
+    def __on_request_done(self, future):
+        if not future.cancelled():
+            return
+        try:
+            self.__loop.call_soon_threadsafe(self.__cancel_request, future)
+        except RuntimeError:
+            pass
+
+    def __cancel_request(self, future):
+        task = self.__requests.pop(future, None)
+        if task is not None:
+            task.cancel()
+
+    def __open_connection(self):
+        connection = MultiAltEndpointsConnection(
+            pick_endpoint=self.__pick_endpoint,
+            options=self.__options,
+            loop=self.__loop,
+        )
+        # Events of a connection which was already switched away from are dropped.
+        connection.add_listener(
+            Event.ON_CONNECTED,
+            lambda *argv, **kwargs: self.__on_connected(connection),
+        )
+        connection.add_listener(
+            Event.ON_DISCONNECTED,
+            lambda *argv, **kwargs: self.__on_disconnected(connection),
+        )
+        connection.add_listener(
+            Event.ON_ERROR,
+            lambda error_code, _, endpoint_connection: self.__on_error(
+                connection, error_code, endpoint_connection
+            ),
+        )
+        return connection
+
+    def __add_connection_listener(self, event, callback, loop):
+        self.__listeners.setdefault(event, []).append((callback, loop))
+        # Late joiners still get to know the channel is already connected.
+        if event == Event.ON_CONNECTED and self.__is_open:
+            self.__call_listeners(loop, [callback])
+
+    def __delete_connection_listener(self, event, callback, loop):
+        try:
+            self.__listeners.get(event, []).remove((callback, loop))
+        except ValueError:
+            pass
+
+    def __notify(self, event):
+        loop_callbacks = {}  # loop => [callback, ...]
+        for callback, loop in self.__listeners.get(event, []):
+            loop_callbacks.setdefault(loop, []).append(callback)
+        for loop, callbacks in loop_callbacks.items():
+            self.__call_listeners(loop, callbacks)
+
+    def __call_listeners(self, loop, callbacks):
+        try:
+            loop.call_soon_threadsafe(_call_listeners, callbacks, self.__connection)
+        except RuntimeError as e:
+            logger.warning("Failed to notify: %s", e)
+
+    def __on_connected(self, connection):
+        if connection is not self.__connection:
+            return
+        self.__is_open = True
+        self.__notify(Event.ON_CONNECTED)
+
+    def __on_disconnected(self, connection):
+        if connection is not self.__connection:
+            return
+        self.__is_open = False
+        self.__notify(Event.ON_DISCONNECTED)
+
+    def __on_error(self, connection, error_code, endpoint_connection):
+        if connection is not self.__connection:
+            return
+        # An endpoint which can't even be connected to is ejected right away.
+        if error_code == ErrorCode.FAILED_TO_CONNECT:
+            self.__selector.eject(endpoint_connection.endpoint())
+
+    async def __request(self, msg):
+        await self.__connection.wait_open()
+        if self.__hedge_percentile > 0 and isinstance(msg, HEDGEABLE_MSG_TYPES):
+            return await self.__hedged_request(msg)
+        return await self.__timed_request(self.__connection, msg)
+
+    async def __timed_request(self, connection, msg):
+        await connection.wait_open()
+        endpoint = connection.endpoint()
+        start_at = time.monotonic()
+        try:
+            rep = await connection.request(msg)
+        except Error as e:
+            # An error reply still proves the endpoint is alive.
+            if isinstance(e.code, ErrorCode):
+                self.__on_request_failed(endpoint)
+            else:
+                self.__on_request_succeeded(endpoint, time.monotonic() - start_at)
+            raise
+        except asyncio.CancelledError:
+            self.__selector.record_abandoned(endpoint, time.monotonic() - start_at)
+            self.__switch_if_better()
+            raise
+        except Exception:
+            self.__on_request_failed(endpoint)
+            raise
+        self.__on_request_succeeded(endpoint, time.monotonic() - start_at)
+        return rep
+
+    async def __hedged_request(self, msg):
+        # Sends the same read to a second master if the first one hasn't replied
+        # within the configured rtt percentile, or failed before that, the first
+        # reply wins.
+        primary = self.__loop.create_task(self.__timed_request(self.__connection, msg))
+        delay = max(
+            self.__selector.get_rtt_percentile(self.__hedge_percentile) or 0,
+            self.__hedge_min_delay,
+        )
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done and primary.exception() is None:
+            return primary.result()
+        hedge_connection = self.__get_hedge_connection()
+        if hedge_connection is None:
+            return await primary
+
+        self.__hedged += 1
+        hedge_msg = type(msg)()
+        hedge_msg.CopyFrom(msg)
+        hedge = self.__loop.create_task(
+            self.__timed_request(hedge_connection, hedge_msg)
+        )
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.__hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def __get_hedge_connection(self):
+        current_endpoint = self.__connection.endpoint()
+        if self.__hedge_connection is not None:
+            endpoint = self.__hedge_connection.endpoint()
+            if endpoint != current_endpoint and not self.__selector.is_ejected(
+                endpoint
+            ):
+                return self.__hedge_connection
+            self.__loop.create_task(self.__hedge_connection.close())
+            self.__hedge_connection = None
+        endpoint = self.__selector.pick(exclude=current_endpoint)
+        if endpoint is None:
+            return None
+        self.__hedge_connection = Connection(
+            endpoint=endpoint, options=self.__options, loop=self.__loop
+        )
+        return self.__hedge_connection
+
+    def __on_request_succeeded(self, endpoint, rtt):
+        self.__selector.record_success(endpoint, rtt)
+        self.__switch_if_better()
+
+    def __on_request_failed(self, endpoint):
+        self.__selector.record_failure(endpoint)
+        self.__switch_if_better()
+
+    def __switch_if_better(self):
+        current_endpoint = self.__connection.endpoint()
+        if current_endpoint is None:
+            return
+        endpoint = self.__selector.pick()
+        if endpoint is None or endpoint == current_endpoint:
+            return
+        if not self.__selector.is_ejected(
+            current_endpoint
+        ) and not self.__selector.is_much_faster(endpoint, current_endpoint):
+            return
+
+        logger.info(
+            "Switching master: from: %s, to: %s, endpoints: %s",
+            current_endpoint,
+            endpoint,
+            self.__selector.get_stats(),
+        )
+        self.__switches += 1
+        old_connection = self.__connection
+        self.__connection = self.__open_connection()
+        if self.__is_open:
+            self.__is_open = False
+            self.__notify(Event.ON_DISCONNECTED)
+        # Give the requests still in flight on the old connection time to finish.
+        self.__retired_connections.add(old_connection)
+        self.__loop.call_later(
+            SWITCH_GRACE_PERIOD,
+            lambda: self.__loop.create_task(
+                self.__close_retired_connection(old_connection)
+            ),
+        )
+
+    async def __close_retired_connection(self, connection):
+        if connection in self.__retired_connections:
+            self.__retired_connections.discard(connection)
+            await connection.close()
+
+    async def __pick_endpoint(self):
+        return self.__selector.pick()
+
+
+def _call_listeners(callbacks, connection):
+    for callback in callbacks:
+        try:
+            callback(connection)
+        except Exception as e:
+            logger.error("Failed to notify: %s", e)
+
+
+def _copy_result(task, future):
+    if future.cancelled():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
@@ -1,49 +1,74 @@
-from maxwell.utils.connection import MultiAltEndpointsConnection
+import time
+from maxwell.utils.logger import get_logger
 
+from .master_channel import MasterChannel
+
+logger = get_logger(__name__)
 
-class MasterClient(object):
-    __instance = None
 
+class MasterClient(object):
     # ===========================================
     # apis
     # ===========================================
-    def __init__(self, endpoints, options, loop):
-        self.__endpoints = endpoints
-        self.__options = options
+    def __init__(self, endpoints, options, loop, name="default"):
         self.__loop = loop
+        self.__name = name
 
-        self.__endpoint_index = -1
-        self.__connection = MultiAltEndpointsConnection(
-            pick_endpoint=self.__pick_endpoint,
-            options=self.__options,
-            loop=self.__loop,
-        )
+        self.__listeners = []  # [(event, callback), ...]
+        self.__requests = 0
+        self.__failed = 0
+        self.__inflight = 0
+        self.__total_latency = 0.0
+        self.__max_latency = 0.0
 
-    @staticmethod
-    def singleton(endpoints, options, loop):
-        if MasterClient.__instance == None:
-            MasterClient.__instance = MasterClient(endpoints, options, loop)
-        return MasterClient.__instance
+        # All clients of a process share one channel to the master.
+        self.__channel = MasterChannel.acquire(endpoints, options, self)
 
     async def close(self):
-        await self.__connection.close()
-        self.__connection = None
+        for event, callback in self.__listeners:
+            self.__channel.delete_connection_listener(event, callback, self.__loop)
+        self.__listeners.clear()
+        await self.__channel.release(self)
 
+    # The callback is called on this client's loop.
     def add_connection_listener(self, event, callback):
-        self.__connection.add_listener(event, callback)
+        self.__listeners.append((event, callback))
+        self.__channel.add_connection_listener(event, callback, self.__loop)
 
     def delete_connection_listener(self, event, callback):
-        self.__connection.delete_listener(event, callback)
+        try:
+            self.__listeners.remove((event, callback))
+        except ValueError:
+            return
+        self.__channel.delete_connection_listener(event, callback, self.__loop)
 
     async def request(self, msg):
-        await self.__connection.wait_open()
-        return await self.__connection.request(msg)
+        self.__requests += 1
+        self.__inflight += 1
+        start_at = time.monotonic()
+        try:
+            return await self.__channel.request(msg, self.__loop)
+        except Exception:
+            self.__failed += 1
+            raise
+        finally:
+            self.__inflight -= 1
+            latency = time.monotonic() - start_at
+            self.__total_latency += latency
+            if latency > self.__max_latency:
+                self.__max_latency = latency
 
-    # ===========================================
-    # internal functions
-    # ===========================================
-    async def __pick_endpoint(self):
-        self.__endpoint_index += 1
-        if self.__endpoint_index >= len(self.__endpoints):
-            self.__endpoint_index = 0
-        return self.__endpoints[self.__endpoint_index]
+    def get_channel(self):
+        return self.__channel
+
+    def get_stats(self):
+        return {
+            "name": self.__name,
+            "requests": self.__requests,
+            "failed": self.__failed,
+            "inflight": self.__inflight,
+            "avg_latency": (
+                self.__total_latency / self.__requests if self.__requests > 0 else 0
+            ),
+            "max_latency": self.__max_latency,
+        }
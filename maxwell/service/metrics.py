@@ -0,0 +1,251 @@
+import bisect
+import math
+import threading
+
+# Seconds, from sub-millisecond cache hits up to slow handlers.
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+# The children are created once per label values and kept by the callers, so
+# updating them on the hot paths allocates nothing. Updates aren't locked: a
+# rare lost increment between threads is fine for metrics.
+class CounterChild(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeChild(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class HistogramChild(object):
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, name, help, type, labelnames, new_child):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labelnames = tuple(labelnames)
+
+        self.__new_child = new_child
+        self.__children = {}  # label values => child
+        self.__lock = threading.Lock()
+
+    def labels(self, *labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(
+                "Expected labels %s, got %s: name: %s"
+                % (self.labelnames, labelvalues, self.name)
+            )
+        labelvalues = tuple(str(labelvalue) for labelvalue in labelvalues)
+        child = self.__children.get(labelvalues)
+        if child is None:
+            with self.__lock:
+                child = self.__children.setdefault(labelvalues, self.__new_child())
+        return child
+
+    def remove(self, *labelvalues):
+        labelvalues = tuple(str(labelvalue) for labelvalue in labelvalues)
+        with self.__lock:
+            self.__children.pop(labelvalues, None)
+
+    def samples(self):
+        with self.__lock:
+            children = list(self.__children.items())
+        for labelvalues, child in children:
+            labels = dict(zip(self.labelnames, labelvalues))
+            if self.type == "histogram":
+                cumulative = 0
+                for bound, count in zip(child.bounds + (math.inf,), child.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else repr(float(bound))
+                    yield "_bucket", {**labels, "le": le}, cumulative
+                yield "_sum", labels, child.sum
+                yield "_count", labels, child.count
+            else:
+                yield "", labels, child.value
+
+
+# Evaluated on each scrape, for what is already counted elsewhere, e.g. the
+# get_stats() of a component.
+class FuncMetric(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, name, help, type, labelnames, func):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labelnames = tuple(labelnames)
+
+        self.__func = func
+
+    def samples(self):
+        values = self.__func()
+        if not self.labelnames:
+            values = {(): values}
+        for labelvalues, value in values.items():
+            if not isinstance(labelvalues, tuple):
+                labelvalues = (labelvalues,)
+            yield "", dict(zip(self.labelnames, map(str, labelvalues))), value
+
+
+class Metrics(object):
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    # ===========================================
+    # apis
+    # ===========================================
+    @staticmethod
+    def singleton():
+        with Metrics.__instance_lock:
+            if Metrics.__instance is None:
+                Metrics.__instance = Metrics()
+            return Metrics.__instance
+
+    def __init__(self):
+        self.__metrics = {}  # name => metric
+        self.__lock = threading.Lock()
+
+    # The metrics are get-or-create by name, so modules may declare them at
+    # import time.
+    def counter(self, name, help, labelnames=()):
+        return self.__get_or_add(
+            name, lambda: Metric(name, help, "counter", labelnames, CounterChild)
+        )
+
+    def gauge(self, name, help, labelnames=()):
+        return self.__get_or_add(
+            name, lambda: Metric(name, help, "gauge", labelnames, GaugeChild)
+        )
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        bounds = tuple(sorted(buckets))
+        return self.__get_or_add(
+            name,
+            lambda: Metric(
+                name, help, "histogram", labelnames, lambda: HistogramChild(bounds)
+            ),
+        )
+
+    # The func returns the value, or a dict of label values => value if there
+    # are labelnames.
+    def counter_func(self, name, help, func, labelnames=()):
+        return self.__get_or_add(
+            name, lambda: FuncMetric(name, help, "counter", labelnames, func)
+        )
+
+    def gauge_func(self, name, help, func, labelnames=()):
+        return self.__get_or_add(
+            name, lambda: FuncMetric(name, help, "gauge", labelnames, func)
+        )
+
+    def get(self, name):
+        return self.__metrics.get(name)
+
+    # Renders all metrics in the prometheus text exposition format.
+    def render(self):
+        with self.__lock:
+            metrics = sorted(self.__metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {Metrics.__escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{Metrics.__format_labels(labels)} "
+                    f"{Metrics.__format_value(value)}"
+                )
+        lines.append("")
+        return "\n".join(lines)
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __get_or_add(self, name, new_metric):
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = new_metric()
+                self.__metrics[name] = metric
+            return metric
+
+    @staticmethod
+    def __format_labels(labels):
+        if not labels:
+            return ""
+        return (
+            "{"
+            + ",".join(
+                f'{name}="{Metrics.__escape_label_value(value)}"'
+                for name, value in labels.items()
+            )
+            + "}"
+        )
+
+    @staticmethod
+    def __format_value(value):
+        if isinstance(value, float):
+            if math.isinf(value):
+                return "+Inf" if value > 0 else "-Inf"
+            if math.isnan(value):
+                return "NaN"
+            return repr(value)
+        return str(value)
+
+    @staticmethod
+    def __escape_help(help):
+        return help.replace("\\", "\\\\").replace("\n", "\\n")
+
+    @staticmethod
+    def __escape_label_value(value):
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,137 @@
+import asyncio
+import cProfile
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from maxwell.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+UNTAGGED = "(other)"
+
+
+class Profiler(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    # The tag_frame(frame) returns the tag of the samples whose stack contains
+    # the frame, e.g. the ws path being handled, or None.
+    def __init__(self, output_dir, sample_interval, tag_frame=lambda frame: None):
+        self.__output_dir = output_dir
+        self.__sample_interval = sample_interval
+        self.__tag_frame = tag_frame
+
+        self.__running = False
+        self.__sessions = 0
+        self.__last_files = []
+
+    def is_running(self):
+        return self.__running
+
+    # Profiles the thread running the calling loop for the given seconds, with
+    # cProfile, a stack sampler and tracemalloc, then writes the results to
+    # the output dir. Returns the written files, nothing is hooked otherwise.
+    async def run(self, seconds):
+        if self.__running:
+            raise RuntimeError("Already profiling.")
+        self.__running = True
+        try:
+            return await self.__run(seconds)
+        finally:
+            self.__running = False
+
+    def get_stats(self):
+        return {
+            "running": self.__running,
+            "sessions": self.__sessions,
+            "last_files": self.__last_files,
+        }
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    async def __run(self, seconds):
+        logger.info("Profiling for %ss...", seconds)
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(25)
+        baseline = tracemalloc.take_snapshot()
+
+        samples = collections.Counter()  # folded stack => count
+        stop_event = threading.Event()
+        sampler = threading.Thread(
+            target=self.__sample,
+            args=(threading.get_ident(), samples, stop_event),
+            name="profiler-sampler",
+            daemon=True,
+        )
+        profile = cProfile.Profile()
+        profile.enable()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            stop_event.set()
+            sampler.join()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(
+            None, self.__write, profile, samples, baseline, snapshot
+        )
+        self.__sessions += 1
+        self.__last_files = files
+        logger.info("Profiled: samples: %s, files: %s", samples.total(), files)
+        return files
+
+    def __sample(self, thread_id, samples, stop_event):
+        while not stop_event.wait(self.__sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            tag = None
+            stack = []
+            while frame is not None:
+                if tag is None:
+                    try:
+                        tag = self.__tag_frame(frame)
+                    except Exception:
+                        pass
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            stack.append(tag if tag is not None else UNTAGGED)
+            stack.reverse()
+            samples[";".join(stack)] += 1
+
+    def __write(self, profile, samples, baseline, snapshot):
+        os.makedirs(self.__output_dir, exist_ok=True)
+        prefix = os.path.join(
+            self.__output_dir,
+            "profile-%s-%s" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S")),
+        )
+
+        # Loadable with pstats, snakeviz, etc.
+        profile.dump_stats(prefix + ".pstats")
+
+        # The folded format of flamegraph.pl, speedscope, etc., rooted at the tag.
+        with open(prefix + ".folded", "wt") as folded_file:
+            for stack, count in samples.most_common():
+                folded_file.write(f"{stack} {count}\n")
+
+        # Loadable with tracemalloc.Snapshot.load(), plus the top growth.
+        snapshot.dump(prefix + ".tracemalloc")
+        with open(prefix + ".memory.txt", "wt") as memory_file:
+            for stat in snapshot.compare_to(baseline, "lineno")[:50]:
+                memory_file.write(f"{stat}\n")
+
+        return [
+            prefix + suffix
+            for suffix in (".pstats", ".folded", ".tracemalloc", ".memory.txt")
+        ]
@@ -1,60 +1,315 @@
-import random
-from maxwell.utils.connection import Connection, Event
+import asyncio
+import time
+import weakref
 from maxwell.utils.logger import get_logger
 import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
 
 from .config import Config
+from .connection_pool import ConnectionPool
+from .inflight_limiter import InflightLimiter
+from .metrics import Metrics
 from .topic_locatlizer import TopicLocatlizer
+from .tracer import Tracer, span
 
 logger = get_logger(__name__)
 
+publish_latency = Metrics.singleton().histogram(
+    "maxwell_publish_duration_seconds",
+    "Time for a backend to ack a published msg, by endpoint.",
+    ("endpoint",),
+)
+publish_failures = Metrics.singleton().counter(
+    "maxwell_publish_failures_total",
+    "Msgs failed to be published, by endpoint.",
+    ("endpoint",),
+)
+locate_failures = (
+    Metrics.singleton()
+    .counter(
+        "maxwell_publish_locate_failures_total",
+        "Msgs failed to be published as their topic couldn't be located.",
+    )
+    .labels()
+)
+
 
 class Publisher(object):
+    # Every live publisher, so pending publishes can be drained on shutdown.
+    __instances = weakref.WeakSet()
+
     # ===========================================
     # apis
     # ===========================================
+    # Returns how many of the publish_nowait msgs pending when the drain
+    # started were acked and failed, and the msgs still pending at the timeout.
+    @staticmethod
+    async def drain_all(timeout):
+        publishers = list(Publisher.__instances)
+        tasks = []  # filled on the loops of the publishers
+        futures = [
+            asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(
+                    publisher.__flush_pending(tasks), publisher.__loop
+                )
+            )
+            for publisher in publishers
+        ]
+        _, pending = (
+            await asyncio.wait(futures, timeout=timeout) if futures else ((), ())
+        )
+        for future in pending:
+            future.cancel()
+        results = [
+            task.result()
+            for task in list(tasks)
+            if task.done() and not task.cancelled()
+        ]
+        drained = sum(1 for acked in results if acked)
+        failed = len(results) - drained
+        dropped = sum(publisher.get_pending_count() for publisher in publishers)
+        return {"drained": drained, "failed": failed, "dropped": dropped}
+
     def __init__(self, options, loop):
         self.__options = options
         self.__loop = loop
 
         self.__topic_locatlizer = TopicLocatlizer(self.__loop)
-        self.__connections = {}  # endpoint => [connection0, connection1, ...]
+        self.__connection_pools = {}  # endpoint => ConnectionPool
         self.__continuous_disconnected_times = 0
+        self.__reap_idle_slots_timer = None
+
+        self.__windows = {}  # endpoint => InflightLimiter
+        self.__endpoint_metrics = {}  # endpoint => (latency, failures)
+        self.__publish_nowait_tasks = set()
+        self.__on_publish_error_callback = lambda *args, **kwargs: None
+        self.__sent = 0
+        self.__acked = 0
+        self.__failed = 0
+
+        Publisher.__instances.add(self)
+
+    # Waits for every pending publish_nowait to be done.
+    # Returns the number of msgs which were pending.
+    async def flush(self):
+        count = self.get_pending_count()
+        if self.__publish_nowait_tasks:
+            # Unlike gather, wait leaves the tasks running if the flush is
+            # cancelled, so they are still counted as pending.
+            await asyncio.wait(set(self.__publish_nowait_tasks))
+        return count
 
     async def close(self):
-        for connections in self.__connections.values():
-            for connection in connections:
-                await connection.close()
+        Publisher.__instances.discard(self)
+        await self.flush()
+        if self.__reap_idle_slots_timer is not None:
+            self.__reap_idle_slots_timer.cancel()
+            self.__reap_idle_slots_timer = None
+        for connection_pool in self.__connection_pools.values():
+            await connection_pool.close()
         await self.__topic_locatlizer.close()
 
     async def publish(self, topic, value):
+        # Joins the trace of the request being handled, if any.
+        with Tracer.singleton().trace("publish") as trace:
+            if trace is not None:
+                trace.attributes["topic"] = topic
+            try:
+                with span("locate"):
+                    endpoint = await self.__topic_locatlizer.locate(topic)
+            except Exception as e:
+                self.__failed += 1
+                locate_failures.inc()
+                logger.error("Failed to locate: topic: %s, error: %s", topic, e)
+                return
+            try:
+                with span("push"):
+                    return await self.__publish_to_endpoint(endpoint, topic, value)
+            except Exception as e:
+                logger.error("Failed to publish: topic: %s, error: %s", topic, e)
+
+    # Returns as soon as the msg is handed over to a connection, without waiting
+    # for the ack. Blocks only while the endpoint's in-flight window is full.
+    # Failures are reported to the callback set via on_publish_error.
+    async def publish_nowait(self, topic, value):
         try:
-            connection = await self.__get_connetion(topic)
-            await connection.wait_open()
-            return await connection.request(self.__build_publish_req(topic, value))
+            endpoint = await self.__topic_locatlizer.locate(topic)
         except Exception as e:
-            logger.error("Failed to publish: topic: %s, error: %s", topic, e)
+            self.__failed += 1
+            locate_failures.inc()
+            self.__on_publish_error(topic, value, e)
+            return
+        window = self.__get_window(endpoint)
+        size = len(value)
+        await window.acquire(size)
+        task = self.__loop.create_task(
+            self.__publish_to_endpoint_nowait(endpoint, topic, value)
+        )
+        self.__publish_nowait_tasks.add(task)
+        task.add_done_callback(self.__publish_nowait_tasks.discard)
+        task.add_done_callback(lambda _task: window.release(size))
+
+    def get_pending_count(self):
+        return len(self.__publish_nowait_tasks)
+
+    def on_publish_error(self, callback):
+        self.__on_publish_error_callback = callback
+
+    def get_stats(self):
+        return {
+            "sent": self.__sent,
+            "acked": self.__acked,
+            "failed": self.__failed,
+            "inflight": {
+                endpoint: window.get_count()
+                for endpoint, window in self.__windows.items()
+            },
+            "slots": {
+                endpoint: connection_pool.get_stats()
+                for endpoint, connection_pool in self.__connection_pools.items()
+            },
+        }
+
+    # Publishes the msgs concurrently: the distinct topics are located at once,
+    # and the msgs to an endpoint are all in flight together over its slots.
+    # Every msg is still its own push request, the protocol has no multi-msg
+    # push. Returns the acks in the order of msgs, with the exception in place
+    # of the ack for every msg which failed.
+    async def publish_many(self, msgs):
+        msgs = list(msgs)
+        results = [None] * len(msgs)
+
+        topics = list({topic for topic, _ in msgs})
+        endpoints = await self.__topic_locatlizer.locate_many(topics)
+        topic_endpoints = dict(zip(topics, endpoints))
+
+        groups = {}  # endpoint => [index0, index1, ...]
+        for index, (topic, _) in enumerate(msgs):
+            endpoint = topic_endpoints[topic]
+            if isinstance(endpoint, BaseException):
+                self.__failed += 1
+                locate_failures.inc()
+                logger.error("Failed to locate: topic: %s, error: %s", topic, endpoint)
+                results[index] = endpoint
+            else:
+                groups.setdefault(endpoint, []).append(index)
+
+        await asyncio.gather(
+            *[
+                self.__publish_group(endpoint, indexes, msgs, results)
+                for endpoint, indexes in groups.items()
+            ]
+        )
+        return results
 
     # ===========================================
     # internal functions
     # ===========================================
-    async def __get_connetion(self, topic):
-        endpoint = await self.__topic_locatlizer.locate(topic)
-        connections = self.__connections.get(endpoint)
-        size = Config.singleton().get_connection_slot_size()
-        if connections is None:
-            connections = []
-            for _ in range(size):
-                connection = Connection(
-                    endpoint=endpoint, options=self.__options, loop=self.__loop
-                )
-                connection.add_listener(
-                    event=Event.ON_DISCONNECTED,
-                    callback=self.__on_disconnected_to_backend,
+    def __get_connection_pool(self, endpoint):
+        connection_pool = self.__connection_pools.get(endpoint)
+        if connection_pool is None:
+            connection_pool = ConnectionPool(
+                endpoint=endpoint,
+                options=self.__options,
+                loop=self.__loop,
+                max_size=Config.singleton().get_connection_slot_size(),
+                grow_threshold=Config.singleton().get_connection_slot_grow_threshold(),
+                on_disconnected=self.__on_disconnected_to_backend,
+            )
+            self.__connection_pools[endpoint] = connection_pool
+            self.__reap_idle_slots_later()
+        return connection_pool
+
+    def __reap_idle_slots_later(self):
+        if self.__reap_idle_slots_timer is None:
+            self.__reap_idle_slots_timer = self.__loop.call_later(
+                Config.singleton().get_connection_slot_idle_timeout() / 2,
+                lambda: self.__loop.create_task(self.__reap_idle_slots()),
+            )
+
+    async def __reap_idle_slots(self):
+        self.__reap_idle_slots_timer = None
+        idle_timeout = Config.singleton().get_connection_slot_idle_timeout()
+        for endpoint, connection_pool in list(self.__connection_pools.items()):
+            await connection_pool.reap_idle_slots(idle_timeout)
+            if connection_pool.size() == 0:
+                self.__connection_pools.pop(endpoint, None)
+        if self.__connection_pools:
+            self.__reap_idle_slots_later()
+
+    async def __publish_group(self, endpoint, indexes, msgs, results):
+        # All requests to an endpoint are in flight at the same time, spread
+        # over its connection slots.
+        acks = await asyncio.gather(
+            *[
+                self.__publish_to_endpoint(endpoint, msgs[index][0], msgs[index][1])
+                for index in indexes
+            ],
+            return_exceptions=True,
+        )
+        for index, ack in zip(indexes, acks):
+            if isinstance(ack, BaseException):
+                logger.error(
+                    "Failed to publish: topic: %s, error: %s", msgs[index][0], ack
                 )
-                connections.append(connection)
-            self.__connections[endpoint] = connections
-        return connections[random.randint(0, size - 1)]
+            results[index] = ack
+
+    async def __publish_to_endpoint(self, endpoint, topic, value):
+        connection_pool = self.__get_connection_pool(endpoint)
+        latency, failures = self.__get_endpoint_metrics(endpoint)
+        self.__sent += 1
+        started_at = time.perf_counter()
+        try:
+            ack = await connection_pool.request(self.__build_publish_req(topic, value))
+        except Exception:
+            self.__failed += 1
+            failures.inc()
+            raise
+        latency.observe(time.perf_counter() - started_at)
+        self.__acked += 1
+        return ack
+
+    def __get_endpoint_metrics(self, endpoint):
+        endpoint_metrics = self.__endpoint_metrics.get(endpoint)
+        if endpoint_metrics is None:
+            endpoint_metrics = (
+                publish_latency.labels(endpoint),
+                publish_failures.labels(endpoint),
+            )
+            self.__endpoint_metrics[endpoint] = endpoint_metrics
+        return endpoint_metrics
+
+    # Returns whether the msg was acked.
+    async def __publish_to_endpoint_nowait(self, endpoint, topic, value):
+        try:
+            await self.__publish_to_endpoint(endpoint, topic, value)
+            return True
+        except Exception as e:
+            self.__on_publish_error(topic, value, e)
+            return False
+
+    # Waits for the publish_nowait tasks pending now, which are added to tasks.
+    async def __flush_pending(self, tasks):
+        pending = set(self.__publish_nowait_tasks)
+        tasks.extend(pending)
+        if pending:
+            await asyncio.wait(pending)
+
+    def __get_window(self, endpoint):
+        window = self.__windows.get(endpoint)
+        if window is None:
+            window = InflightLimiter(
+                Config.singleton().get_publish_window_size(),
+                Config.singleton().get_publish_window_bytes(),
+            )
+            self.__windows[endpoint] = window
+        return window
+
+    def __on_publish_error(self, topic, value, error):
+        logger.error("Failed to publish: topic: %s, error: %s", topic, error)
+        try:
+            self.__on_publish_error_callback(topic, value, error)
+        except Exception as e:
+            logger.error("Failed to notify publish error: %s", e)
 
     def __on_disconnected_to_backend(self, connection):
         self.__continuous_disconnected_times += 1
@@ -63,7 +318,9 @@ class Publisher(object):
             >= Config.singleton().get_max_continuous_disconnected_times()
         ):
             self.__continuous_disconnected_times = 0
-            self.__connections.pop(connection.get_endpoint(), None)
+            connection_pool = self.__connection_pools.pop(connection.endpoint(), None)
+            if connection_pool is not None:
+                self.__loop.create_task(connection_pool.close())
 
     def __build_publish_req(self, topic, value):
         push_req = protocol_types.push_req_t()
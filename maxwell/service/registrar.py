@@ -1,18 +1,43 @@
 import asyncio
+import contextlib
+import hashlib
+import time
 from enum import Enum
-from threading import Thread
+from threading import Event as ThreadingEvent, Thread
 from starlette.routing import Route, Mount
 from fastapi.routing import APIWebSocketRoute, APIRoute
-from google.protobuf.json_format import MessageToDict
 import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
 from maxwell.utils.connection import Event
 from maxwell.utils.logger import get_logger
 
 from .config import Config
 from .master_client import MasterClient
+from .metrics import Metrics
 
 logger = get_logger(__name__)
 
+register_service_latency = (
+    Metrics.singleton()
+    .histogram(
+        "maxwell_registrar_register_service_duration_seconds",
+        "Time for the master to ack register_service.",
+    )
+    .labels()
+)
+set_routes_latency = (
+    Metrics.singleton()
+    .histogram(
+        "maxwell_registrar_set_routes_duration_seconds",
+        "Time for the master to ack set_routes.",
+    )
+    .labels()
+)
+registrar_requests = Metrics.singleton().counter(
+    "maxwell_registrar_requests_total",
+    "Requests sent to the master by the registrar, by op and result.",
+    ("op", "result"),
+)
+
 
 class Item(Enum):
     ROUTES = 1
@@ -35,22 +60,91 @@ class Registrar(Thread):
         self.__queue = None
         self.__master_client = None
         self.__put_routes_item_timer = None
+        self.__first_pending_change_at = None
         self.__running = True
+        self.__acked_routes_hash = None
+        self.__registered_event = ThreadingEvent()
+        self.__deregistered = False
+        self.__task = None
 
     def stop(self):
         self.__running = False
 
+    # Blocks until the master has acked the routes once, returns False if it
+    # hasn't within the timeout.
+    def wait_registered(self, timeout):
+        return self.__registered_event.wait(timeout)
+
+    # Clears the routes with the master, so the gateway stops routing new
+    # requests here before the service drains. Can be awaited from any loop,
+    # returns False if the master hasn't acked within the timeout.
+    async def deregister(self, timeout):
+        if self.__loop is None or self.__loop.is_closed() or not self.__running:
+            return False
+        try:
+            await asyncio.wait_for(
+                asyncio.wrap_future(
+                    asyncio.run_coroutine_threadsafe(self.__deregister(), self.__loop)
+                ),
+                timeout,
+            )
+            return True
+        except Exception as e:
+            logger.warning("Failed to deregister: %s", repr(e))
+            return False
+
+    # Sends the routes again, even if the master has acked them already, e.g.
+    # after a next generation with the same id failed to take over. Can be
+    # called from any thread.
+    def resend_routes(self):
+        if self.__loop is None or self.__loop.is_closed() or not self.__running:
+            return
+        self.__loop.call_soon_threadsafe(self.__resend_routes)
+
+    # Runs the registrar in its own thread and loop.
     def run(self):
         logger.info("Starting registrar thread...")
+        self.__loop = asyncio.new_event_loop()
+        self.__loop.run_until_complete(self.__run())
+        self.__loop.close()
+        logger.info("Finished registrar thread.")
+
+    # Runs the registrar on the serving loop instead: it starts as soon as the
+    # service's own startup has completed, and stops before its shutdown.
+    def attach(self):
+        lifespan_context = self.__service.router.lifespan_context
+
+        @contextlib.asynccontextmanager
+        async def lifespan(app):
+            async with lifespan_context(app) as state:
+                logger.info("Starting registrar on the serving loop...")
+                self.__loop = asyncio.get_running_loop()
+                self.__task = self.__loop.create_task(self.__run())
+                try:
+                    yield state
+                finally:
+                    self.__running = False
+                    self.__task.cancel()
+                    try:
+                        await self.__task
+                    except asyncio.CancelledError:
+                        pass
+                    logger.info("Finished registrar on the serving loop.")
 
+        self.__service.router.lifespan_context = lifespan
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    async def __run(self):
         # init
-        self.__loop = asyncio.new_event_loop()
         self.__open_event = asyncio.Event()
         self.__queue = asyncio.Queue()
         self.__master_client = MasterClient(
             Config.singleton().get_master_endpoints(),
             {"reconnect_delay": 1, "ping_interval": 10},
             self.__loop,
+            name="registrar",
         )
 
         # set routes change listener
@@ -65,39 +159,73 @@ class Registrar(Thread):
         )
 
         # do real stuff
-        self.__loop.run_until_complete(self.__repeat_register_service_and_set_routes())
-
-        # clean up
-        self.__master_client.delete_connection_listener(
-            event=Event.ON_CONNECTED, callback=self.__on_connected_to_master
-        )
-        self.__master_client.delete_connection_listener(
-            event=Event.ON_DISCONNECTED, callback=self.__on_disconnected_from_master
-        )
-        self.__loop.run_until_complete(self.__master_client.close())
-        if self.__put_routes_item_timer:
-            self.__put_routes_item_timer.cancel()
-        self.__loop.close()
-
-        logger.info("Finished registrar thread.")
-
-    # ===========================================
-    # internal functions
-    # ===========================================
+        try:
+            await self.__repeat_register_service_and_set_routes()
+        finally:
+            # clean up
+            self.__service.on_routes_change(lambda *args, **kwargs: None)
+            self.__master_client.delete_connection_listener(
+                event=Event.ON_CONNECTED, callback=self.__on_connected_to_master
+            )
+            self.__master_client.delete_connection_listener(
+                event=Event.ON_DISCONNECTED,
+                callback=self.__on_disconnected_from_master,
+            )
+            await self.__master_client.close()
+            if self.__put_routes_item_timer:
+                self.__put_routes_item_timer.cancel()
 
+    # Route changes may come from any thread.
     def __put_routes_item_later(self, *argv, **kwargs):
         logger.debug("Put routes item later: argv: %s, kwargs: %s", argv, kwargs)
+        self.__loop.call_soon_threadsafe(
+            self.__schedule_put_routes_item, kwargs.get("delay")
+        )
+
+    def __schedule_put_routes_item(self, delay=None):
+        # Adaptive debouncing: routes are sent once they have been quiet for a
+        # short while, but a burst of changes never holds them back for longer
+        # than set_routes_delay.
+        now = self.__loop.time()
+        if self.__first_pending_change_at is None:
+            self.__first_pending_change_at = now
+        if delay is None:
+            deadline = self.__first_pending_change_at + (
+                Config.singleton().get_set_routes_delay()
+            )
+            delay = max(
+                min(Config.singleton().get_set_routes_quiet_period(), deadline - now),
+                0,
+            )
         if self.__put_routes_item_timer:
             self.__put_routes_item_timer.cancel()
-        delay = kwargs.get("delay", Config.singleton().get_set_routes_delay())
-        self.__put_routes_item_timer = self.__loop.call_soon_threadsafe(
-            self.__loop.call_later, delay, self.__put_routes_item
+        self.__put_routes_item_timer = self.__loop.call_later(
+            delay, self.__put_routes_item
         )
 
     def __put_routes_item(self):
-        req = self.__service.visit_routes(Registrar.__build_set_routes_req)
+        self.__put_routes_item_timer = None
+        self.__first_pending_change_at = None
+        if self.__deregistered:
+            return
+        # Only copy the routes while holding the lock, the req is built outside.
+        root_path, ws_paths, routes = self.__service.visit_routes(
+            lambda root_path, ws_routes, routes: (
+                root_path,
+                list(ws_routes.keys()),
+                list(routes),
+            )
+        )
+        req = Registrar.__build_set_routes_req(root_path, ws_paths, routes)
         self.__queue.put_nowait((Item.ROUTES, req))
 
+    def __resend_routes(self):
+        # Not started yet, the routes are sent once connected anyway.
+        if self.__queue is None:
+            return
+        self.__acked_routes_hash = None
+        self.__schedule_put_routes_item(0)
+
     def __put_cancel_item(self):
         self.__queue.put_nowait((Item.CANCEL, None))
 
@@ -121,22 +249,24 @@ class Registrar(Thread):
 
     async def __register_service(self):
         req = Registrar.__build_register_service_req()
+        started_at = time.perf_counter()
         try:
             rep = await self.__master_client.request(req)
+            register_service_latency.observe(time.perf_counter() - started_at)
+            registrar_requests.labels("register_service", "ok").inc()
+            # The master may have lost our routes, always send them after this.
+            self.__acked_routes_hash = None
             logger.info("Successfully to register service: %s", rep)
         except Exception as e:
+            registrar_requests.labels("register_service", "failed").inc()
             logger.error("Failed to register service: %s", e)
             raise e
 
     async def __repeat_set_routes(self):
         while self.__running:
+            type, req = await self.__queue.get()
             try:
-                type, req = await self.__queue.get()
-                logger.info(
-                    "Got item: type: %s, path bundle: %s",
-                    type,
-                    MessageToDict(req, preserving_proto_field_name=True),
-                )
+                logger.debug("Got item: type: %s", type)
                 if type == Item.ROUTES:
                     await self.__set_routes(req)
                 elif type == Item.CANCEL:
@@ -148,13 +278,42 @@ class Registrar(Thread):
                 self.__queue.task_done()
 
     async def __set_routes(self, req):
+        if self.__deregistered:
+            return
+        routes_hash = hashlib.sha256(req.SerializeToString(deterministic=True))
+        routes_hash = routes_hash.hexdigest()
+        if routes_hash == self.__acked_routes_hash:
+            registrar_requests.labels("set_routes", "skipped").inc()
+            logger.debug("Routes stay the same: hash: %s, skip.", routes_hash[:12])
+            return
+        started_at = time.perf_counter()
         try:
             rep = await self.__master_client.request(req)
-            logger.info("Successfully to set routes: %s", rep)
+            set_routes_latency.observe(time.perf_counter() - started_at)
+            registrar_requests.labels("set_routes", "ok").inc()
+            self.__acked_routes_hash = routes_hash
+            self.__registered_event.set()
+            logger.info(
+                "Successfully to set routes: hash: %s, %s",
+                routes_hash[:12],
+                Registrar.__summarize_set_routes_req(req),
+            )
         except Exception as e:
+            registrar_requests.labels("set_routes", "failed").inc()
             logger.error("Failed to set routes: %s", e)
             raise e
 
+    async def __deregister(self):
+        # Routes changed or reconnected afterwards are never sent again.
+        self.__deregistered = True
+        if self.__put_routes_item_timer:
+            self.__put_routes_item_timer.cancel()
+            self.__put_routes_item_timer = None
+        await self.__open_event.wait()
+        await self.__master_client.request(protocol_types.set_routes_req_t())
+        self.__acked_routes_hash = None
+        logger.info("Successfully to deregister: routes cleared.")
+
     @staticmethod
     def __build_register_service_req():
         req = protocol_types.register_service_req_t()
@@ -163,11 +322,14 @@ class Registrar(Thread):
         return req
 
     @staticmethod
-    def __build_set_routes_req(root_path, ws_routes, routes):
+    def __build_set_routes_req(root_path, ws_paths, routes):
         req = protocol_types.set_routes_req_t()
-        for ws_path in ws_routes.keys():
+        for ws_path in ws_paths:
             req.ws_paths.extend([Registrar.__prepend_root_path(root_path, ws_path)])
         for route in routes:
+            # Internal endpoints, e.g. /$metrics, aren't served via the gateway.
+            if route.path.startswith("/$"):
+                continue
             path = Registrar.__prepend_root_path(root_path, route.path)
             if isinstance(route, APIRoute):
                 for method in route.methods:
@@ -197,8 +359,22 @@ class Registrar(Thread):
                 req.get_paths.extend([path])
             else:
                 logger.error("Unknown route: %s", route)
+        # Sorted and deduplicated, so the same route set always hashes the same.
+        for field in protocol_types.set_routes_req_t.DESCRIPTOR.fields:
+            if field.label == field.LABEL_REPEATED:
+                paths = sorted(set(getattr(req, field.name)))
+                req.ClearField(field.name)
+                getattr(req, field.name).extend(paths)
         return req
 
+    @staticmethod
+    def __summarize_set_routes_req(req):
+        return ", ".join(
+            f"{field.name}: {len(getattr(req, field.name))}"
+            for field in protocol_types.set_routes_req_t.DESCRIPTOR.fields
+            if field.label == field.LABEL_REPEATED and len(getattr(req, field.name)) > 0
+        )
+
     @staticmethod
     def __prepend_root_path(root_path, path):
         return root_path + path
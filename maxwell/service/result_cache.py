@@ -0,0 +1,99 @@
+import collections
+import threading
+import time
+
+from .config import Config
+
+
+class ResultCache(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, ttl=None, max_entries=None, max_bytes=None):
+        self.__ttl = ttl if ttl is not None else Config.singleton().get_ws_cache_ttl()
+        self.__max_entries = (
+            max_entries
+            if max_entries is not None
+            else Config.singleton().get_ws_cache_max_entries()
+        )
+        self.__max_bytes = (
+            max_bytes
+            if max_bytes is not None
+            else Config.singleton().get_ws_cache_max_bytes()
+        )
+
+        self.__entries = collections.OrderedDict()  # key => (expire_at, data)
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__invalidations = 0
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__misses += 1
+                return None
+            expire_at, data = entry
+            if expire_at <= time.monotonic():
+                self.__pop(key)
+                self.__misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return data
+
+    def put(self, key, data):
+        size = len(data)
+        if size > self.__max_bytes:
+            return
+        with self.__lock:
+            self.__pop(key)
+            self.__entries[key] = (time.monotonic() + self.__ttl, data)
+            self.__bytes += size
+            while (
+                len(self.__entries) > self.__max_entries
+                or self.__bytes > self.__max_bytes
+            ):
+                self.__pop(next(iter(self.__entries)))
+                self.__evictions += 1
+
+    def invalidate(self, key):
+        with self.__lock:
+            if self.__pop(key) is not None:
+                self.__invalidations += 1
+
+    # Clears every entry, or those whose keys match.
+    def clear(self, match=None):
+        with self.__lock:
+            if match is None:
+                self.__invalidations += len(self.__entries)
+                self.__entries.clear()
+                self.__bytes = 0
+                return
+            for key in [key for key in self.__entries if match(key)]:
+                self.__pop(key)
+                self.__invalidations += 1
+
+    def get_stats(self):
+        with self.__lock:
+            return {
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions,
+                "invalidations": self.__invalidations,
+                "entries": len(self.__entries),
+                "bytes": self.__bytes,
+            }
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __pop(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__bytes -= len(entry[1])
+        return entry
@@ -1,12 +1,15 @@
 import argparse
+import asyncio
 import sys
 import setproctitle
 import uvicorn
 from maxwell.utils.logger import get_logger
 
 from .config import Config
+from .executor import Executor
 from .registrar import Registrar
 from .service import Service
+from .supervisor import DrainingServer, Supervisor, inherit_or_bind_socket
 
 logger = get_logger(__name__)
 
@@ -19,7 +22,7 @@ class Server(object):
             [module_name, service_name] = service_ref.split(":")
             service = getattr(sys.modules[module_name], service_name)
         elif isinstance(service_ref, Service):
-            pass
+            service = service_ref
         else:
             raise ValueError("The service_ref must be a str or a Service.")
 
@@ -30,13 +33,76 @@ class Server(object):
         parser.add_argument(
             "--reload", action="store_true", help="Reload service on file changes."
         )
+        parser.add_argument(
+            "--workers", type=int, default=None, help="Number of worker processes."
+        )
         args = vars(parser.parse_args())
+        workers = (
+            args["workers"]
+            if args["workers"] is not None
+            else Config.singleton().get_workers()
+        )
 
         setproctitle.setproctitle(Config.singleton().get_proc_name())
 
-        self.__registrar.start()
-        uvicorn.run(
-            self.__service_ref,
+        # The reloader and the workers serve from child processes, keep the
+        # registrar in its own thread of this process then, so the instance is
+        # registered only once.
+        attached = (
+            Config.singleton().get_registrar_mode() == "loop"
+            and not args["reload"]
+            and workers == 0
+        )
+        if attached:
+            self.__registrar.attach()
+        else:
+            self.__registrar.start()
+        if args["reload"]:
+            uvicorn.run(
+                self.__service_ref, reload=True, **self.__build_uvicorn_kwargs()
+            )
+        elif workers > 0:
+            self.__run_workers(workers)
+        else:
+            # On shutdown: clear the routes with the master, reject new frames,
+            # then wait for the requests in flight and the pending publishes.
+            DrainingServer(
+                uvicorn.Config(self.__service_ref, **self.__build_uvicorn_kwargs()),
+                Config.singleton().get_drain_timeout(),
+                before_drain=self.__registrar.deregister,
+            ).run()
+        self.__registrar.stop()
+        Executor.singleton().shutdown()
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __run_workers(self, workers):
+        if not isinstance(self.__service_ref, str):
+            raise ValueError("The service_ref must be a str to run workers.")
+        uvicorn_kwargs = self.__build_uvicorn_kwargs()
+        sock = inherit_or_bind_socket(uvicorn_kwargs["host"], uvicorn_kwargs["port"])
+        uvicorn_kwargs["app"] = self.__service_ref
+        # Send SIGHUP to reload: the next generation inherits the socket, and
+        # takes over once its workers are ready and the master knows its routes.
+        supervisor = Supervisor(
+            uvicorn_kwargs,
+            sock,
+            workers,
+            Config.singleton().get_worker_restart_delay(),
+            Config.singleton().get_drain_timeout(),
+            Config.singleton().get_reload_timeout(),
+            self.__registrar.wait_registered,
+            lambda: asyncio.run(
+                self.__registrar.deregister(Config.singleton().get_drain_timeout())
+            ),
+            self.__registrar.resend_routes,
+        )
+        supervisor.run()
+        sock.close()
+
+    def __build_uvicorn_kwargs(self):
+        return dict(
             host="0.0.0.0",
             port=Config.singleton().get_port(),
             loop="uvloop",
@@ -47,7 +113,5 @@ class Server(object):
             ws_ping_timeout=None,
             lifespan="on",
             interface="asgi3",
-            reload=args["reload"],
             log_config=Config.singleton().get_log_config(),
         )
-        self.__registrar.stop()
@@ -1,19 +1,60 @@
 import asyncio
+import contextlib
 from enum import Enum
 import functools
 import inspect
-import json
+import itertools
 import traceback
 import threading
+import time
 import signal
+import weakref
 from typing import TypeAlias, override
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from maxwell.utils.logger import get_logger
 import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
 import maxwell.protocol.maxwell_protocol as protocol
 
+from . import codec as codecs
+from .config import Config
+from .executor import Executor
+from .inflight_limiter import InflightLimiter
+from .loop_monitor import LoopMonitor
+from .metrics import Metrics
+from .profiler import Profiler
+from .publisher import Publisher
+from .result_cache import ResultCache
+from .single_flight import SingleFlight
+from .tracer import Tracer, current_trace, span
+from .ws_writer import WsWriter
+
 logger = get_logger(__name__)
 
+ws_requests = Metrics.singleton().counter(
+    "maxwell_ws_requests_total", "Ws requests handled, by path.", ("path",)
+)
+ws_errors = Metrics.singleton().counter(
+    "maxwell_ws_errors_total",
+    "Ws requests failed, by path and error code.",
+    ("path", "code"),
+)
+ws_latency = Metrics.singleton().histogram(
+    "maxwell_ws_request_duration_seconds",
+    "Time to handle a ws request until its reply is queued, by path.",
+    ("path",),
+)
+ws_unknown_paths = (
+    Metrics.singleton()
+    .counter("maxwell_ws_unknown_path_total", "Ws requests for unknown paths.")
+    .labels()
+)
+ws_rejected = Metrics.singleton().counter(
+    "maxwell_ws_rejected_total",
+    "Ws requests rejected, as overloaded or shutting down.",
+    ("reason",),
+)
+
 
 class Change(Enum):
     ADD = 1
@@ -34,54 +75,186 @@ class Reply:
         self.payload = payload
 
 
+class WsRoute:
+    def __init__(
+        self,
+        handle,
+        is_coroutine,
+        version,
+        executor=None,
+        codec="json",
+        cache=None,
+        single_flight=None,
+        is_stream=False,
+    ):
+        self.handle = handle
+        self.is_coroutine = is_coroutine
+        self.version = version
+        self.executor = executor
+        self.codec = codec
+        self.cache = cache
+        self.single_flight = single_flight
+        self.is_stream = is_stream
+        self.path = None
+        self.requests = None
+        self.latency = None
+        self.errors = {}  # code => counter
+
+    def bind_metrics(self, path):
+        self.path = path
+        self.requests = ws_requests.labels(path)
+        self.latency = ws_latency.labels(path)
+
+    def count_error(self, code):
+        errors = self.errors.get(code)
+        if errors is None:
+            errors = self.errors[code] = ws_errors.labels(self.path, code)
+        errors.inc()
+
+
+def call_sync_handler(handle, version, codec, req):
+    if version == Version.V1:
+        with span("handle"):
+            userland_rep: Reply = handle(req)
+        with span("serialize"):
+            return build_result(userland_rep, codec)
+    elif version == Version.V0:
+        with span("handle"):
+            return protocol_types.error_code_t.OK, "", handle(req)
+    else:
+        raise SystemExit("Unknown version: %s" % version)
+
+
+def call_sync_handler_with_encoded_req(handle, version, codec, encoded_req):
+    # The generated protobuf classes can't be pickled across processes.
+    req = protocol_types.req_req_t()
+    req.ParseFromString(encoded_req)
+    return call_sync_handler(handle, version, codec, req)
+
+
+def encode_refs(req):
+    # Serialized protobuf msgs can be concatenated to merge fields, so the refs
+    # are appended to a ref-less encoded rep instead of re-encoding the payload.
+    # The refs have the same field numbers in req_rep_t and error2_rep_t.
+    refs = protocol_types.req_rep_t()
+    refs.conn0_ref = req.conn0_ref
+    refs.ref = req.ref
+    return refs.SerializeToString()
+
+
+# Ends a stream. A dedicated rep, as an empty req_rep_t is a valid chunk.
+STREAM_END = protocol.encode_msg(protocol_types.ok2_rep_t())
+
+
+def encode_chunk(codec, chunk):
+    rep = protocol_types.req_rep_t()
+    if isinstance(chunk, (str, bytes)):
+        rep.payload = chunk
+    else:
+        rep.payload = codecs.encode(codec, chunk)
+    return protocol.encode_msg(rep)
+
+
+def build_result(userland_rep, codec):
+    if userland_rep.code == protocol_types.error_code_t.OK:
+        return (
+            userland_rep.code,
+            userland_rep.desc,
+            codecs.encode(codec, userland_rep.payload),
+        )
+    else:
+        return userland_rep.code, userland_rep.desc, None
+
+
 class Service(FastAPI):
-    def __init__(self, *args, **kwargs):
+    __instances = weakref.WeakSet()
+    # Unique across the services, as the metrics merge their connections.
+    __connection_ids = itertools.count(1)
+
+    @staticmethod
+    def get_all_ws_inflight():
+        return sum(
+            service.__inflight_limiter.get_count()
+            for service in list(Service.__instances)
+        )
+
+    @staticmethod
+    def get_all_ws_connection_stats():
+        stats = {}
+        for service in list(Service.__instances):
+            for writer, (connection_id, inflight_limiter) in list(
+                service.__ws_writers.items()
+            ):
+                stats[connection_id] = {
+                    "inflight": inflight_limiter.get_count(),
+                    "queued_bytes": writer.get_stats()["queued_bytes"],
+                }
+        return stats
+
+    def __init__(self, *args, codec=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.__codec = codec if codec is not None else Config.singleton().get_ws_codec()
+        codecs.check_codec(self.__codec)
         self.__ws_routes = {}
         self.__routes_lock = threading.Lock()
         self.__on_routes_change_callback = lambda *args, **kwargs: None
         self.__running = True
+        self.__draining = False
+        self.__drained = 0
+        self.__rejected = 0  # refused while draining
+        self.__abandoned = 0  # still in flight at the drain timeout
+        self.__drained_publishes = 0
+        self.__failed_publishes = 0
+        self.__dropped_publishes = 0
+        self.__ws_writers = {}  # writer => (connection id, inflight limiter)
+        self.__overloaded = ws_rejected.labels("overloaded")
+        self.__shutting_down = ws_rejected.labels("shutting_down")
+        self.__inflight_limiter = InflightLimiter(
+            Config.singleton().get_ws_max_inflight(),
+            Config.singleton().get_ws_max_inflight_bytes(),
+        )
+
+        self.__profiler = Profiler(
+            Config.singleton().get_profile_dir(),
+            Config.singleton().get_profile_sample_interval(),
+            self.__tag_frame,
+        )
+        self.__profile_task = None
+        self.__tracer = Tracer.singleton()
+        self.__loop_monitor = LoopMonitor(
+            Config.singleton().get_loop_monitor_interval(),
+            Config.singleton().get_loop_lag_threshold(),
+            self.__tag_frame,
+        )
 
         signal.signal(signal.SIGINT, self.__signal_handler)
+        signal.signal(signal.SIGUSR1, self.__profile_signal_handler)
         self.__add_websocket_endpoint()
-
-    def ws(self, path):
-        def decorator(func):
-            @functools.wraps(func)
-            def func_wrapper(*args, **kwargs):
-                value = func(*args, **kwargs)
-                return value
-
-            with self.__routes_lock:
-                self.__ws_routes[path] = [
-                    func_wrapper,
-                    inspect.iscoroutinefunction(func),
-                    Version.V0,
-                ]
-                self.__on_routes_change_callback(Change.ADD, path)
-
-            return func_wrapper
-
-        return decorator
-
-    def add_ws_route(self, path):
-        def decorator(func):
-            @functools.wraps(func)
-            def func_wrapper(*args, **kwargs):
-                value = func(*args, **kwargs)
-                return value
-
-            with self.__routes_lock:
-                self.__ws_routes[path] = [
-                    func_wrapper,
-                    inspect.iscoroutinefunction(func),
-                    Version.V1,
-                ]
-                self.__on_routes_change_callback(Change.ADD, path)
-
-            return func_wrapper
-
-        return decorator
+        self.__add_metrics_endpoint()
+        self.__add_profile_endpoint()
+        self.__add_traces_endpoint()
+        self.__add_loop_monitor()
+        Service.__instances.add(self)
+
+    def ws(self, path, executor=None, cache: ResultCache = None, coalesce=False):
+        return self.__add_ws_route(path, Version.V0, executor, "raw", cache, coalesce)
+
+    def add_ws_route(
+        self,
+        path,
+        executor=None,
+        codec=None,
+        cache: ResultCache = None,
+        coalesce=False,
+    ):
+        return self.__add_ws_route(
+            path,
+            Version.V1,
+            executor,
+            codec if codec is not None else self.__codec,
+            cache,
+            coalesce,
+        )
 
     @override
     def get(self, *args, **kwargs):
@@ -157,6 +330,76 @@ class Service(FastAPI):
         with self.__routes_lock:
             return visit(self.root_path, self.__ws_routes, self.routes)
 
+    def invalidate_ws_cache(self, path, payload=None):
+        ws_route = self.__ws_routes.get(path)
+        if ws_route is None or ws_route.cache is None:
+            return
+        # Entries are keyed by path too, as a cache may be shared by routes.
+        if payload is None:
+            ws_route.cache.clear(lambda key: key[0] == path)
+        else:
+            ws_route.cache.invalidate((path, payload))
+
+    # Stops taking new ws requests (they are rejected, so the gateway can retry
+    # them elsewhere), then waits for the ones in flight to be replied and for
+    # the pending publishes to be sent. Returns False if that didn't finish
+    # within the timeout.
+    async def drain(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.__draining = True
+        inflight = self.__inflight_limiter.get_count()
+        logger.info("Draining: inflight: %s", inflight)
+        while self.__inflight_limiter.get_count() > 0 or any(
+            writer.get_stats()["queued_frames"] > 0 for writer in self.__ws_writers
+        ):
+            if loop.time() >= deadline:
+                break
+            await asyncio.sleep(0.01)
+        remaining = self.__inflight_limiter.get_count()
+        self.__drained += inflight - remaining
+        self.__abandoned += remaining
+
+        publish_stats = await Publisher.drain_all(max(deadline - loop.time(), 0))
+        self.__drained_publishes += publish_stats["drained"]
+        self.__failed_publishes += publish_stats["failed"]
+        self.__dropped_publishes += publish_stats["dropped"]
+
+        drain_stats = self.get_drain_stats()
+        logger.info("Drained: %s", drain_stats)
+        return remaining == 0 and publish_stats["dropped"] == 0
+
+    def get_drain_stats(self):
+        return {
+            "drained": self.__drained,
+            "rejected": self.__rejected,
+            "abandoned": self.__abandoned,
+            "drained_publishes": self.__drained_publishes,
+            "failed_publishes": self.__failed_publishes,
+            "dropped_publishes": self.__dropped_publishes,
+        }
+
+    def get_ws_stats(self):
+        return {
+            "inflight": self.__inflight_limiter.get_count(),
+            "inflight_bytes": self.__inflight_limiter.get_bytes(),
+            "connections": [writer.get_stats() for writer in self.__ws_writers],
+        }
+
+    # Profiles the serving loop, with the samples tagged by the ws path being
+    # handled. Also triggered by SIGUSR1 or POST /$profile?seconds=N. Returns
+    # the files written to the profile_dir.
+    async def profile(self, seconds=None):
+        if seconds is None:
+            seconds = Config.singleton().get_profile_duration()
+        return await self.__profiler.run(seconds)
+
+    def get_profile_stats(self):
+        return self.__profiler.get_stats()
+
+    def get_loop_stats(self):
+        return self.__loop_monitor.get_stats()
+
     def on_routes_change(self, callback):
         self.__on_routes_change_callback = callback
 
@@ -164,64 +407,198 @@ class Service(FastAPI):
         @self.websocket("/$ws")
         async def websocket_endpoint(websocket: WebSocket):
             await websocket.accept()
+            connection_inflight_limiter = InflightLimiter(
+                Config.singleton().get_ws_max_inflight_per_connection(),
+                Config.singleton().get_ws_max_inflight_bytes_per_connection(),
+            )
+            should_pause = Config.singleton().get_ws_overload_policy() == "pause"
+            writer = WsWriter(
+                websocket,
+                Config.singleton().get_ws_writer_high_water_mark(),
+                Config.singleton().get_ws_writer_low_water_mark(),
+            )
+            writer.start()
+            self.__ws_writers[writer] = (
+                next(Service.__connection_ids),
+                connection_inflight_limiter,
+            )
+            data = None
             try:
                 while self.__running:
                     data = await websocket.receive_bytes()
-                    asyncio.ensure_future(self.__handle_msg(websocket, data))
+                    size = len(data)
+                    if self.__draining:
+                        if await self.__reply_rejected(
+                            writer, data, "Shutting down, please retry: %s"
+                        ):
+                            self.__rejected += 1
+                            self.__shutting_down.inc()
+                        continue
+                    if should_pause:
+                        await self.__acquire_inflight(connection_inflight_limiter, size)
+                    elif not self.__try_acquire_inflight(
+                        connection_inflight_limiter, size
+                    ):
+                        if await self.__reply_rejected(
+                            writer, data, "Overloaded, please retry later: %s"
+                        ):
+                            self.__overloaded.inc()
+                        continue
+                    task = asyncio.ensure_future(self.__handle_msg(writer, data))
+                    task.add_done_callback(
+                        functools.partial(
+                            self.__release_inflight, connection_inflight_limiter, size
+                        )
+                    )
             except WebSocketDisconnect as e:
                 logger.warning("Connection was closed: reason: %s", e)
             except Exception as e:
                 logger.error("Failed to handle data: %s, reason: %s", data, e)
+            finally:
+                self.__ws_writers.pop(writer, None)
+                await writer.close()
+
+    def __add_metrics_endpoint(self):
+        # Scraped directly rather than through the gateway, so it isn't
+        # registered with the master.
+        @self.get(
+            "/$metrics",
+            response_class=PlainTextResponse,
+            include_in_schema=False,
+        )
+        def metrics():
+            return PlainTextResponse(
+                Metrics.singleton().render(),
+                media_type="text/plain; version=0.0.4; charset=utf-8",
+            )
+
+    def __add_profile_endpoint(self):
+        @self.post("/$profile", include_in_schema=False)
+        async def profile(seconds: float = None):
+            if self.__profiler.is_running():
+                raise HTTPException(status_code=409, detail="Already profiling.")
+            return {"files": await self.profile(seconds)}
+
+    def __add_traces_endpoint(self):
+        # The latest sampled traces, see trace_sample_rate.
+        @self.get("/$traces", include_in_schema=False)
+        def traces(limit: int = 100):
+            return {
+                "stats": self.__tracer.get_stats(),
+                "traces": self.__tracer.get_traces(limit),
+            }
+
+    # Monitors the serving loop from its startup to its shutdown.
+    def __add_loop_monitor(self):
+        lifespan_context = self.router.lifespan_context
+
+        @contextlib.asynccontextmanager
+        async def lifespan(app):
+            async with lifespan_context(app) as state:
+                self.__loop_monitor.start()
+                try:
+                    yield state
+                finally:
+                    await self.__loop_monitor.stop()
+
+        self.router.lifespan_context = lifespan
+
+    # Returns the ws path or the http route which the frame is handling.
+    def __tag_frame(self, frame):
+        code = frame.f_code
+        if code is Service.__handle_msg.__code__:
+            req = frame.f_locals.get("req")
+            if req.__class__ != protocol_types.req_req_t:
+                return None
+            return req.path
+        # The asgi apps of the matched routes get the route in their scope.
+        if "scope" in code.co_varnames:
+            scope = frame.f_locals.get("scope")
+            if isinstance(scope, dict) and "route" in scope:
+                return scope["route"].path
+        return None
+
+    async def __acquire_inflight(self, connection_inflight_limiter, size):
+        await connection_inflight_limiter.acquire(size)
+        try:
+            await self.__inflight_limiter.acquire(size)
+        except BaseException:
+            connection_inflight_limiter.release(size)
+            raise
+
+    def __try_acquire_inflight(self, connection_inflight_limiter, size):
+        if not connection_inflight_limiter.try_acquire(size):
+            return False
+        if not self.__inflight_limiter.try_acquire(size):
+            connection_inflight_limiter.release(size)
+            return False
+        return True
+
+    def __release_inflight(self, connection_inflight_limiter, size, _task):
+        self.__inflight_limiter.release(size)
+        connection_inflight_limiter.release(size)
+
+    # Returns whether the rejected msg was a request.
+    async def __reply_rejected(self, writer, data, desc_format):
+        try:
+            req = protocol.decode_msg(data)
+            if req.__class__ == protocol_types.req_req_t:
+                logger.warning("Rejected msg: path: %s", req.path)
+                rep = protocol_types.error2_rep_t()
+                rep.code = protocol_types.error_code_t.SERVICE_ERROR
+                rep.desc = desc_format % req.path
+                rep.conn0_ref = req.conn0_ref
+                rep.ref = req.ref
+                await writer.send(protocol.encode_msg(rep))
+                return True
+            elif req.__class__ == protocol_types.ping_req_t:
+                rep = protocol_types.ping_rep_t()
+                rep.ref = req.ref
+                await writer.send(protocol.encode_msg(rep))
+            else:
+                logger.error("Received unknown msg: %s", req)
+        except Exception:
+            logger.error("Failed to reply rejected: %s", traceback.format_exc())
+        return False
 
-    async def __handle_msg(self, websocket, data):
+    async def __handle_msg(self, writer, data):
+        req = None
         try:
+            started_at = time.perf_counter()
             req = protocol.decode_msg(data)
             if req.__class__ == protocol_types.req_req_t:
                 logger.debug("Received msg: %s", req)
-                handler = self.__ws_routes.get(req.path)
-                if handler is not None:
-                    handle, is_coroutine, version = handler
-                    if version == Version.V1:
-                        if is_coroutine is True:
-                            userland_rep: Reply = await handle(req)
-                        else:
-                            userland_rep: Reply = handle(req)
-                        if userland_rep.code == protocol_types.error_code_t.OK:
-                            rep = protocol_types.req_rep_t()
-                            rep.payload = json.dumps(userland_rep.payload)
-                            rep.conn0_ref = req.conn0_ref
-                            rep.ref = req.ref
-                            await websocket.send_bytes(protocol.encode_msg(rep))
-                        else:
-                            rep = protocol_types.error2_rep_t()
-                            rep.code = userland_rep.code
-                            rep.desc = userland_rep.desc
-                            rep.conn0_ref = req.conn0_ref
-                            rep.ref = req.ref
-                            await websocket.send_bytes(protocol.encode_msg(rep))
-                    elif version == Version.V0:
-                        rep = protocol_types.req_rep_t()
-                        if is_coroutine is True:
-                            rep.payload = await handle(req)
-                        else:
-                            rep.payload = handle(req)
-                        rep.conn0_ref = req.conn0_ref
-                        rep.ref = req.ref
-                        await websocket.send_bytes(protocol.encode_msg(rep))
-                    else:
-                        raise SystemExit("Unknown version: %s" % version)
+                ws_route = self.__ws_routes.get(req.path)
+                if ws_route is not None:
+                    with self.__tracer.trace("ws", None, started_at) as trace:
+                        if trace is not None:
+                            trace.add_span(
+                                "decode", started_at, time.perf_counter() - started_at
+                            )
+                            trace.attributes["path"] = req.path
+                            trace.attributes["conn0_ref"] = req.conn0_ref
+                            trace.attributes["ref"] = req.ref
+                        try:
+                            await self.__reply_ws_route(writer, ws_route, req)
+                        except Exception:
+                            ws_route.count_error("exception")
+                            raise
+                        finally:
+                            ws_route.requests.inc()
+                            ws_route.latency.observe(time.perf_counter() - started_at)
                 else:
+                    ws_unknown_paths.inc()
                     logger.error("Unknown path: %s", req.path)
                     rep = protocol_types.error2_rep_t()
                     rep.code = protocol_types.error_code_t.UNKNOWN_PATH
                     rep.desc = "Unknown path: %s" % req.path
                     rep.conn0_ref = req.conn0_ref
                     rep.ref = req.ref
-                    await websocket.send_bytes(protocol.encode_msg(rep))
+                    await writer.send(protocol.encode_msg(rep))
             elif req.__class__ == protocol_types.ping_req_t:
                 rep = protocol_types.ping_rep_t()
                 rep.ref = req.ref
-                await websocket.send_bytes(protocol.encode_msg(rep))
+                await writer.send(protocol.encode_msg(rep))
             else:
                 logger.error("Received unknown msg: %s", req)
         except Exception:
@@ -229,6 +606,216 @@ class Service(FastAPI):
                 "Failed to handle msg: %s, error: %s", req, traceback.format_exc()
             )
 
+    async def __reply_ws_route(self, writer, ws_route, req):
+        if ws_route.is_stream:
+            await self.__stream_ws_route(writer, ws_route, req)
+            return
+
+        encoded_rep = None
+        if ws_route.cache is not None:
+            encoded_rep = ws_route.cache.get((req.path, req.payload))
+        if encoded_rep is None:
+            if ws_route.single_flight is not None:
+                encoded_rep = await ws_route.single_flight.do(
+                    req.payload,
+                    functools.partial(self.__build_encoded_rep, ws_route, req),
+                )
+            else:
+                encoded_rep = await self.__build_encoded_rep(ws_route, req)
+        seq = await writer.send(encoded_rep + encode_refs(req))
+        trace = current_trace()
+        if trace is not None:
+            # Until the writer has handed the reply to the websocket.
+            with trace.span("send"):
+                await writer.wait_sent(seq)
+
+    async def __stream_ws_route(self, writer, ws_route, req):
+        # Every chunk goes out as its own req_rep_t with the same refs, and an
+        # ok2_rep_t marks the end of the stream. Awaiting the writer keeps
+        # at most ws_writer_high_water_mark bytes of chunks in memory.
+        refs = encode_refs(req)
+        try:
+            chunks = ws_route.handle(req)
+            if inspect.isasyncgen(chunks):
+                async for chunk in chunks:
+                    await writer.send(encode_chunk(ws_route.codec, chunk) + refs)
+            else:
+                for chunk in chunks:
+                    await writer.send(encode_chunk(ws_route.codec, chunk) + refs)
+        except ConnectionError:
+            raise
+        except Exception as e:
+            logger.error(
+                "Failed to stream: path: %s, error: %s",
+                req.path,
+                traceback.format_exc(),
+            )
+            rep = protocol_types.error2_rep_t()
+            rep.code = protocol_types.error_code_t.SERVICE_ERROR
+            rep.desc = "Failed to stream: %s" % e
+            await writer.send(protocol.encode_msg(rep) + refs)
+            ws_route.count_error(rep.code)
+            return
+        await writer.send(STREAM_END + refs)
+
+    async def __build_encoded_rep(self, ws_route, req):
+        code, desc, payload = await self.__call_ws_route(ws_route, req)
+        with span("encode"):
+            if code == protocol_types.error_code_t.OK:
+                rep = protocol_types.req_rep_t()
+                rep.payload = payload
+                encoded_rep = protocol.encode_msg(rep)
+                if ws_route.cache is not None:
+                    ws_route.cache.put((req.path, req.payload), encoded_rep)
+            else:
+                ws_route.count_error(code)
+                rep = protocol_types.error2_rep_t()
+                rep.code = code
+                rep.desc = desc
+                encoded_rep = protocol.encode_msg(rep)
+        return encoded_rep
+
+    async def __call_ws_route(self, ws_route, req):
+        if ws_route.is_coroutine is True:
+            if ws_route.version == Version.V1:
+                with span("handle"):
+                    userland_rep: Reply = await ws_route.handle(req)
+                with span("serialize"):
+                    return build_result(userland_rep, ws_route.codec)
+            elif ws_route.version == Version.V0:
+                with span("handle"):
+                    rep_payload = await ws_route.handle(req)
+                return protocol_types.error_code_t.OK, "", rep_payload
+            else:
+                raise SystemExit("Unknown version: %s" % ws_route.version)
+        elif ws_route.executor is None:
+            # Runs inline, blocking the loop meanwhile.
+            started_at = time.perf_counter()
+            try:
+                return call_sync_handler(
+                    ws_route.handle, ws_route.version, ws_route.codec, req
+                )
+            finally:
+                self.__loop_monitor.check_handler(
+                    ws_route.path, time.perf_counter() - started_at
+                )
+        elif ws_route.executor == "thread":
+            return await Executor.singleton().run(
+                ws_route.executor,
+                call_sync_handler,
+                ws_route.handle,
+                ws_route.version,
+                ws_route.codec,
+                req,
+            )
+        else:
+            # The trace isn't propagated to other processes, the span includes
+            # the pickling and queueing then.
+            with span("handle"):
+                return await Executor.singleton().run(
+                    ws_route.executor,
+                    call_sync_handler_with_encoded_req,
+                    ws_route.handle,
+                    ws_route.version,
+                    ws_route.codec,
+                    req.SerializeToString(),
+                )
+
+    def __add_ws_route(self, path, version, executor, codec, cache, coalesce):
+        Executor.check_mode(executor)
+        codecs.check_codec(codec)
+
+        def decorator(func):
+            @functools.wraps(func)
+            def func_wrapper(*args, **kwargs):
+                value = func(*args, **kwargs)
+                return value
+
+            is_coroutine = inspect.iscoroutinefunction(func)
+            if is_coroutine and executor is not None:
+                raise ValueError(
+                    "The executor only applies to sync handlers: path: %s" % path
+                )
+            is_stream = inspect.isasyncgenfunction(func)
+            is_stream = is_stream or inspect.isgeneratorfunction(func)
+            if is_stream and (
+                executor is not None or cache is not None or coalesce is True
+            ):
+                raise ValueError(
+                    "Stream handlers can't use executor, cache or coalesce: path: %s"
+                    % path
+                )
+
+            ws_route = WsRoute(
+                func_wrapper,
+                is_coroutine,
+                version,
+                executor,
+                codec,
+                cache,
+                SingleFlight() if coalesce else None,
+                is_stream,
+            )
+            ws_route.bind_metrics(path)
+            with self.__routes_lock:
+                self.__ws_routes[path] = ws_route
+                self.__on_routes_change_callback(Change.ADD, path)
+
+            return func_wrapper
+
+        return decorator
+
     def __signal_handler(self, signal, frame):
         logger.info("Signal handler triggered: signal: %s, frame: %s", signal, frame)
         self.__running = False
+
+    def __profile_signal_handler(self, signum, frame):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("No serving loop to profile in this process.")
+            return
+        loop.call_soon_threadsafe(self.__start_profile)
+
+    def __start_profile(self):
+        if self.__profiler.is_running():
+            logger.warning("Already profiling, ignore the signal.")
+            return
+        self.__profile_task = asyncio.ensure_future(self.__profile_on_signal())
+
+    async def __profile_on_signal(self):
+        try:
+            await self.profile()
+        except Exception as e:
+            logger.error("Failed to profile: %s", e)
+
+
+# Registered once for all the services, so the metrics never keep one alive.
+Metrics.singleton().gauge_func(
+    "maxwell_ws_connections",
+    "Open ws connections.",
+    lambda: len(Service.get_all_ws_connection_stats()),
+)
+Metrics.singleton().gauge_func(
+    "maxwell_ws_inflight",
+    "Ws requests in flight.",
+    Service.get_all_ws_inflight,
+)
+Metrics.singleton().gauge_func(
+    "maxwell_ws_connection_inflight",
+    "Ws requests in flight, by connection.",
+    lambda: {
+        connection_id: stats["inflight"]
+        for connection_id, stats in Service.get_all_ws_connection_stats().items()
+    },
+    ("connection",),
+)
+Metrics.singleton().gauge_func(
+    "maxwell_ws_queued_bytes",
+    "Reply bytes queued in the ws writers, by connection.",
+    lambda: {
+        connection_id: stats["queued_bytes"]
+        for connection_id, stats in Service.get_all_ws_connection_stats().items()
+    },
+    ("connection",),
+)
@@ -0,0 +1,44 @@
+import asyncio
+
+
+class SingleFlight(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self):
+        self.__futures = {}  # key => future
+        self.__executions = 0
+        self.__coalesced = 0
+
+    async def do(self, key, func):
+        future = self.__futures.get(key)
+        if future is not None:
+            self.__coalesced += 1
+            # Shield the shared future, so a cancelled follower won't cancel the
+            # execution which the others are still waiting for.
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.__futures[key] = future
+        self.__executions += 1
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved, as there may be no followers.
+            future.exception()
+            raise
+        finally:
+            del self.__futures[key]
+
+    def get_stats(self):
+        return {
+            "executions": self.__executions,
+            "coalesced": self.__coalesced,
+            "inflight": len(self.__futures),
+        }
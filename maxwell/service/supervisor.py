@@ -0,0 +1,329 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uvicorn
+from uvicorn.importer import import_from_string
+from maxwell.utils.logger import get_logger
+
+from .tracer import Tracer
+
+logger = get_logger(__name__)
+
+# Set by a generation for the next one it spawns on reload.
+LISTEN_FD_ENV = "MAXWELL_LISTEN_FD"
+PARENT_PID_ENV = "MAXWELL_PARENT_PID"
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Lets another instance bind the same port while this one is still serving.
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+# Takes over the listening socket of the previous generation on reload, binds a
+# new one otherwise.
+def inherit_or_bind_socket(host, port):
+    listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if listen_fd is None:
+        return bind_socket(host, port)
+    logger.info("Inherited listening socket: fd: %s", listen_fd)
+    sock = socket.socket(fileno=int(listen_fd))
+    sock.set_inheritable(True)
+    return sock
+
+
+class DrainingServer(uvicorn.Server):
+    def __init__(
+        self,
+        config,
+        drain_timeout,
+        ready_event=None,
+        before_drain=None,
+        supervised=False,
+    ):
+        super().__init__(config)
+        self.__drain_timeout = drain_timeout
+        self.__ready_event = ready_event
+        self.__before_drain = before_drain
+        self.__supervised = supervised
+
+    async def startup(self, sockets=None):
+        # By now uvicorn and the service have installed their signal handlers.
+        if threading.current_thread() is threading.main_thread():
+            if self.__supervised:
+                # A Ctrl-C or a hangup reaches the whole process group, but the
+                # supervisor stops (one SIGTERM each) or reloads the workers.
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            else:
+                signal.signal(signal.SIGHUP, self.__reload_signal_handler)
+        await super().startup(sockets)
+        if self.started and self.__ready_event is not None:
+            self.__ready_event.set()
+
+    async def shutdown(self, sockets=None):
+        # Stops accepting first, then lets the ws requests in flight finish,
+        # before uvicorn closes the connections. All within one drain_timeout.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.__drain_timeout
+        for server in self.servers:
+            server.close()
+        if self.__before_drain is not None:
+            await self.__before_drain(self.__drain_timeout)
+        service = self.config.app
+        if isinstance(service, str):
+            service = import_from_string(service)
+        try:
+            if hasattr(service, "drain"):
+                if not await service.drain(max(deadline - loop.time(), 0)):
+                    logger.warning("Failed to drain in %ss.", self.__drain_timeout)
+            await super().shutdown(sockets)
+        finally:
+            # The trace writer is a daemon thread, the traces it still has
+            # queued are written before the process exits.
+            Tracer.singleton().close()
+
+    def __reload_signal_handler(self, signum, frame):
+        logger.warning("Reloading needs workers > 0, ignore the signal: %s", signum)
+
+
+def _run_worker(uvicorn_kwargs, sock, ready_event, drain_timeout):
+    # The supervisor handles SIGINT, workers only stop on SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = DrainingServer(
+        uvicorn.Config(**uvicorn_kwargs),
+        drain_timeout,
+        ready_event=ready_event,
+        supervised=True,
+    )
+    server.run(sockets=[sock])
+
+
+class Supervisor(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(
+        self,
+        uvicorn_kwargs,
+        sock,
+        workers,
+        restart_delay,
+        drain_timeout,
+        reload_timeout,
+        wait_ready=lambda timeout: True,
+        before_stop=lambda: None,
+        on_reload_failed=lambda: None,
+    ):
+        self.__uvicorn_kwargs = uvicorn_kwargs
+        self.__sock = sock
+        self.__workers = workers
+        self.__restart_delay = restart_delay
+        self.__drain_timeout = drain_timeout
+        self.__reload_timeout = reload_timeout
+        self.__wait_ready = wait_ready
+        self.__before_stop = before_stop
+        self.__on_reload_failed = on_reload_failed
+
+        # Workers are spawned rather than forked, as the supervisor already runs
+        # threads (e.g. the registrar) by then.
+        self.__context = multiprocessing.get_context("spawn")
+        self.__processes = [None] * workers
+        self.__ready_events = [None] * workers
+        self.__started_at = [0] * workers
+        self.__should_exit = threading.Event()
+        self.__should_reload = False
+        self.__handed_over = False
+        # Set while this is a next generation which hasn't taken over yet.
+        self.__parent_pid = None
+        self.__ready = False
+        self.__next_generation = None
+        self.__restarts = 0
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.__signal_handler)
+        signal.signal(signal.SIGTERM, self.__signal_handler)
+        signal.signal(signal.SIGHUP, self.__reload_signal_handler)
+        signal.signal(signal.SIGUSR2, self.__handover_signal_handler)
+        signal.signal(signal.SIGUSR1, self.__profile_signal_handler)
+
+        self.__parent_pid = os.environ.get(PARENT_PID_ENV)
+        logger.info("Starting %s workers...", self.__workers)
+        run_at = time.monotonic()
+        for index in range(self.__workers):
+            self.__spawn(index)
+        while not self.__should_exit.wait(0.1):
+            self.__restart_exited_workers()
+            if not self.__ready:
+                self.__check_ready(run_at)
+            if self.__should_reload:
+                self.__should_reload = False
+                self.__spawn_next_generation()
+            self.__check_next_generation()
+        self.__stop_all()
+
+    def stop(self):
+        self.__should_exit.set()
+
+    # Whether this generation stopped because the next one took over.
+    def is_handed_over(self):
+        return self.__handed_over
+
+    def get_stats(self):
+        return {
+            "workers": [
+                process.pid if process is not None else None
+                for process in self.__processes
+            ],
+            "restarts": self.__restarts,
+        }
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __spawn(self, index):
+        ready_event = self.__context.Event()
+        process = self.__context.Process(
+            target=_run_worker,
+            args=(
+                self.__uvicorn_kwargs,
+                self.__sock,
+                ready_event,
+                self.__drain_timeout,
+            ),
+            name=f"worker-{index}",
+            daemon=False,
+        )
+        process.start()
+        self.__processes[index] = process
+        self.__ready_events[index] = ready_event
+        self.__started_at[index] = time.monotonic()
+        logger.info("Started worker: index: %s, pid: %s", index, process.pid)
+
+    def __restart_exited_workers(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.__processes):
+            if process.is_alive():
+                continue
+            # A worker crashing right after its start is restarted no more often
+            # than every restart_delay seconds.
+            if now - self.__started_at[index] < self.__restart_delay:
+                continue
+            logger.warning(
+                "Worker exited, restart it: index: %s, pid: %s, exitcode: %s",
+                index,
+                process.pid,
+                process.exitcode,
+            )
+            self.__restarts += 1
+            self.__spawn(index)
+            # Only closed once replaced, get_stats may be reading its pid.
+            process.close()
+
+    # Called on every tick, never blocks the supervise loop.
+    def __check_ready(self, run_at):
+        workers_ready = all(ready_event.is_set() for ready_event in self.__ready_events)
+        if not workers_ready or not self.__wait_ready(0):
+            if time.monotonic() - run_at <= self.__reload_timeout:
+                return
+            if not workers_ready:
+                logger.error("Workers weren't ready in %ss.", self.__reload_timeout)
+            else:
+                logger.error("Service wasn't registered in %ss.", self.__reload_timeout)
+            # A new generation which can't warm up gives way to the old one.
+            if self.__parent_pid is not None:
+                self.__should_exit.set()
+            else:
+                self.__ready = True
+            return
+        self.__ready = True
+        logger.info("All %s workers are ready.", self.__workers)
+        os.environ.pop(PARENT_PID_ENV, None)
+        parent_pid, self.__parent_pid = self.__parent_pid, None
+        if parent_pid is not None:
+            logger.info("Taking over from the previous generation: pid: %s", parent_pid)
+            try:
+                os.kill(int(parent_pid), signal.SIGUSR2)
+            except ProcessLookupError:
+                pass
+
+    def __spawn_next_generation(self):
+        if self.__next_generation is not None:
+            logger.warning("Already reloading, ignore the signal.")
+            return
+        logger.info("Reloading, spawning the next generation...")
+        env = dict(os.environ)
+        env[LISTEN_FD_ENV] = str(self.__sock.fileno())
+        env[PARENT_PID_ENV] = str(os.getpid())
+        # The original args keep the interpreter options, and -m if any.
+        self.__next_generation = subprocess.Popen(
+            [sys.executable] + sys.orig_argv[1:],
+            env=env,
+            pass_fds=[self.__sock.fileno()],
+        )
+
+    def __check_next_generation(self):
+        if self.__next_generation is None or self.__handed_over:
+            return
+        exitcode = self.__next_generation.poll()
+        if exitcode is not None:
+            logger.error(
+                "The next generation exited before taking over: exitcode: %s",
+                exitcode,
+            )
+            self.__next_generation = None
+            # It may have set its own routes before giving up.
+            try:
+                self.__on_reload_failed()
+            except Exception as e:
+                logger.warning("Failed to run on reload failed: %s", e)
+
+    def __stop_all(self):
+        # On handover, the next generation has already set the same routes. A
+        # next generation which never took over leaves the routes to the
+        # previous one, which is still serving.
+        if not self.__handed_over and self.__parent_pid is None:
+            try:
+                self.__before_stop()
+            except Exception as e:
+                logger.warning("Failed to run before stop: %s", e)
+        logger.info("Stopping %s workers...", self.__workers)
+        for process in self.__processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.__processes:
+            process.join(timeout=self.__drain_timeout + 5)
+            if process.is_alive():
+                logger.warning("Killing worker: pid: %s", process.pid)
+                process.kill()
+                process.join()
+
+    def __signal_handler(self, signum, frame):
+        logger.info("Signal handler triggered: signal: %s", signum)
+        self.__should_exit.set()
+
+    def __reload_signal_handler(self, signum, frame):
+        logger.info("Reload signal triggered: signal: %s", signum)
+        self.__should_reload = True
+
+    def __profile_signal_handler(self, signum, frame):
+        # Every worker profiles itself.
+        for process in self.__processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signal.SIGUSR1)
+
+    def __handover_signal_handler(self, signum, frame):
+        logger.info("The next generation has taken over, stopping...")
+        self.__handed_over = True
+        self.__should_exit.set()
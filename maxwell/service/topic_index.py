@@ -0,0 +1,178 @@
+import asyncio
+import collections
+import time
+from maxwell.utils.logger import get_logger
+
+from .config import Config
+
+logger = get_logger(__name__)
+
+
+class TopicIndex(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, maxsize=None, ttl=None, negative_ttl=None):
+        self.__maxsize = (
+            maxsize
+            if maxsize is not None
+            else Config.singleton().get_endpoint_cache_size()
+        )
+        self.__ttl = (
+            ttl if ttl is not None else Config.singleton().get_endpoint_cache_ttl()
+        )
+        self.__negative_ttl = (
+            negative_ttl
+            if negative_ttl is not None
+            else Config.singleton().get_endpoint_negative_cache_ttl()
+        )
+
+        # topic => (expire_at, endpoint, epoch)
+        self.__entries = collections.OrderedDict()
+        self.__failures = {}  # topic => (expire_at, exception)
+        self.__loading_futures = {}  # topic => future
+        self.__refresh_tasks = {}  # topic => task
+        self.__generation = 0
+        self.__epoch = 0
+        self.__version = 0
+
+        self.__hits = 0
+        self.__stale_hits = 0
+        self.__negative_hits = 0
+        self.__misses = 0
+        self.__coalesced = 0
+        self.__clears = 0
+
+    def get(self, topic):
+        entry = self.__entries.get(topic)
+        if entry is None or self.__is_stale(entry):
+            return None
+        self.__entries.move_to_end(topic)
+        return entry[1]
+
+    def put(self, topic, endpoint):
+        self.__entries[topic] = (time.monotonic() + self.__ttl, endpoint, self.__epoch)
+        self.__entries.move_to_end(topic)
+        self.__failures.pop(topic, None)
+        self.__version += 1
+        while len(self.__entries) > self.__maxsize:
+            self.__entries.popitem(last=False)
+
+    def put_many(self, items):
+        for topic, endpoint in items:
+            self.put(topic, endpoint)
+
+    def items(self):
+        return [
+            (topic, entry[1])
+            for topic, entry in self.__entries.items()
+            if not self.__is_stale(entry)
+        ]
+
+    def delete(self, topic):
+        self.__entries.pop(topic, None)
+
+    def clear(self):
+        self.__entries.clear()
+        self.__failures.clear()
+        self.__generation += 1
+        self.__clears += 1
+
+    def mark_all_stale(self):
+        # Stale entries are still served, but each one is re-loaded in the
+        # background the next time it is asked for.
+        self.__epoch += 1
+        self.__failures.clear()
+
+    async def get_or_load(self, topic, load):
+        entry = self.__entries.get(topic)
+        if entry is not None:
+            self.__entries.move_to_end(topic)
+            if self.__is_stale(entry):
+                self.__stale_hits += 1
+                self.__refresh_later(topic, load)
+            else:
+                self.__hits += 1
+            return entry[1]
+
+        failure = self.__failures.get(topic)
+        if failure is not None:
+            expire_at, exception = failure
+            if expire_at > time.monotonic():
+                self.__negative_hits += 1
+                raise exception.with_traceback(None)
+            del self.__failures[topic]
+
+        self.__misses += 1
+        return await self.__load(topic, load)
+
+    def version(self):
+        return self.__version
+
+    def size(self):
+        return len(self.__entries)
+
+    def get_stats(self):
+        return {
+            "hits": self.__hits,
+            "stale_hits": self.__stale_hits,
+            "negative_hits": self.__negative_hits,
+            "misses": self.__misses,
+            "coalesced": self.__coalesced,
+            "clears": self.__clears,
+            "size": len(self.__entries),
+            "refreshing": len(self.__refresh_tasks),
+        }
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __is_stale(self, entry):
+        expire_at, _, epoch = entry
+        return epoch != self.__epoch or expire_at <= time.monotonic()
+
+    async def __load(self, topic, load):
+        future = self.__loading_futures.get(topic)
+        if future is not None:
+            self.__coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.__loading_futures[topic] = future
+        generation = self.__generation
+        try:
+            endpoint = await load(topic)
+            # Don't resurrect an endpoint which was loaded before a clear.
+            if generation == self.__generation:
+                self.put(topic, endpoint)
+            future.set_result(endpoint)
+            return endpoint
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            # Remember the failure for a short while, so an unavailable master
+            # doesn't turn every lookup into a blocking round trip.
+            if generation == self.__generation:
+                self.__failures[topic] = (time.monotonic() + self.__negative_ttl, e)
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self.__loading_futures[topic]
+
+    def __refresh_later(self, topic, load):
+        if topic in self.__loading_futures or topic in self.__refresh_tasks:
+            return
+        failure = self.__failures.get(topic)
+        if failure is not None and failure[0] > time.monotonic():
+            return
+        task = asyncio.get_running_loop().create_task(self.__refresh(topic, load))
+        self.__refresh_tasks[topic] = task
+        task.add_done_callback(lambda _task: self.__refresh_tasks.pop(topic, None))
+
+    async def __refresh(self, topic, load):
+        try:
+            await self.__load(topic, load)
+        except Exception as e:
+            logger.warning("Failed to refresh: topic: %s, error: %s", topic, e)
@@ -0,0 +1,80 @@
+import contextlib
+import os
+import sqlite3
+import tempfile
+from maxwell.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class TopicIndexSnapshot(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, path):
+        self.__path = path
+
+    def load(self):
+        if not os.path.exists(self.__path):
+            return None, []
+        try:
+            # A sqlite3 connection as a context manager only commits, it is
+            # closed by closing.
+            with contextlib.closing(sqlite3.connect(self.__path)) as conn:
+                row = conn.execute(
+                    "SELECT value FROM meta WHERE key = 'checksum'"
+                ).fetchone()
+                if row is None:
+                    return None, []
+                items = conn.execute("SELECT topic, endpoint FROM topics").fetchall()
+            return int(row[0]), items
+        except Exception as e:
+            logger.warning(
+                "Failed to load snapshot: path: %s, error: %s", self.__path, e
+            )
+            return None, []
+
+    def save(self, checksum, items):
+        # Write to a temporary file and swap it in, so a crash never leaves a
+        # half written snapshot behind. Every locatlizer, of every worker
+        # process, saves to the same path, so each writes its own temporary
+        # file.
+        tmp_path = None
+        try:
+            dir_path = os.path.dirname(os.path.abspath(self.__path))
+            os.makedirs(dir_path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=os.path.basename(self.__path) + ".", suffix=".tmp", dir=dir_path
+            )
+            os.close(fd)
+            with contextlib.closing(sqlite3.connect(tmp_path)) as conn:
+                with conn:
+                    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                    conn.execute(
+                        "CREATE TABLE topics (topic TEXT PRIMARY KEY, endpoint TEXT)"
+                    )
+                    conn.execute(
+                        "INSERT INTO meta (key, value) VALUES ('checksum', ?)",
+                        (str(checksum),),
+                    )
+                    conn.executemany(
+                        "INSERT INTO topics (topic, endpoint) VALUES (?, ?)", items
+                    )
+            os.replace(tmp_path, self.__path)
+            tmp_path = None
+            logger.info(
+                "Saved snapshot: path: %s, checksum: %s, topics: %s",
+                self.__path,
+                checksum,
+                len(items),
+            )
+        except Exception as e:
+            logger.warning(
+                "Failed to save snapshot: path: %s, error: %s", self.__path, e
+            )
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
@@ -1,76 +1,239 @@
-from async_lru import alru_cache
+import asyncio
+import weakref
 import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
 from maxwell.utils.connection import Event
 from maxwell.utils.logger import get_logger
 
 from .config import Config
 from .master_client import MasterClient
+from .metrics import Metrics
+from .topic_index import TopicIndex
+from .topic_index_snapshot import TopicIndexSnapshot
 
 logger = get_logger(__name__)
 
 
 class TopicLocatlizer(object):
+    # Every live locatlizer, so their topic indexes can be scraped.
+    __instances = weakref.WeakSet()
+
     # ===========================================
     # apis
     # ===========================================
-    def __init__(self, loop):
+    @staticmethod
+    def get_topic_index_stats():
+        # Locatlizers may share a topic index, count each one only once.
+        topic_indexes = {
+            id(topic_index): topic_index
+            for topic_index in (
+                locatlizer.get_topic_index()
+                for locatlizer in list(TopicLocatlizer.__instances)
+            )
+        }
+        stats = {}
+        for topic_index in topic_indexes.values():
+            for key, value in topic_index.get_stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def __init__(self, loop, topic_index=None):
         self.__loop = loop
 
         self.__checksum = 0
+        # Pass the same topic_index to share it between locatlizers on purpose.
+        self.__owns_topic_index = topic_index is None
+        self.__topic_index = topic_index if topic_index is not None else TopicIndex()
         self.__master_client = MasterClient(
             Config.singleton().get_master_endpoints(),
             {"reconnect_delay": 1, "ping_interval": 10},
             self.__loop,
+            name="topic_locatlizer",
         )
         self.__master_client.add_connection_listener(
             Event.ON_CONNECTED, self.__on_connected_to_master
         )
+        self.__repeat_check_task = self.__loop.create_task(self.__repeat_check())
+
+        # The snapshot is only trusted once the master confirms its checksum,
+        # lookups wait a bit for that first check instead of going to the master.
+        self.__snapshot = None
+        self.__snapshot_items = None
+        self.__saved_version = -1
+        self.__first_checked_event = asyncio.Event()
+        self.__first_checked_event.set()
+        self.__load_snapshot_task = None
+        self.__repeat_save_task = None
+        snapshot_file = Config.singleton().get_endpoint_snapshot_file()
+        if snapshot_file is not None:
+            self.__snapshot = TopicIndexSnapshot(snapshot_file)
+            self.__first_checked_event.clear()
+            self.__load_snapshot_task = self.__loop.create_task(self.__load_snapshot())
+            self.__repeat_save_task = self.__loop.create_task(self.__repeat_save())
+
+        TopicLocatlizer.__instances.add(self)
 
     async def close(self):
+        TopicLocatlizer.__instances.discard(self)
         self.__master_client.delete_connection_listener(
             Event.ON_CONNECTED, self.__on_connected_to_master
         )
+        self.__repeat_check_task.cancel()
+        if self.__load_snapshot_task is not None:
+            self.__load_snapshot_task.cancel()
+        if self.__repeat_save_task is not None:
+            self.__repeat_save_task.cancel()
+            await self.__save()
         await self.__master_client.close()
-        self.locate.cache_clear()
-        await self.locate.cache_close()
+        if self.__owns_topic_index:
+            self.__topic_index.clear()
 
-    @alru_cache(
-        maxsize=Config.singleton().get_endpoint_cache_size(),
-        ttl=Config.singleton().get_endpoint_cache_ttl(),
-    )
     async def locate(self, topic):
+        if not self.__first_checked_event.is_set():
+            await self.__wait_first_checked()
+        return await self.__topic_index.get_or_load(topic, self.__locate)
+
+    # Returns the endpoints in the order of topics, with the exception in place
+    # of the endpoint for every topic which failed to be located.
+    async def locate_many(self, topics):
+        return await asyncio.gather(
+            *[self.locate(topic) for topic in topics], return_exceptions=True
+        )
+
+    def get_topic_index(self):
+        return self.__topic_index
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    async def __wait_first_checked(self):
+        try:
+            await asyncio.wait_for(
+                self.__first_checked_event.wait(),
+                Config.singleton().get_endpoint_snapshot_verify_timeout(),
+            )
+        except asyncio.TimeoutError:
+            logger.debug("Snapshot isn't verified yet, locate with the master.")
+
+    async def __locate(self, topic):
         req = protocol_types.locate_topic_req_t()
         req.topic = topic
         rep = await self.__master_client.request(req)
         return rep.endpoint
 
-    # ===========================================
-    # internal functions
-    # ===========================================
     def __on_connected_to_master(self, *argv, **kwargs):
         self.__loop.create_task(self.__check())
 
+    async def __repeat_check(self):
+        interval = Config.singleton().get_topic_dist_checksum_interval()
+        while True:
+            await asyncio.sleep(interval)
+            await self.__check()
+
     async def __check(self):
+        # The snapshot's checksum must be known before it is compared.
+        if self.__load_snapshot_task is not None:
+            await asyncio.shield(self.__load_snapshot_task)
+
         req = protocol_types.get_topic_dist_checksum_req_t()
-        logger.info("Getting TopicDistChecksum: req: %s", req)
+        logger.debug("Getting TopicDistChecksum: req: %s", req)
         try:
             rep = await self.__master_client.request(req)
-            logger.info("Successfully to get TopicDistChecksum: rep: %s", rep)
+            logger.debug("Successfully to get TopicDistChecksum: rep: %s", rep)
         except Exception as e:
             logger.error("Failed to get TopicDistChecksum: %s", e)
+            self.__first_checked_event.set()
             return
 
+        if self.__snapshot_items is not None:
+            self.__apply_snapshot(rep.checksum)
+        self.__first_checked_event.set()
+
         if self.__checksum != rep.checksum:
             logger.info(
-                "TopicDistChecksum has changed: local: %s, remote: %s, clear cache...",
+                "TopicDistChecksum has changed: local: %s, remote: %s, revalidate...",
                 self.__checksum,
                 rep.checksum,
             )
             self.__checksum = rep.checksum
-            self.locate.cache_clear()
+            self.__topic_index.mark_all_stale()
         else:
-            logger.info(
+            logger.debug(
                 "TopicDistChecksum stays the same: local: %s, remote: %s, do nothing.",
                 self.__checksum,
                 rep.checksum,
             )
+
+    async def __load_snapshot(self):
+        checksum, items = await self.__loop.run_in_executor(None, self.__snapshot.load)
+        if checksum is None or len(items) == 0:
+            self.__first_checked_event.set()
+            return
+        logger.info(
+            "Loaded snapshot: checksum: %s, topics: %s, waiting for verification...",
+            checksum,
+            len(items),
+        )
+        self.__checksum = checksum
+        self.__snapshot_items = items
+
+    def __apply_snapshot(self, checksum):
+        items = self.__snapshot_items
+        self.__snapshot_items = None
+        if self.__checksum == checksum:
+            logger.info("Snapshot verified, warm up with %s topics.", len(items))
+            self.__topic_index.put_many(items)
+            self.__saved_version = self.__topic_index.version()
+        else:
+            logger.info(
+                "Snapshot is outdated: local: %s, remote: %s, discard it.",
+                self.__checksum,
+                checksum,
+            )
+
+    async def __repeat_save(self):
+        interval = Config.singleton().get_endpoint_snapshot_interval()
+        while True:
+            await asyncio.sleep(interval)
+            await self.__save()
+
+    async def __save(self):
+        # Only entries confirmed under the current checksum are saved, and only
+        # when something has changed since the last save.
+        if self.__checksum == 0 or self.__snapshot_items is not None:
+            return
+        version = self.__topic_index.version()
+        if version == self.__saved_version:
+            return
+        checksum = self.__checksum
+        items = self.__topic_index.items()
+        self.__saved_version = version
+        await self.__loop.run_in_executor(None, self.__snapshot.save, checksum, items)
+
+
+def _count_lookups():
+    stats = TopicLocatlizer.get_topic_index_stats()
+    return {
+        "hit": stats.get("hits", 0),
+        "stale_hit": stats.get("stale_hits", 0),
+        "negative_hit": stats.get("negative_hits", 0),
+        "miss": stats.get("misses", 0),
+        "coalesced": stats.get("coalesced", 0),
+    }
+
+
+Metrics.singleton().counter_func(
+    "maxwell_topic_index_lookups_total",
+    "Topic lookups, by result.",
+    _count_lookups,
+    ("result",),
+)
+Metrics.singleton().counter_func(
+    "maxwell_topic_index_clears_total",
+    "Times the topic index was cleared.",
+    lambda: TopicLocatlizer.get_topic_index_stats().get("clears", 0),
+)
+Metrics.singleton().gauge_func(
+    "maxwell_topic_index_size",
+    "Topics in the topic index.",
+    lambda: TopicLocatlizer.get_topic_index_stats().get("size", 0),
+)
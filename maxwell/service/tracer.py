@@ -0,0 +1,255 @@
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from maxwell.utils.logger import get_logger
+
+from .config import Config
+
+logger = get_logger(__name__)
+
+# Shared by every unsampled request, so tracing costs a lookup when it is off.
+NULL_SCOPE = contextlib.nullcontext()
+
+_current_trace = contextvars.ContextVar("maxwell_current_trace", default=None)
+
+
+# Returns the trace of the request being handled, or None if it isn't sampled.
+# Handlers may add their own spans and attributes to it.
+def current_trace():
+    return _current_trace.get()
+
+
+# Times a stage of the current trace, does nothing if there is none.
+def span(name):
+    trace = _current_trace.get()
+    if trace is None:
+        return NULL_SCOPE
+    return trace.span(name)
+
+
+class Span(object):
+    __slots__ = ("trace", "name", "started_at")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.started_at = 0
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add_span(
+            self.name, self.started_at, time.perf_counter() - self.started_at
+        )
+
+
+class Trace(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, name, attributes, started_at=None):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.attributes = attributes
+        self.timestamp = time.time()
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.duration = None
+        self.spans = []  # [(name, offset, duration), ...]
+
+    def span(self, name):
+        return Span(self, name)
+
+    def add_span(self, name, started_at, duration):
+        self.spans.append((name, started_at - self.started_at, duration))
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started_at
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "spans": [
+                {"name": name, "offset": offset, "duration": duration}
+                for name, offset, duration in self.spans
+            ],
+        }
+
+
+class TraceScope(object):
+    __slots__ = ("tracer", "trace", "token")
+
+    def __init__(self, tracer, trace):
+        self.tracer = tracer
+        self.trace = trace
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc_info):
+        _current_trace.reset(self.token)
+        self.tracer.finish(self.trace)
+
+
+class RingBufferExporter(object):
+    def __init__(self, size):
+        self.__traces = collections.deque(maxlen=size)
+
+    def export(self, trace):
+        self.__traces.append(trace)
+
+    def get_traces(self, limit=None):
+        traces = list(self.__traces)
+        traces.reverse()
+        return traces[:limit] if limit is not None else traces
+
+    def close(self):
+        pass
+
+
+# Writes the traces on its own thread, so a slow disk never stalls the serving
+# loop. Raises queue.Full when the writer falls more than queue_size behind.
+class JsonLinesExporter(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, path, queue_size):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.__file = open(path, "at")
+        self.__queue = queue.Queue(queue_size)
+        self.__closed = False
+        self.__close_lock = threading.Lock()
+        self.__thread = threading.Thread(
+            target=self.__write, name="trace-writer", daemon=True
+        )
+        self.__thread.start()
+
+    def export(self, trace):
+        if self.__closed:
+            raise ValueError("Exporter closed")
+        self.__queue.put_nowait(trace)
+
+    # Writes the traces queued already, then closes the file. Only the first
+    # call does so.
+    def close(self):
+        with self.__close_lock:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__file.close()
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    def __write(self):
+        while True:
+            trace = self.__queue.get()
+            if trace is None:
+                break
+            try:
+                self.__file.write(json.dumps(trace.to_dict(), default=str) + "\n")
+                if self.__queue.empty():
+                    self.__file.flush()
+            except Exception as e:
+                logger.warning("Failed to write trace: %s", e)
+        self.__file.flush()
+
+
+class Tracer(object):
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    # ===========================================
+    # apis
+    # ===========================================
+    @staticmethod
+    def singleton():
+        with Tracer.__instance_lock:
+            if Tracer.__instance is None:
+                exporters = [
+                    RingBufferExporter(Config.singleton().get_trace_buffer_size())
+                ]
+                trace_file = Config.singleton().get_trace_file()
+                if trace_file is not None:
+                    exporters.append(
+                        JsonLinesExporter(
+                            trace_file, Config.singleton().get_trace_queue_size()
+                        )
+                    )
+                Tracer.__instance = Tracer(
+                    Config.singleton().get_trace_sample_rate(), exporters
+                )
+            return Tracer.__instance
+
+    def __init__(self, sample_rate, exporters):
+        self.__sample_rate = sample_rate
+        self.__exporters = exporters
+
+        self.__sampled = 0
+        self.__dropped = 0
+
+    # Returns a context manager which yields a new trace, made current within
+    # it, if sampled. Yields None if not, or if there is a current trace
+    # already, whose spans then cover this part too.
+    # The started_at is a time.perf_counter() taken before, if the trace covers
+    # work done before it is known whether to trace.
+    def trace(self, name, attributes=None, started_at=None):
+        if self.__sample_rate <= 0 or _current_trace.get() is not None:
+            return NULL_SCOPE
+        if self.__sample_rate < 1 and random.random() >= self.__sample_rate:
+            return NULL_SCOPE
+        self.__sampled += 1
+        return TraceScope(self, Trace(name, attributes or {}, started_at))
+
+    def finish(self, trace):
+        trace.finish()
+        for exporter in self.__exporters:
+            try:
+                exporter.export(trace)
+            except queue.Full:
+                self.__dropped += 1
+            except Exception as e:
+                self.__dropped += 1
+                logger.warning("Failed to export trace: %s", e)
+
+    # Returns the latest traces kept in memory, the latest first.
+    def get_traces(self, limit=None):
+        for exporter in self.__exporters:
+            if isinstance(exporter, RingBufferExporter):
+                return [trace.to_dict() for trace in exporter.get_traces(limit)]
+        return []
+
+    def get_stats(self):
+        return {
+            "sample_rate": self.__sample_rate,
+            "sampled": self.__sampled,
+            "dropped": self.__dropped,
+        }
+
+    # Flushes the exporters, e.g. the traces still queued for the file, which
+    # would be lost with the writer thread otherwise. The next singleton() call
+    # gets a new tracer.
+    def close(self):
+        with Tracer.__instance_lock:
+            if Tracer.__instance is self:
+                Tracer.__instance = None
+        for exporter in self.__exporters:
+            exporter.close()
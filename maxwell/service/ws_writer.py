@@ -0,0 +1,119 @@
+import asyncio
+import collections
+from maxwell.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class WsWriter(object):
+    # ===========================================
+    # apis
+    # ===========================================
+    def __init__(self, websocket, high_water_mark, low_water_mark):
+        self.__websocket = websocket
+        self.__high_water_mark = high_water_mark
+        self.__low_water_mark = low_water_mark
+
+        self.__frames = collections.deque()
+        self.__bytes = 0
+        self.__has_frames_event = asyncio.Event()
+        self.__drained_event = asyncio.Event()
+        self.__drained_event.set()
+        self.__closed = False
+        self.__write_task = None
+        self.__queued_total = 0
+        self.__sent_event = None  # only while someone waits in wait_sent
+
+        self.__max_bytes = 0
+        self.__sent_frames = 0
+        self.__sent_batches = 0
+        self.__throttled = 0
+
+    def start(self):
+        if self.__write_task is None:
+            self.__write_task = asyncio.ensure_future(self.__repeat_write())
+
+    async def close(self):
+        self.__toggle_to_closed()
+        if self.__write_task is not None:
+            self.__write_task.cancel()
+            try:
+                await self.__write_task
+            except asyncio.CancelledError:
+                pass
+            self.__write_task = None
+
+    # Returns the seq of the frame, to wait for it via wait_sent.
+    async def send(self, frame):
+        if self.__bytes >= self.__high_water_mark and not self.__closed:
+            self.__throttled += 1
+            while self.__bytes >= self.__high_water_mark and not self.__closed:
+                await self.__drained_event.wait()
+        if self.__closed:
+            raise ConnectionError("The ws writer was already closed.")
+        self.__frames.append(frame)
+        self.__bytes += len(frame)
+        if self.__bytes > self.__max_bytes:
+            self.__max_bytes = self.__bytes
+        if self.__bytes >= self.__high_water_mark:
+            self.__drained_event.clear()
+        self.__has_frames_event.set()
+        self.__queued_total += 1
+        return self.__queued_total
+
+    # Waits until the frame of the seq was handed to the websocket, or the
+    # writer was closed.
+    async def wait_sent(self, seq):
+        while self.__sent_frames < seq and not self.__closed:
+            if self.__sent_event is None:
+                self.__sent_event = asyncio.Event()
+            await self.__sent_event.wait()
+
+    def get_stats(self):
+        return {
+            "queued_frames": len(self.__frames),
+            "queued_bytes": self.__bytes,
+            "max_queued_bytes": self.__max_bytes,
+            "sent_frames": self.__sent_frames,
+            "sent_batches": self.__sent_batches,
+            "throttled": self.__throttled,
+        }
+
+    # ===========================================
+    # internal functions
+    # ===========================================
+    async def __repeat_write(self):
+        try:
+            while not self.__closed:
+                await self.__has_frames_event.wait()
+                self.__has_frames_event.clear()
+                await self.__write_all()
+        except Exception as e:
+            logger.warning("Failed to write, close the ws writer: %s", e)
+            self.__toggle_to_closed()
+
+    async def __write_all(self):
+        # Flushes everything queued so far in one wakeup, rather than scheduling
+        # a send per reply.
+        while self.__frames:
+            frame = self.__frames.popleft()
+            self.__bytes -= len(frame)
+            if self.__bytes <= self.__low_water_mark:
+                self.__drained_event.set()
+            await self.__websocket.send_bytes(frame)
+            self.__sent_frames += 1
+        self.__sent_batches += 1
+        self.__notify_sent()
+
+    def __notify_sent(self):
+        if self.__sent_event is not None:
+            self.__sent_event.set()
+            self.__sent_event = None
+
+    def __toggle_to_closed(self):
+        self.__closed = True
+        self.__frames.clear()
+        self.__bytes = 0
+        self.__has_frames_event.set()
+        self.__drained_event.set()
+        self.__notify_sent()
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import pytest
+import websockets
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+import maxwell.protocol.maxwell_protocol as protocol
+
+
+# Acks a push after as many ms as the value has bytes, and fails the pushes to
+# "*/fail" topics. Holds every request while hold is cleared.
+class FakeConnection(object):
+    instances = []
+    hold = None
+
+    def __init__(self, endpoint, options, loop):
+        self.__endpoint = endpoint
+        self.listeners = []
+        self.requests = []
+        self.closed = False
+        FakeConnection.instances.append(self)
+
+    def endpoint(self):
+        return self.__endpoint
+
+    def add_listener(self, event, callback):
+        self.listeners.append((event, callback))
+
+    def delete_listener(self, event, callback):
+        self.listeners.remove((event, callback))
+
+    async def wait_open(self):
+        pass
+
+    async def request(self, msg):
+        self.requests.append(msg)
+        if FakeConnection.hold is not None:
+            await FakeConnection.hold.wait()
+        if isinstance(msg, protocol_types.push_req_t):
+            await asyncio.sleep(len(msg.value) / 1000)
+            if msg.topic.endswith("/fail"):
+                raise ConnectionError("Failed to push: %s" % msg.topic)
+            return protocol_types.push_rep_t(ref=len(msg.value))
+        return None
+
+    async def close(self):
+        self.closed = True
+
+
+# Locates "<endpoint>/<name>" topics to the endpoint, fails "unknown/*" ones.
+class FakeTopicLocatlizer(object):
+    def __init__(self, loop):
+        pass
+
+    async def locate(self, topic):
+        endpoint = topic.split("/")[0]
+        if endpoint == "unknown":
+            raise LookupError("Failed to locate: %s" % topic)
+        return endpoint
+
+    async def locate_many(self, topics):
+        return await asyncio.gather(
+            *[self.locate(topic) for topic in topics], return_exceptions=True
+        )
+
+    async def close(self):
+        pass
+
+
+# Locates every topic to the located endpoint, after locate_delay seconds, or
+# replies an error then when locate_error is set. Never replies to checksum
+# requests when checksum is None, like a master which is reachable but too slow.
+# Keeps the set_routes reqs it got.
+class FakeMaster(object):
+    def __init__(self, checksum, located="backend:1"):
+        self.checksum = checksum
+        self.located = located
+        self.locate_delay = 0
+        self.locate_error = False
+        self.locates = 0
+        self.registers = 0
+        self.set_routes = []
+        self.__server = None
+        self.__loop = None
+        self.__websockets = set()
+
+    async def start(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__server = await websockets.serve(self.__handle, "127.0.0.1", 0)
+        return self
+
+    # Closes the open connections, from any thread.
+    def disconnect(self):
+        for websocket in list(self.__websockets):
+            asyncio.run_coroutine_threadsafe(websocket.close(), self.__loop)
+
+    async def stop(self):
+        self.__server.close()
+        await self.__server.wait_closed()
+
+    def endpoint(self):
+        return "127.0.0.1:%s" % self.__server.sockets[0].getsockname()[1]
+
+    async def __handle(self, websocket):
+        self.__websockets.add(websocket)
+        try:
+            async for data in websocket:
+                req = protocol.decode_msg(data)
+                if isinstance(req, protocol_types.locate_topic_req_t):
+                    self.locates += 1
+                    await asyncio.sleep(self.locate_delay)
+                    if self.locate_error:
+                        rep = protocol_types.error_rep_t(code=1, desc="Failed")
+                    else:
+                        rep = protocol_types.locate_topic_rep_t(endpoint=self.located)
+                elif isinstance(req, protocol_types.get_topic_dist_checksum_req_t):
+                    if self.checksum is None:
+                        continue
+                    rep = protocol_types.get_topic_dist_checksum_rep_t(
+                        checksum=self.checksum
+                    )
+                elif isinstance(req, protocol_types.register_service_req_t):
+                    self.registers += 1
+                    rep = protocol_types.register_service_rep_t()
+                elif isinstance(req, protocol_types.set_routes_req_t):
+                    self.set_routes.append(req)
+                    rep = protocol_types.set_routes_rep_t()
+                elif isinstance(req, protocol_types.ping_req_t):
+                    rep = protocol_types.ping_rep_t()
+                else:
+                    continue
+                rep.ref = req.ref
+                await websocket.send(protocol.encode_msg(rep))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.__websockets.discard(websocket)
+
+
+@pytest.fixture
+def fake_connections(monkeypatch):
+    monkeypatch.setattr("maxwell.service.connection_pool.Connection", FakeConnection)
+    FakeConnection.instances = []
+    FakeConnection.hold = None
+    yield FakeConnection
+    FakeConnection.instances = []
+    FakeConnection.hold = None
+
+
+@pytest.fixture
+def fake_backend(monkeypatch, fake_connections):
+    monkeypatch.setattr(
+        "maxwell.service.publisher.TopicLocatlizer", FakeTopicLocatlizer
+    )
+    return fake_connections
+
+
+# A FakeMaster on its own loop and thread, for the code which talks to the
+# master from threads or loops of its own. Set as the master_endpoints.
+@pytest.fixture
+def fake_master(monkeypatch):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    master = asyncio.run_coroutine_threadsafe(FakeMaster(1).start(), loop).result(5)
+    monkeypatch.setenv("master_endpoints", master.endpoint())
+    yield master
+    asyncio.run_coroutine_threadsafe(master.stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
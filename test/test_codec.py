@@ -0,0 +1,19 @@
+import json
+import pytest
+from maxwell.service import codec as codecs
+
+
+class TestCodec:
+    def test_json(self):
+        assert codecs.encode("json", {"a": 1}) == json.dumps({"a": 1})
+
+    def test_raw(self):
+        assert codecs.encode("raw", '{"a": 1}') == '{"a": 1}'
+        assert codecs.encode("raw", b'{"a": 1}') == b'{"a": 1}'
+        with pytest.raises(TypeError):
+            codecs.encode("raw", {"a": 1})
+
+    def test_check_codec(self):
+        codecs.check_codec("json")
+        with pytest.raises(ValueError):
+            codecs.check_codec("pickle")
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from maxwell.service.connection_pool import ConnectionPool
+from maxwell.service.publisher import Publisher
+
+
+def new_connection_pool(max_size, grow_threshold):
+    return ConnectionPool(
+        endpoint="b0",
+        options={},
+        loop=asyncio.get_running_loop(),
+        max_size=max_size,
+        grow_threshold=grow_threshold,
+        on_disconnected=lambda connection: None,
+    )
+
+
+async def start_requests(connection_pool, count):
+    tasks = []
+    for _ in range(count):
+        tasks.append(asyncio.ensure_future(connection_pool.request(None)))
+        # Lets the request pick its slot before the next one.
+        await asyncio.sleep(0)
+    return tasks
+
+
+class TestConnectionPool:
+    @pytest.mark.asyncio
+    async def test_grow_past_threshold(self, fake_connections):
+        fake_connections.hold = asyncio.Event()
+        connection_pool = new_connection_pool(4, 2)
+        tasks = await start_requests(connection_pool, 2)
+        assert connection_pool.size() == 1
+        tasks += await start_requests(connection_pool, 1)
+        assert connection_pool.size() == 2
+        assert [slot["outstanding"] for slot in connection_pool.get_stats()] == [2, 1]
+        fake_connections.hold.set()
+        await asyncio.gather(*tasks)
+        await connection_pool.close()
+
+    @pytest.mark.asyncio
+    async def test_pick_less_loaded_slot(self, fake_connections):
+        fake_connections.hold = asyncio.Event()
+        connection_pool = new_connection_pool(2, 2)
+        tasks = await start_requests(connection_pool, 3)
+        assert [slot["outstanding"] for slot in connection_pool.get_stats()] == [2, 1]
+        # Of the two slots, the less loaded one always gets the request.
+        tasks += await start_requests(connection_pool, 1)
+        assert [slot["outstanding"] for slot in connection_pool.get_stats()] == [2, 2]
+        fake_connections.hold.set()
+        await asyncio.gather(*tasks)
+        await connection_pool.close()
+
+    @pytest.mark.asyncio
+    async def test_max_size(self, fake_connections):
+        fake_connections.hold = asyncio.Event()
+        connection_pool = new_connection_pool(3, 1)
+        tasks = await start_requests(connection_pool, 30)
+        assert connection_pool.size() == 3
+        assert sum(slot["outstanding"] for slot in connection_pool.get_stats()) == 30
+        fake_connections.hold.set()
+        await asyncio.gather(*tasks)
+        assert sum(slot["requests"] for slot in connection_pool.get_stats()) == 30
+        await connection_pool.close()
+
+    @pytest.mark.asyncio
+    async def test_reap_idle_slots(self, fake_connections):
+        fake_connections.hold = asyncio.Event()
+        connection_pool = new_connection_pool(2, 1)
+        tasks = await start_requests(connection_pool, 2)
+        # Busy slots are never reaped.
+        assert await connection_pool.reap_idle_slots(0) == 0
+        fake_connections.hold.set()
+        await asyncio.gather(*tasks)
+        assert await connection_pool.reap_idle_slots(60) == 0
+        assert await connection_pool.reap_idle_slots(0) == 2
+        assert connection_pool.size() == 0
+        assert all(connection.closed for connection in fake_connections.instances)
+        assert all(
+            not connection.listeners for connection in fake_connections.instances
+        )
+
+    @pytest.mark.asyncio
+    async def test_publisher_removes_idle_pools(self, fake_backend, monkeypatch):
+        monkeypatch.setenv("connection_slot_idle_timeout", "0.02")
+        publisher = Publisher(options={}, loop=asyncio.get_running_loop())
+        try:
+            await publisher.publish("b0/t0", b"x")
+            assert len(publisher.get_stats()["slots"]["b0"]) == 1
+            await asyncio.sleep(0.1)
+            assert publisher.get_stats()["slots"] == {}
+            assert fake_backend.instances[0].closed
+            # A new pool is opened for the next publish.
+            await publisher.publish("b0/t1", b"x")
+            assert len(publisher.get_stats()["slots"]["b0"]) == 1
+        finally:
+            await publisher.close()
@@ -0,0 +1,36 @@
+import time
+from maxwell.service.endpoint_selector import EndpointSelector
+
+
+class TestEndpointSelector:
+    def test_prefers_unmeasured_then_fastest(self):
+        selector = EndpointSelector(["a", "b", "c"], 3, 60)
+        assert selector.pick() == "a"
+        selector.record_success("a", 0.01)
+        assert selector.pick() == "b"
+        selector.record_success("b", 0.002)
+        selector.record_success("c", 0.005)
+        assert selector.pick() == "b"
+        assert selector.pick(exclude="b") == "c"
+        assert selector.is_much_faster("b", "a")
+        assert not selector.is_much_faster("c", "b")
+
+    def test_ejects_after_consecutive_failures(self):
+        selector = EndpointSelector(["a", "b"], 2, 0.01)
+        selector.record_success("a", 0.001)
+        selector.record_success("b", 0.01)
+        selector.record_failure("a")
+        assert selector.pick() == "a"
+        selector.record_failure("a")
+        assert selector.is_ejected("a")
+        assert selector.pick() == "b"
+        time.sleep(0.02)
+        assert selector.pick() == "a"
+
+    def test_rtt_percentile(self):
+        selector = EndpointSelector(["a"], 3, 60)
+        assert selector.get_rtt_percentile(95) is None
+        for i in range(1, 101):
+            selector.record_success("a", i / 1000)
+        assert selector.get_rtt_percentile(95) == 0.095
+        assert selector.get_rtt_percentile(100) == 0.1
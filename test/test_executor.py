@@ -0,0 +1,58 @@
+import contextvars
+import os
+import pytest
+from multiprocessing import shared_memory
+from maxwell.service.executor import Executor, SharedMemoryRef, _pack, _unpack
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def get_request_id():
+    return request_id.get()
+
+
+def make_result(size):
+    return (os.getpid(), b"x" * size, "y" * size)
+
+
+class TestExecutor:
+    @pytest.mark.asyncio
+    async def test_run_in_thread(self):
+        executor = Executor()
+        try:
+            token = request_id.set("req-1")
+            try:
+                assert await executor.run("thread", get_request_id) == "req-1"
+            finally:
+                request_id.reset(token)
+        finally:
+            executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_run_in_process(self):
+        executor = Executor()
+        try:
+            pid, data, text = await executor.run("process", make_result, 2097152)
+        finally:
+            executor.shutdown()
+        assert pid != os.getpid()
+        assert data == b"x" * 2097152
+        assert text == "y" * 2097152
+
+    @pytest.mark.asyncio
+    async def test_run_unknown_mode(self):
+        with pytest.raises(ValueError):
+            await Executor().run("fiber", get_request_id)
+
+    def test_pack_and_unpack(self):
+        # 512 chars, but 1024 bytes in utf-8.
+        value = (b"x" * 1024, "é" * 512, "x" * 1023, b"small", 1)
+        packed = _pack(value, 1024)
+        assert isinstance(packed[0], SharedMemoryRef)
+        assert isinstance(packed[1], SharedMemoryRef)
+        assert packed[1].size == 1024
+        assert packed[2:] == ("x" * 1023, b"small", 1)
+        assert _unpack(packed) == value
+        # The reader unlinks the segments.
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=packed[0].name)
@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+from maxwell.service.inflight_limiter import InflightLimiter
+
+
+class TestInflightLimiter:
+    def test_try_acquire(self):
+        limiter = InflightLimiter(2, 100)
+        assert limiter.try_acquire(60)
+        assert not limiter.try_acquire(60)
+        assert limiter.try_acquire(40)
+        assert not limiter.try_acquire(0)
+        limiter.release(60)
+        assert limiter.get_count() == 1
+        assert limiter.get_bytes() == 40
+
+    def test_oversized_msg_admitted_when_idle(self):
+        limiter = InflightLimiter(2, 100)
+        assert limiter.try_acquire(1000)
+        assert not limiter.try_acquire(1)
+
+    @pytest.mark.asyncio
+    async def test_acquire_waits_for_release(self):
+        limiter = InflightLimiter(1, 100)
+        await limiter.acquire(10)
+        waiter = asyncio.ensure_future(limiter.acquire(10))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        assert limiter.get_waiting_count() == 1
+        limiter.release(10)
+        await waiter
+        assert limiter.get_count() == 1
+        assert limiter.get_waiting_count() == 0
@@ -0,0 +1,48 @@
+import asyncio
+import time
+import pytest
+from maxwell.service.loop_monitor import LoopMonitor
+from maxwell.service.metrics import Metrics
+
+
+def block(seconds):
+    time.sleep(seconds)
+
+
+class TestLoopMonitor:
+    @pytest.mark.asyncio
+    async def test_blocked(self):
+        blocked = Metrics.singleton().get("maxwell_loop_blocked_total").labels("/block")
+        blocked_before = blocked.value
+        monitor = LoopMonitor(
+            0.01,
+            0.05,
+            lambda frame: "/block" if frame.f_code is block.__code__ else None,
+        )
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            block(0.2)
+            await asyncio.sleep(0.05)
+        finally:
+            await monitor.stop()
+        stats = monitor.get_stats()
+        assert stats["blocked"] == 1
+        assert stats["max_lag"] >= 0.15
+        assert blocked.value == blocked_before + 1
+
+    @pytest.mark.asyncio
+    async def test_not_blocked(self):
+        monitor = LoopMonitor(0.01, 0.05)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.1)
+        finally:
+            await monitor.stop()
+        assert monitor.get_stats()["blocked"] == 0
+
+    def test_check_handler(self):
+        monitor = LoopMonitor(0.01, 0.05)
+        monitor.check_handler("/fast", 0.01)
+        monitor.check_handler("/slow", 0.1)
+        assert monitor.get_stats()["slow_handlers"] == 1
@@ -0,0 +1,251 @@
+import asyncio
+import threading
+import pytest
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+from maxwell.utils.connection import Event
+from maxwell.service.master_client import MasterClient
+
+from .conftest import FakeMaster
+
+OPTIONS = {"reconnect_delay": 1, "ping_interval": 10}
+
+
+def new_master_client(master, loop):
+    return MasterClient([master.endpoint()], OPTIONS, loop)
+
+
+async def locate(master_client):
+    req = protocol_types.locate_topic_req_t()
+    req.topic = "t0"
+    rep = await asyncio.wait_for(master_client.request(req), 5)
+    return rep.endpoint
+
+
+def is_channel_running():
+    return any(thread.name == "master-channel" for thread in threading.enumerate())
+
+
+async def wait_channel_stopped():
+    for _ in range(100):
+        if not is_channel_running():
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+class TestMasterChannel:
+    @pytest.mark.asyncio
+    async def test_acquire_and_release(self):
+        master = await FakeMaster(1).start()
+        loop = asyncio.get_running_loop()
+        try:
+            client0 = new_master_client(master, loop)
+            client1 = new_master_client(master, loop)
+            channel = client0.get_channel()
+            assert client1.get_channel() is channel
+            assert (await channel.get_stats())["ref_count"] == 2
+
+            await client0.close()
+            assert await locate(client1) == "backend:1"
+            stats = await channel.get_stats()
+            assert stats["ref_count"] == 1
+            assert [client["requests"] for client in stats["clients"]] == [1]
+
+            # The last release closes the channel, the next client gets a new one.
+            await client1.close()
+            assert await wait_channel_stopped()
+            client2 = new_master_client(master, loop)
+            assert client2.get_channel() is not channel
+            assert await locate(client2) == "backend:1"
+            await client2.close()
+            assert await wait_channel_stopped()
+        finally:
+            await master.stop()
+
+    @pytest.mark.asyncio
+    async def test_listeners_on_caller_loop(self):
+        master = await FakeMaster(1).start()
+        loop = asyncio.get_running_loop()
+        calls = []
+        connected = asyncio.Event()
+
+        def on_connected(connection):
+            calls.append((asyncio.get_running_loop(), threading.current_thread()))
+            if len(calls) == 2:
+                connected.set()
+
+        try:
+            client0 = new_master_client(master, loop)
+            client1 = new_master_client(master, loop)
+            client0.add_connection_listener(Event.ON_CONNECTED, on_connected)
+            client1.add_connection_listener(Event.ON_CONNECTED, on_connected)
+            await asyncio.wait_for(connected.wait(), 5)
+            assert calls == [(loop, threading.current_thread())] * 2
+
+            # A late joiner is told the channel is connected already.
+            late = asyncio.Event()
+            client1.add_connection_listener(
+                Event.ON_CONNECTED, lambda connection: late.set()
+            )
+            await asyncio.wait_for(late.wait(), 5)
+            await client0.close()
+            await client1.close()
+            assert await wait_channel_stopped()
+        finally:
+            await master.stop()
+
+    @pytest.mark.asyncio
+    async def test_clients_on_other_loops(self):
+        master = await FakeMaster(1).start()
+        results = []
+
+        def run_client():
+            async def main():
+                client = new_master_client(master, asyncio.get_running_loop())
+                try:
+                    results.append(await locate(client))
+                finally:
+                    await client.close()
+
+            asyncio.run(main())
+
+        try:
+            client = new_master_client(master, asyncio.get_running_loop())
+            thread = threading.Thread(target=run_client)
+            thread.start()
+            assert await locate(client) == "backend:1"
+            await asyncio.get_running_loop().run_in_executor(None, thread.join)
+            assert results == ["backend:1"]
+            await client.close()
+            assert await wait_channel_stopped()
+        finally:
+            await master.stop()
+
+    @pytest.mark.asyncio
+    async def test_cancel_request(self):
+        # Never answers the checksum request.
+        master = await FakeMaster(None).start()
+        client = new_master_client(master, asyncio.get_running_loop())
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    client.request(protocol_types.get_topic_dist_checksum_req_t()),
+                    0.1,
+                )
+            await asyncio.sleep(0.05)
+            assert (await client.get_channel().get_stats())["requests"] == 0
+        finally:
+            await client.close()
+            await master.stop()
+
+    @pytest.mark.asyncio
+    async def test_acquire_with_other_args(self, monkeypatch):
+        master = await FakeMaster(1).start()
+        warnings = []
+        monkeypatch.setattr(
+            "maxwell.service.master_channel.logger.warning",
+            lambda *argv: warnings.append(argv),
+        )
+        loop = asyncio.get_running_loop()
+        try:
+            client0 = new_master_client(master, loop)
+            client1 = MasterClient(["127.0.0.1:1"], OPTIONS, loop)
+            assert client1.get_channel() is client0.get_channel()
+            assert len(warnings) == 1
+            assert await locate(client1) == "backend:1"
+            await client0.close()
+            await client1.close()
+            assert await wait_channel_stopped()
+        finally:
+            await master.stop()
+
+
+class TestHedging:
+    @pytest.fixture(autouse=True)
+    def hedge(self, monkeypatch):
+        monkeypatch.setenv("master_hedge_percentile", "50")
+        monkeypatch.setenv("master_hedge_min_delay", "0.05")
+
+    @pytest.mark.asyncio
+    async def test_hedge_wins(self):
+        slow_master = await FakeMaster(1, "backend:1").start()
+        slow_master.locate_delay = 0.5
+        master = await FakeMaster(1, "backend:2").start()
+        client = MasterClient(
+            [slow_master.endpoint(), master.endpoint()],
+            OPTIONS,
+            asyncio.get_running_loop(),
+        )
+        channel = client.get_channel()
+        try:
+            assert await locate(client) == "backend:2"
+            stats = await channel.get_stats()
+            assert stats["hedged"] == 1
+            assert stats["hedge_wins"] == 1
+            # The slow master's request was given up on, its rtt tells the
+            # channel to switch over to the fast one.
+            assert stats["requests"] == 0
+            assert stats["switches"] == 1
+            endpoints = stats["endpoints"]
+            assert (
+                endpoints[slow_master.endpoint()]["rtt"]
+                > endpoints[master.endpoint()]["rtt"] * 2
+            )
+
+            assert await locate(client) == "backend:2"
+            stats = await channel.get_stats()
+            assert stats["endpoint"] == master.endpoint()
+            assert stats["hedged"] == 1
+            assert (slow_master.locates, master.locates) == (1, 2)
+        finally:
+            await client.close()
+            assert await wait_channel_stopped()
+            await slow_master.stop()
+            await master.stop()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("error_delay", [0, 0.1])
+    async def test_fall_back_on_error(self, error_delay):
+        failing_master = await FakeMaster(1, "backend:1").start()
+        failing_master.locate_delay = error_delay
+        failing_master.locate_error = True
+        master = await FakeMaster(1, "backend:2").start()
+        master.locate_delay = 0.2
+        client = MasterClient(
+            [failing_master.endpoint(), master.endpoint()],
+            OPTIONS,
+            asyncio.get_running_loop(),
+        )
+        try:
+            assert await locate(client) == "backend:2"
+            stats = await client.get_channel().get_stats()
+            assert stats["hedged"] == 1
+            assert stats["hedge_wins"] == 1
+            assert (failing_master.locates, master.locates) == (1, 1)
+        finally:
+            await client.close()
+            assert await wait_channel_stopped()
+            await failing_master.stop()
+            await master.stop()
+
+
+class TestEjection:
+    @pytest.mark.asyncio
+    async def test_switch_from_dead_master(self):
+        master = await FakeMaster(1).start()
+        dead_endpoint = "127.0.0.1:1"
+        client = MasterClient(
+            [dead_endpoint, master.endpoint()],
+            {"reconnect_delay": 0.1, "ping_interval": 10},
+            asyncio.get_running_loop(),
+        )
+        try:
+            assert await locate(client) == "backend:1"
+            stats = await client.get_channel().get_stats()
+            assert stats["endpoint"] == master.endpoint()
+            assert stats["endpoints"][dead_endpoint]["ejected"]
+            assert not stats["endpoints"][master.endpoint()]["ejected"]
+        finally:
+            await client.close()
+            assert await wait_channel_stopped()
+            await master.stop()
@@ -0,0 +1,54 @@
+import pytest
+from maxwell.service.metrics import Metrics
+
+
+class TestMetrics:
+    def test_counter(self):
+        metrics = Metrics()
+        counter = metrics.counter("requests_total", "Requests.", ("path",))
+        child = counter.labels("/a")
+        child.inc()
+        child.inc(2)
+        assert counter.labels("/a") is child
+        assert metrics.counter("requests_total", "Requests.", ("path",)) is counter
+        assert 'requests_total{path="/a"} 3' in metrics.render()
+
+    def test_wrong_labels(self):
+        metrics = Metrics()
+        counter = metrics.counter("requests_total", "Requests.", ("path",))
+        with pytest.raises(ValueError):
+            counter.labels("/a", "b")
+
+    def test_histogram(self):
+        metrics = Metrics()
+        histogram = metrics.histogram("latency", "Latency.", buckets=(0.1, 1)).labels()
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(3)
+        lines = metrics.render().splitlines()
+        assert "# TYPE latency histogram" in lines
+        assert 'latency_bucket{le="0.1"} 2' in lines
+        assert 'latency_bucket{le="1.0"} 3' in lines
+        assert 'latency_bucket{le="+Inf"} 4' in lines
+        assert "latency_sum 3.65" in lines
+        assert "latency_count 4" in lines
+
+    def test_func(self):
+        metrics = Metrics()
+        values = {"hit": 1, "miss": 2}
+        metrics.counter_func("lookups_total", "Lookups.", lambda: values, ("result",))
+        metrics.gauge_func("size", "Size.", lambda: 7)
+        values["hit"] = 5
+        lines = metrics.render().splitlines()
+        assert 'lookups_total{result="hit"} 5' in lines
+        assert 'lookups_total{result="miss"} 2' in lines
+        assert "# TYPE size gauge" in lines
+        assert "size 7" in lines
+
+    def test_escape(self):
+        metrics = Metrics()
+        metrics.gauge("queued", "Queued\nbytes.", ("path",)).labels('a"\\b').set(1)
+        lines = metrics.render().splitlines()
+        assert "# HELP queued Queued\\nbytes." in lines
+        assert 'queued{path="a\\"\\\\b"} 1' in lines
@@ -0,0 +1,53 @@
+import asyncio
+import time
+import pstats
+import pytest
+from maxwell.service.profiler import Profiler
+
+
+def busy(seconds):
+    started_at = time.perf_counter()
+    while time.perf_counter() - started_at < seconds:
+        pass
+
+
+class TestProfiler:
+    @pytest.mark.asyncio
+    async def test_run(self, tmp_path):
+        profiler = Profiler(
+            str(tmp_path),
+            0.001,
+            lambda frame: "busy" if frame.f_code is busy.__code__ else None,
+        )
+
+        async def repeat_busy():
+            while True:
+                busy(0.01)
+                await asyncio.sleep(0)
+
+        task = asyncio.ensure_future(repeat_busy())
+        try:
+            files = await profiler.run(0.2)
+        finally:
+            task.cancel()
+
+        assert not profiler.is_running()
+        assert profiler.get_stats()["sessions"] == 1
+        pstats_file, folded_file, _, memory_file = files
+        assert any(
+            function[2] == "busy" for function in pstats.Stats(pstats_file).stats
+        )
+        with open(folded_file) as folded:
+            tags = {line.split(";")[0] for line in folded}
+        assert "busy" in tags
+        assert (tmp_path / memory_file).exists()
+
+    @pytest.mark.asyncio
+    async def test_one_session_at_a_time(self, tmp_path):
+        profiler = Profiler(str(tmp_path), 0.01)
+        session = asyncio.ensure_future(profiler.run(0.1))
+        await asyncio.sleep(0)
+        assert profiler.is_running()
+        with pytest.raises(RuntimeError):
+            await profiler.run(0.1)
+        await session
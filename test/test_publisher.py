@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+from maxwell.service.publisher import Publisher
+
+
+class TestPublisher:
+    @pytest.mark.asyncio
+    async def test_publish_many_in_order(self, fake_backend):
+        publisher = Publisher(options={}, loop=asyncio.get_running_loop())
+        try:
+            # The later msgs are acked first.
+            acks = await publisher.publish_many(
+                [("b0/t0", b"xxx"), ("b1/t1", b"xx"), ("b0/t2", b"x")]
+            )
+        finally:
+            await publisher.close()
+        assert [ack.ref for ack in acks] == [3, 2, 1]
+        endpoints = {
+            connection.endpoint(): [req.topic for req in connection.requests]
+            for connection in fake_backend.instances
+        }
+        assert sorted(endpoints["b0"]) == ["b0/t0", "b0/t2"]
+        assert endpoints["b1"] == ["b1/t1"]
+
+    @pytest.mark.asyncio
+    async def test_publish_many_with_failures(self, fake_backend):
+        publisher = Publisher(options={}, loop=asyncio.get_running_loop())
+        try:
+            acks = await publisher.publish_many(
+                [("unknown/t0", b"x"), ("b0/fail", b"x"), ("b0/t1", b"x")]
+            )
+        finally:
+            await publisher.close()
+        assert isinstance(acks[0], LookupError)
+        assert isinstance(acks[1], ConnectionError)
+        assert isinstance(acks[2], protocol_types.push_rep_t)
+        stats = publisher.get_stats()
+        assert (stats["sent"], stats["acked"], stats["failed"]) == (2, 1, 2)
+
+    @pytest.mark.asyncio
+    async def test_drain_all(self, fake_backend):
+        publisher = Publisher(options={}, loop=asyncio.get_running_loop())
+        try:
+            await publisher.publish_nowait("b0/t0", b"x" * 20)
+            await publisher.publish_nowait("b0/fail", b"x" * 20)
+            assert publisher.get_pending_count() == 2
+            # Acked while draining, but not one of the pending msgs.
+            other = asyncio.ensure_future(publisher.publish("b0/t1", b"x"))
+            stats = await Publisher.drain_all(1)
+            assert (await other).ref == 1
+        finally:
+            await publisher.close()
+        assert stats == {"drained": 1, "failed": 1, "dropped": 0}
+
+    @pytest.mark.asyncio
+    async def test_publish_nowait_blocks_on_full_window(
+        self, fake_backend, monkeypatch
+    ):
+        monkeypatch.setenv("publish_window_size", "1")
+        fake_backend.hold = asyncio.Event()
+        publisher = Publisher(options={}, loop=asyncio.get_running_loop())
+        try:
+            await publisher.publish_nowait("b0/t0", b"x")
+            blocked = asyncio.ensure_future(publisher.publish_nowait("b0/t1", b"x"))
+            await asyncio.sleep(0.01)
+            assert not blocked.done()
+            assert publisher.get_stats()["inflight"] == {"b0": 1}
+            fake_backend.hold.set()
+            await asyncio.wait_for(blocked, 1)
+            await publisher.flush()
+        finally:
+            await publisher.close()
+        assert publisher.get_stats()["acked"] == 2
+
+    @pytest.mark.asyncio
+    async def test_publish_nowait_releases_window_on_failure(
+        self, fake_backend, monkeypatch
+    ):
+        monkeypatch.setenv("publish_window_size", "1")
+        errors = []
+        publisher = Publisher(options={}, loop=asyncio.get_running_loop())
+        publisher.on_publish_error(lambda *args: errors.append(args))
+        try:
+            await publisher.publish_nowait("b0/fail", b"x")
+            await publisher.flush()
+            assert publisher.get_stats()["inflight"] == {"b0": 0}
+            await asyncio.wait_for(publisher.publish_nowait("b0/t0", b"x"), 1)
+            await publisher.publish_nowait("unknown/t1", b"y")
+            await publisher.flush()
+        finally:
+            await publisher.close()
+        assert [(topic, value) for topic, value, _ in errors] == [
+            ("b0/fail", b"x"),
+            ("unknown/t1", b"y"),
+        ]
+        assert isinstance(errors[0][2], ConnectionError)
+        assert isinstance(errors[1][2], LookupError)
+
+    @pytest.mark.asyncio
+    async def test_publish_nowait_with_raising_callback(self, fake_backend):
+        def on_publish_error(topic, value, error):
+            raise RuntimeError("broken callback")
+
+        publisher = Publisher(options={}, loop=asyncio.get_running_loop())
+        publisher.on_publish_error(on_publish_error)
+        try:
+            await publisher.publish_nowait("b0/fail", b"x")
+            await publisher.publish_nowait("unknown/t0", b"x")
+            await publisher.flush()
+            assert publisher.get_stats()["inflight"] == {"b0": 0}
+            await publisher.publish_nowait("b0/t1", b"x")
+            await publisher.flush()
+        finally:
+            await publisher.close()
+        assert publisher.get_stats()["acked"] == 1
+        assert publisher.get_stats()["failed"] == 2
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from fastapi.testclient import TestClient
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+from maxwell.service.registrar import Registrar
+from maxwell.service.service import Service
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def new_service():
+    service = Service()
+
+    @service.get("/hello")
+    def hello():
+        return "world"
+
+    return service
+
+
+def add_route(service, path):
+    service.get(path)(lambda: "world")
+
+
+# The routes of a set_routes req, without its ref.
+def routes_of(req):
+    routes = protocol_types.set_routes_req_t()
+    routes.CopyFrom(req)
+    routes.ClearField("ref")
+    return routes
+
+
+class TestRegistrar:
+    def test_skip_unchanged_routes(self, fake_master):
+        service = new_service()
+        registrar = Registrar(service)
+        registrar.attach()
+        with TestClient(service):
+            assert registrar.wait_registered(5)
+            assert len(fake_master.set_routes) == 1
+            # The same path again, the routes sent stay the same.
+            add_route(service, "/hello")
+            time.sleep(0.3)
+            assert len(fake_master.set_routes) == 1
+
+            add_route(service, "/hi")
+            assert wait_until(lambda: len(fake_master.set_routes) == 2)
+            assert "/hi" in fake_master.set_routes[-1].get_paths
+
+    def test_resend_after_reconnect(self, fake_master):
+        service = new_service()
+        registrar = Registrar(service)
+        registrar.attach()
+        with TestClient(service):
+            assert registrar.wait_registered(5)
+            assert (fake_master.registers, len(fake_master.set_routes)) == (1, 1)
+            # The master may have lost the routes, they are sent unchanged.
+            fake_master.disconnect()
+            assert wait_until(lambda: len(fake_master.set_routes) == 2)
+            assert fake_master.registers == 2
+            assert routes_of(fake_master.set_routes[1]) == routes_of(
+                fake_master.set_routes[0]
+            )
+
+    def test_debounce_burst(self, fake_master, monkeypatch):
+        monkeypatch.setenv("set_routes_quiet_period", "0.2")
+        monkeypatch.setenv("set_routes_delay", "1")
+        service = new_service()
+        registrar = Registrar(service)
+        registrar.attach()
+        with TestClient(service):
+            assert registrar.wait_registered(5)
+            for i in range(5):
+                add_route(service, "/burst/%s" % i)
+                time.sleep(0.02)
+            assert wait_until(lambda: len(fake_master.set_routes) == 2)
+            assert [
+                path
+                for path in fake_master.set_routes[-1].get_paths
+                if path.startswith("/burst/")
+            ] == ["/burst/%s" % i for i in range(5)]
+
+            # A burst which never goes quiet is still sent after set_routes_delay.
+            for i in range(15):
+                add_route(service, "/busy/%s" % i)
+                time.sleep(0.1)
+            assert wait_until(lambda: len(fake_master.set_routes) >= 3)
+            assert "/busy/0" in fake_master.set_routes[2].get_paths
+            assert "/busy/14" not in fake_master.set_routes[2].get_paths
+            time.sleep(0.5)
+            assert len(fake_master.set_routes) == 4
+            assert "/busy/14" in fake_master.set_routes[3].get_paths
+
+    def test_deregister(self, fake_master):
+        service = new_service()
+        registrar = Registrar(service)
+        registrar.attach()
+        with TestClient(service) as client:
+            assert registrar.wait_registered(5)
+            assert asyncio.run(registrar.deregister(1))
+            assert routes_of(fake_master.set_routes[-1]) == (
+                protocol_types.set_routes_req_t()
+            )
+            # Changed routes are never sent again.
+            add_route(service, "/hi")
+            time.sleep(0.3)
+            assert len(fake_master.set_routes) == 2
+            assert client.get("/hello").status_code == 200
@@ -0,0 +1,60 @@
+import time
+from maxwell.service.result_cache import ResultCache
+
+
+class TestResultCache:
+    def test_get_put(self):
+        cache = ResultCache(ttl=60, max_entries=2, max_bytes=1024)
+        assert cache.get("a") is None
+        cache.put("a", b"1")
+        assert cache.get("a") == b"1"
+        stats = cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_lru_eviction(self):
+        cache = ResultCache(ttl=60, max_entries=2, max_bytes=1024)
+        cache.put("a", b"1")
+        cache.put("b", b"2")
+        cache.get("a")
+        cache.put("c", b"3")
+        assert cache.get("b") is None
+        assert cache.get("a") == b"1"
+        assert cache.get_stats()["evictions"] == 1
+
+    def test_max_bytes(self):
+        cache = ResultCache(ttl=60, max_entries=10, max_bytes=4)
+        cache.put("a", b"12")
+        cache.put("b", b"34")
+        cache.put("c", b"56")
+        assert cache.get("a") is None
+        assert cache.get_stats()["bytes"] == 4
+        cache.put("d", b"12345")
+        assert cache.get("d") is None
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.01, max_entries=2, max_bytes=1024)
+        cache.put("a", b"1")
+        time.sleep(0.02)
+        assert cache.get("a") is None
+
+    def test_invalidate(self):
+        cache = ResultCache(ttl=60, max_entries=2, max_bytes=1024)
+        cache.put("a", b"1")
+        cache.put("b", b"2")
+        cache.invalidate("a")
+        assert cache.get("a") is None
+        cache.clear()
+        assert cache.get("b") is None
+        assert cache.get_stats()["invalidations"] == 2
+
+    def test_clear_matching(self):
+        cache = ResultCache(ttl=60, max_entries=4, max_bytes=1024)
+        cache.put(("/a", "1"), b"1")
+        cache.put(("/a", "2"), b"2")
+        cache.put(("/b", "1"), b"3")
+        cache.clear(lambda key: key[0] == "/a")
+        assert cache.get(("/a", "1")) is None
+        assert cache.get(("/b", "1")) == b"3"
+        stats = cache.get_stats()
+        assert (stats["invalidations"], stats["entries"], stats["bytes"]) == (2, 1, 1)
@@ -0,0 +1,243 @@
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+import maxwell.protocol.maxwell_protocol_pb2 as protocol_types
+import maxwell.protocol.maxwell_protocol as protocol
+from maxwell.service.metrics import Metrics
+from maxwell.service.result_cache import ResultCache
+from maxwell.service.service import Reply, Service
+
+
+def build_req(path, ref):
+    req = protocol_types.req_req_t()
+    req.path = path
+    req.payload = "{}"
+    req.conn0_ref = 1
+    req.ref = ref
+    return protocol.encode_msg(req)
+
+
+def request(websocket, path, ref):
+    websocket.send_bytes(build_req(path, ref))
+
+
+def ping(websocket):
+    websocket.send_bytes(protocol.encode_msg(protocol_types.ping_req_t(ref=1)))
+    return protocol.decode_msg(websocket.receive_bytes())
+
+
+def receive_until(websocket, rep_types):
+    reps = []
+    while True:
+        rep = protocol.decode_msg(websocket.receive_bytes())
+        reps.append(rep)
+        if rep.__class__ in rep_types:
+            return reps
+
+
+# Tracks how many requests the handler of the returned service holds at once.
+def new_slow_service():
+    service = Service(codec="json")
+    service.concurrency = [0, 0]  # [current, max]
+
+    @service.add_ws_route("/slow")
+    async def slow(req):
+        service.concurrency[0] += 1
+        service.concurrency[1] = max(service.concurrency)
+        try:
+            await asyncio.sleep(0.2)
+        finally:
+            service.concurrency[0] -= 1
+        return Reply(payload=req.ref)
+
+    return service
+
+
+@pytest.fixture(scope="module")
+def service():
+    service = Service(codec="json")
+
+    @service.add_ws_route("/stream")
+    async def stream(req):
+        yield "a"
+        # An empty chunk mustn't end the stream.
+        yield ""
+        yield {"b": 1}
+
+    @service.add_ws_route("/sync_stream")
+    def sync_stream(req):
+        yield from ["a", "b"]
+
+    @service.add_ws_route("/broken_stream")
+    async def broken_stream(req):
+        yield "a"
+        raise RuntimeError("broken")
+
+    return service
+
+
+class TestService:
+    def test_stream(self, service):
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            request(websocket, "/stream", 1)
+            reps = receive_until(websocket, (protocol_types.ok2_rep_t,))
+        assert [rep.__class__ for rep in reps] == [
+            protocol_types.req_rep_t,
+            protocol_types.req_rep_t,
+            protocol_types.req_rep_t,
+            protocol_types.ok2_rep_t,
+        ]
+        assert [rep.payload for rep in reps[:3]] == ["a", "", '{"b": 1}']
+        assert all(rep.conn0_ref == 1 and rep.ref == 1 for rep in reps)
+
+    def test_sync_stream(self, service):
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            request(websocket, "/sync_stream", 2)
+            reps = receive_until(websocket, (protocol_types.ok2_rep_t,))
+        assert [rep.payload for rep in reps[:-1]] == ["a", "b"]
+
+    def test_error_mid_stream(self, service):
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            request(websocket, "/broken_stream", 3)
+            reps = receive_until(
+                websocket, (protocol_types.ok2_rep_t, protocol_types.error2_rep_t)
+            )
+        assert reps[0].payload == "a"
+        assert reps[1].__class__ == protocol_types.error2_rep_t
+        assert reps[1].code == protocol_types.error_code_t.SERVICE_ERROR
+        assert reps[1].ref == 3
+
+    def test_drain_stats(self):
+        service = Service(codec="json")
+
+        @service.add_ws_route("/slow")
+        async def slow(req):
+            await asyncio.sleep(0.3)
+            return Reply(payload="done")
+
+        with TestClient(service) as client:
+            with client.websocket_connect("/$ws") as websocket:
+                request(websocket, "/slow", 1)
+                time.sleep(0.05)
+                drained = client.portal.start_task_soon(service.drain, 0.1)
+                time.sleep(0.05)
+                request(websocket, "/slow", 2)
+                reps = receive_until(websocket, (protocol_types.error2_rep_t,))
+                assert reps[0].ref == 2
+                assert reps[0].desc == "Shutting down, please retry: /slow"
+                assert not drained.result()
+                reps = receive_until(websocket, (protocol_types.req_rep_t,))
+                assert reps[0].ref == 1
+        # The late request was rejected, the slow one outlived the timeout.
+        stats = service.get_drain_stats()
+        assert (stats["drained"], stats["rejected"], stats["abandoned"]) == (0, 1, 1)
+
+    def test_metrics_cover_all_services(self, service):
+        metrics = Metrics.singleton().get("maxwell_ws_connections")
+        other_service = Service(codec="json")
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            ping(websocket)
+            with TestClient(other_service).websocket_connect("/$ws") as other:
+                ping(other)
+                # Not only the connections of the first service created.
+                assert [value for _, _, value in metrics.samples()] == [2]
+
+    def test_cache(self):
+        service = Service(codec="json")
+        # Shared by the routes, the entries of one never reply to the other.
+        cache = ResultCache(ttl=60)
+        calls = []
+
+        @service.add_ws_route("/a", cache=cache)
+        async def a(req):
+            calls.append("/a")
+            return Reply(payload="a")
+
+        @service.add_ws_route("/b", cache=cache)
+        async def b(req):
+            calls.append("/b")
+            return Reply(payload="b")
+
+        reps = []
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            for ref, path in enumerate(["/a", "/a", "/b", "/b"]):
+                request(websocket, path, ref)
+                reps.append(protocol.decode_msg(websocket.receive_bytes()))
+            service.invalidate_ws_cache("/a")
+            for ref, path in enumerate(["/a", "/b"], 4):
+                request(websocket, path, ref)
+                reps.append(protocol.decode_msg(websocket.receive_bytes()))
+        assert [rep.payload for rep in reps] == [
+            '"a"',
+            '"a"',
+            '"b"',
+            '"b"',
+            '"a"',
+            '"b"',
+        ]
+        assert [rep.ref for rep in reps] == [0, 1, 2, 3, 4, 5]
+        assert calls == ["/a", "/b", "/a"]
+
+    def test_reject_over_count(self, monkeypatch):
+        monkeypatch.setenv("ws_overload_policy", "reject")
+        monkeypatch.setenv("ws_max_inflight_per_connection", "2")
+        service = new_slow_service()
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            for ref in range(3):
+                request(websocket, "/slow", ref)
+            reps = [protocol.decode_msg(websocket.receive_bytes()) for _ in range(3)]
+        assert reps[0].__class__ == protocol_types.error2_rep_t
+        assert reps[0].desc == "Overloaded, please retry later: /slow"
+        assert reps[0].ref == 2
+        assert sorted(rep.ref for rep in reps[1:]) == [0, 1]
+        assert service.concurrency[1] == 2
+
+    def test_reject_over_bytes(self, monkeypatch):
+        size = len(build_req("/slow", 0))
+        monkeypatch.setenv("ws_overload_policy", "reject")
+        monkeypatch.setenv("ws_max_inflight_bytes_per_connection", str(size * 3 // 2))
+        service = new_slow_service()
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            for ref in range(2):
+                request(websocket, "/slow", ref)
+            reps = [protocol.decode_msg(websocket.receive_bytes()) for _ in range(2)]
+        assert reps[0].__class__ == protocol_types.error2_rep_t
+        assert reps[0].ref == 1
+        assert reps[1].__class__ == protocol_types.req_rep_t
+        assert reps[1].ref == 0
+
+    def test_pause_over_count(self, monkeypatch):
+        monkeypatch.setenv("ws_overload_policy", "pause")
+        monkeypatch.setenv("ws_max_inflight_per_connection", "1")
+        service = new_slow_service()
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            for ref in range(3):
+                request(websocket, "/slow", ref)
+            reps = [protocol.decode_msg(websocket.receive_bytes()) for _ in range(3)]
+        # Every request is handled, one after another.
+        assert [rep.__class__ for rep in reps] == [protocol_types.req_rep_t] * 3
+        assert [rep.ref for rep in reps] == [0, 1, 2]
+        assert service.concurrency[1] == 1
+
+    def test_coalesce(self):
+        service = Service(codec="json")
+        calls = []
+
+        @service.add_ws_route("/coalesced", coalesce=True)
+        async def coalesced(req):
+            calls.append(req.ref)
+            await asyncio.sleep(0.2)
+            return Reply(payload="done")
+
+        with TestClient(service).websocket_connect("/$ws") as websocket:
+            for ref in range(3):
+                request(websocket, "/coalesced", ref)
+            reps = [protocol.decode_msg(websocket.receive_bytes()) for _ in range(3)]
+            # Once done, the next request runs the handler again.
+            request(websocket, "/coalesced", 3)
+            reps.append(protocol.decode_msg(websocket.receive_bytes()))
+        assert calls == [0, 3]
+        assert [rep.payload for rep in reps] == ['"done"'] * 4
+        assert sorted(rep.ref for rep in reps) == [0, 1, 2, 3]
+        assert all(rep.conn0_ref == 1 for rep in reps)
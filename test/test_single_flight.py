@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+from maxwell.service.single_flight import SingleFlight
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_coalesce(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        results = await asyncio.gather(
+            *[single_flight.do("a", func) for _ in range(10)]
+        )
+        assert results == [1] * 10
+        assert single_flight.get_stats() == {
+            "executions": 1,
+            "coalesced": 9,
+            "inflight": 0,
+        }
+
+    @pytest.mark.asyncio
+    async def test_exception_is_shared(self):
+        single_flight = SingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(
+            single_flight.do("a", func),
+            single_flight.do("a", func),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        assert single_flight.get_stats()["executions"] == 1
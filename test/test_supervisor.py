@@ -0,0 +1,295 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import types
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+import maxwell.service.supervisor
+from maxwell.service.registrar import Registrar
+from maxwell.service.service import Service
+from maxwell.service.supervisor import (
+    LISTEN_FD_ENV,
+    PARENT_PID_ENV,
+    DrainingServer,
+    Supervisor,
+    bind_socket,
+    inherit_or_bind_socket,
+)
+from maxwell.service.tracer import Trace, Tracer
+
+
+# Workers are spawned, so they must be importable from here.
+def exit_worker(uvicorn_kwargs, sock, ready_event, drain_timeout):
+    ready_event.set()
+
+
+def crash_worker(uvicorn_kwargs, sock, ready_event, drain_timeout):
+    ready_event.set()
+    time.sleep(0.3)
+
+
+def serve_worker(uvicorn_kwargs, sock, ready_event, drain_timeout):
+    ready_event.set()
+    while True:
+        time.sleep(1)
+
+
+@pytest.fixture
+def sock():
+    sock = bind_socket("127.0.0.1", 0)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def restore_signals():
+    signums = (
+        signal.SIGINT,
+        signal.SIGTERM,
+        signal.SIGHUP,
+        signal.SIGUSR1,
+        signal.SIGUSR2,
+    )
+    handlers = {signum: signal.getsignal(signum) for signum in signums}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def new_supervisor(sock, workers, restart_delay, reload_timeout=5, **kwargs):
+    return Supervisor({}, sock, workers, restart_delay, 1, reload_timeout, **kwargs)
+
+
+# Runs the supervisor on this, the main, thread until stop_when is true, or
+# until it stops by itself.
+def run_supervisor(supervisor, stop_when, timeout=10):
+    deadline = time.monotonic() + timeout
+    finished = threading.Event()
+
+    def stop():
+        while not finished.is_set() and time.monotonic() < deadline:
+            if stop_when():
+                break
+            time.sleep(0.01)
+        supervisor.stop()
+
+    thread = threading.Thread(target=stop)
+    thread.start()
+    try:
+        supervisor.run()
+    finally:
+        finished.set()
+        thread.join()
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+class TestSupervisor:
+    def test_restart_exited_workers(self, sock, restore_signals, monkeypatch):
+        monkeypatch.setattr(maxwell.service.supervisor, "_run_worker", exit_worker)
+        supervisor = new_supervisor(sock, 2, 0)
+        run_supervisor(supervisor, lambda: supervisor.get_stats()["restarts"] >= 4)
+        assert supervisor.get_stats()["restarts"] >= 4
+
+    def test_restart_delay(self, sock, restore_signals, monkeypatch):
+        monkeypatch.setattr(maxwell.service.supervisor, "_run_worker", exit_worker)
+        supervisor = new_supervisor(sock, 1, 0.5)
+        started_at = time.monotonic()
+        run_supervisor(supervisor, lambda: supervisor.get_stats()["restarts"] >= 2)
+        # At most one restart every 0.5s, however fast the worker exits.
+        assert supervisor.get_stats()["restarts"] == 2
+        assert time.monotonic() - started_at >= 1
+
+    def test_stop_all(self, sock, restore_signals, monkeypatch):
+        monkeypatch.setattr(maxwell.service.supervisor, "_run_worker", serve_worker)
+        before_stop_calls = []
+        supervisor = new_supervisor(
+            sock, 2, 0, before_stop=lambda: before_stop_calls.append(1)
+        )
+        pids = []
+
+        def stop_when():
+            pids[:] = supervisor.get_stats()["workers"]
+            return supervisor.get_stats()["restarts"] > 0 or all(
+                pid is not None and is_running(pid) for pid in pids
+            )
+
+        run_supervisor(supervisor, stop_when)
+        assert supervisor.get_stats()["restarts"] == 0
+        assert len(pids) == 2
+        assert not any(is_running(pid) for pid in pids)
+        assert before_stop_calls == [1]
+        assert not supervisor.is_handed_over()
+
+    def test_not_blocked_while_registering(self, sock, restore_signals, monkeypatch):
+        monkeypatch.setattr(maxwell.service.supervisor, "_run_worker", crash_worker)
+        wait_ready_timeouts = []
+
+        def wait_ready(timeout):
+            wait_ready_timeouts.append(timeout)
+            time.sleep(timeout)
+            return False
+
+        supervisor = new_supervisor(sock, 1, 0, wait_ready=wait_ready)
+        started_at = time.monotonic()
+        run_supervisor(supervisor, lambda: supervisor.get_stats()["restarts"] >= 2)
+        # Crashed workers are restarted while waiting for the registration.
+        assert time.monotonic() - started_at < 5
+        assert set(wait_ready_timeouts) == {0}
+
+    def test_take_over(self, sock, restore_signals, monkeypatch):
+        monkeypatch.setattr(maxwell.service.supervisor, "_run_worker", serve_worker)
+        # Pretends to be the next generation of this very process.
+        monkeypatch.setenv(PARENT_PID_ENV, str(os.getpid()))
+        before_stop_calls = []
+        supervisor = new_supervisor(
+            sock, 1, 0, before_stop=lambda: before_stop_calls.append(1)
+        )
+        run_supervisor(supervisor, supervisor.is_handed_over)
+        # The SIGUSR2 sent to the parent made this generation stop, without
+        # clearing the routes which the next generation has set.
+        assert supervisor.is_handed_over()
+        assert before_stop_calls == []
+        assert PARENT_PID_ENV not in os.environ
+
+    def test_next_generation_gives_way(
+        self, sock, restore_signals, monkeypatch, fake_master
+    ):
+        monkeypatch.setattr(maxwell.service.supervisor, "_run_worker", serve_worker)
+        service = Service()
+
+        @service.get("/hello")
+        def hello():
+            return "world"
+
+        registrar = Registrar(service)
+        registrar.attach()
+        with TestClient(service):
+            assert registrar.wait_registered(5)
+            # Never registered in time, e.g. as the master is too slow.
+            monkeypatch.setenv(PARENT_PID_ENV, str(os.getpid()))
+            supervisor = new_supervisor(
+                sock,
+                1,
+                0,
+                reload_timeout=0.3,
+                wait_ready=lambda timeout: False,
+                before_stop=lambda: asyncio.run(registrar.deregister(1)),
+            )
+            run_supervisor(supervisor, lambda: False)
+        # The previous generation is still serving with the routes, they must
+        # not be cleared.
+        assert not supervisor.is_handed_over()
+        assert ["/hello" in req.get_paths for req in fake_master.set_routes] == [True]
+
+    def test_reload_failed(self, sock, restore_signals, monkeypatch):
+        monkeypatch.setattr(maxwell.service.supervisor, "_run_worker", serve_worker)
+        spawned = []
+
+        class ExitedProcess(object):
+            def __init__(self, args, **kwargs):
+                spawned.append(args)
+
+            def poll(self):
+                return 1
+
+        monkeypatch.setattr(
+            maxwell.service.supervisor,
+            "subprocess",
+            types.SimpleNamespace(Popen=ExitedProcess),
+        )
+        reload_failed_calls = []
+        supervisor = new_supervisor(
+            sock, 1, 0, on_reload_failed=lambda: reload_failed_calls.append(1)
+        )
+
+        def stop_when():
+            # Once running, with its signal handlers installed.
+            if not spawned and supervisor.get_stats()["workers"][0] is not None:
+                os.kill(os.getpid(), signal.SIGHUP)
+                time.sleep(0.2)
+            return len(reload_failed_calls) > 0
+
+        run_supervisor(supervisor, stop_when)
+        # Started like this process, e.g. with python -m.
+        assert spawned[0] == [sys.executable] + sys.orig_argv[1:]
+        # So the routes of this generation are sent again.
+        assert reload_failed_calls == [1]
+
+
+class TestDrainingServer:
+    def test_shutdown_writes_queued_traces(self, sock, monkeypatch, tmp_path):
+        path = str(tmp_path / "traces.jsonl")
+        monkeypatch.setenv("trace_file", path)
+        monkeypatch.setenv("trace_sample_rate", "1")
+        # A tracer of its own, which writes to the file.
+        Tracer.singleton().close()
+        tracer = Tracer.singleton()
+        unblocked = threading.Event()
+
+        # Stalls the writer, like a slow disk would.
+        class SlowTrace(Trace):
+            def to_dict(self):
+                unblocked.wait()
+                return super().to_dict()
+
+        server = DrainingServer(
+            uvicorn.Config(Service(), lifespan="on", log_config=None), 1
+        )
+        thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]})
+        thread.start()
+        for _ in range(100):
+            if server.started:
+                break
+            time.sleep(0.01)
+        assert server.started
+        tracer.finish(SlowTrace("slow", {}))
+        for _ in range(3):
+            with tracer.trace("ws"):
+                pass
+
+        server.should_exit = True
+        threading.Timer(0.2, unblocked.set).start()
+        thread.join(5)
+        with open(path) as file:
+            names = [json.loads(line)["name"] for line in file]
+        assert names == ["slow", "ws", "ws", "ws"]
+        # Closed for good, a new one is made if needed, e.g. by the next test.
+        next_tracer = Tracer.singleton()
+        assert next_tracer is not tracer
+        next_tracer.close()
+
+
+class TestInheritOrBindSocket:
+    def test_bind(self, monkeypatch):
+        monkeypatch.delenv(LISTEN_FD_ENV, raising=False)
+        sock = inherit_or_bind_socket("127.0.0.1", 0)
+        try:
+            assert sock.getsockname()[0] == "127.0.0.1"
+            assert sock.get_inheritable()
+        finally:
+            sock.close()
+
+    def test_inherit(self, sock, monkeypatch):
+        listen_fd = os.dup(sock.fileno())
+        monkeypatch.setenv(LISTEN_FD_ENV, str(listen_fd))
+        inherited_sock = inherit_or_bind_socket("127.0.0.1", 0)
+        try:
+            assert inherited_sock.fileno() == listen_fd
+            assert inherited_sock.getsockname() == sock.getsockname()
+            assert inherited_sock.get_inheritable()
+            # Only the first socket is inherited.
+            assert LISTEN_FD_ENV not in os.environ
+        finally:
+            inherited_sock.close()
@@ -0,0 +1,80 @@
+import asyncio
+import time
+import pytest
+from maxwell.service.topic_index import TopicIndex
+
+
+class TestTopicIndex:
+    def test_lru_and_ttl(self):
+        topic_index = TopicIndex(maxsize=2, ttl=0.01)
+        topic_index.put("a", "host-a")
+        topic_index.put("b", "host-b")
+        topic_index.get("a")
+        topic_index.put("c", "host-c")
+        assert topic_index.get("b") is None
+        assert topic_index.get("a") == "host-a"
+        time.sleep(0.02)
+        assert topic_index.get("a") is None
+
+    @pytest.mark.asyncio
+    async def test_get_or_load_dedups(self):
+        topic_index = TopicIndex(maxsize=10, ttl=60)
+        loads = []
+
+        async def load(topic):
+            loads.append(topic)
+            await asyncio.sleep(0.01)
+            return "host-" + topic
+
+        endpoints = await asyncio.gather(
+            *[topic_index.get_or_load("a", load) for _ in range(5)]
+        )
+        assert endpoints == ["host-a"] * 5
+        assert loads == ["a"]
+        assert await topic_index.get_or_load("a", load) == "host-a"
+        stats = topic_index.get_stats()
+        assert stats["coalesced"] == 4
+        assert stats["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_clear_during_load(self):
+        topic_index = TopicIndex(maxsize=10, ttl=60)
+
+        async def load(topic):
+            topic_index.clear()
+            return "host-" + topic
+
+        assert await topic_index.get_or_load("a", load) == "host-a"
+        assert topic_index.get("a") is None
+
+    @pytest.mark.asyncio
+    async def test_stale_while_revalidate(self):
+        topic_index = TopicIndex(maxsize=10, ttl=60)
+        endpoints = iter(["host-0", "host-1"])
+
+        async def load(topic):
+            await asyncio.sleep(0.01)
+            return next(endpoints)
+
+        assert await topic_index.get_or_load("a", load) == "host-0"
+        topic_index.mark_all_stale()
+        assert await topic_index.get_or_load("a", load) == "host-0"
+        assert topic_index.get("a") is None
+        await asyncio.sleep(0.02)
+        assert await topic_index.get_or_load("a", load) == "host-1"
+        assert topic_index.get_stats()["stale_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_negative_cache(self):
+        topic_index = TopicIndex(maxsize=10, ttl=60, negative_ttl=60)
+        loads = []
+
+        async def load(topic):
+            loads.append(topic)
+            raise LookupError("master is down")
+
+        for _ in range(3):
+            with pytest.raises(LookupError):
+                await topic_index.get_or_load("a", load)
+        assert loads == ["a"]
+        assert topic_index.get_stats()["negative_hits"] == 2
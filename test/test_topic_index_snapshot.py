@@ -0,0 +1,54 @@
+import concurrent.futures
+import os
+import maxwell.service.topic_index_snapshot as topic_index_snapshot
+from maxwell.service.topic_index import TopicIndex
+from maxwell.service.topic_index_snapshot import TopicIndexSnapshot
+
+
+class TestTopicIndexSnapshot:
+    def test_save_and_load(self, tmp_path):
+        topic_index = TopicIndex(maxsize=10, ttl=60)
+        topic_index.put("a", "host-a")
+        topic_index.put("b", "host-b")
+        topic_index.mark_all_stale()
+        topic_index.put("c", "host-c")
+
+        snapshot = TopicIndexSnapshot(str(tmp_path / "data" / "topic_index.sqlite"))
+        snapshot.save(7, topic_index.items())
+        checksum, items = snapshot.load()
+        assert checksum == 7
+        assert items == [("c", "host-c")]
+
+        snapshot.save(8, [("d", "host-d")])
+        assert snapshot.load() == (8, [("d", "host-d")])
+        assert os.listdir(str(tmp_path / "data")) == ["topic_index.sqlite"]
+
+    def test_concurrent_saves(self, tmp_path, monkeypatch):
+        warnings = []
+        monkeypatch.setattr(
+            topic_index_snapshot.logger, "warning", lambda *args: warnings.append(args)
+        )
+        path = str(tmp_path / "topic_index.sqlite")
+        snapshots = [TopicIndexSnapshot(path) for _ in range(4)]
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            futures = [
+                executor.submit(
+                    snapshot.save,
+                    checksum,
+                    [("t%s" % i, "host-%s" % checksum) for i in range(1000)],
+                )
+                for checksum, snapshot in enumerate(snapshots * 5)
+            ]
+            for future in futures:
+                future.result()
+        # Every save succeeds and one of them wins, no temporary file is left.
+        assert warnings == []
+        checksum, items = TopicIndexSnapshot(path).load()
+        assert items == [("t%s" % i, "host-%s" % checksum) for i in range(1000)]
+        assert os.listdir(str(tmp_path)) == ["topic_index.sqlite"]
+
+    def test_load_missing_or_broken(self, tmp_path):
+        path = tmp_path / "topic_index.sqlite"
+        assert TopicIndexSnapshot(str(path)).load() == (None, [])
+        path.write_bytes(b"not a database")
+        assert TopicIndexSnapshot(str(path)).load() == (None, [])
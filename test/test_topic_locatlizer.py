@@ -0,0 +1,45 @@
+import asyncio
+import time
+import pytest
+from maxwell.service.topic_index_snapshot import TopicIndexSnapshot
+from maxwell.service.topic_locatlizer import TopicLocatlizer
+
+from .conftest import FakeMaster
+
+
+@pytest.fixture
+def snapshot_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "topic_index.sqlite")
+    TopicIndexSnapshot(path).save(7, [("t0", "snapshot:1")])
+    monkeypatch.setenv("endpoint_snapshot_file", path)
+    monkeypatch.setenv("endpoint_snapshot_verify_timeout", "0.2")
+    return path
+
+
+class TestTopicLocatlizer:
+    @pytest.mark.asyncio
+    async def test_locate_with_verified_snapshot(self, snapshot_file, monkeypatch):
+        master = await FakeMaster(7).start()
+        monkeypatch.setenv("master_endpoints", master.endpoint())
+        locatlizer = TopicLocatlizer(asyncio.get_running_loop())
+        try:
+            assert await asyncio.wait_for(locatlizer.locate("t0"), 5) == "snapshot:1"
+            assert master.locates == 0
+        finally:
+            await locatlizer.close()
+            await master.stop()
+
+    @pytest.mark.asyncio
+    async def test_locate_while_snapshot_unverified(self, snapshot_file, monkeypatch):
+        master = await FakeMaster(None).start()
+        monkeypatch.setenv("master_endpoints", master.endpoint())
+        locatlizer = TopicLocatlizer(asyncio.get_running_loop())
+        try:
+            started_at = time.monotonic()
+            # Falls back to the master after the verify timeout.
+            assert await asyncio.wait_for(locatlizer.locate("t0"), 5) == "backend:1"
+            assert time.monotonic() - started_at >= 0.2
+            assert master.locates == 1
+        finally:
+            await locatlizer.close()
+            await master.stop()
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import threading
+import pytest
+from maxwell.service.tracer import (
+    JsonLinesExporter,
+    RingBufferExporter,
+    Trace,
+    Tracer,
+    current_trace,
+    span,
+)
+
+
+class TestTracer:
+    def test_not_sampled(self):
+        tracer = Tracer(0, [RingBufferExporter(10)])
+        with tracer.trace("ws") as trace:
+            assert trace is None
+            assert current_trace() is None
+            with span("handle"):
+                pass
+        assert tracer.get_traces() == []
+
+    def test_sampled(self):
+        tracer = Tracer(1, [RingBufferExporter(2)])
+        for ref in range(3):
+            with tracer.trace("ws", {"ref": ref}) as trace:
+                assert current_trace() is trace
+                with span("handle"):
+                    pass
+        assert current_trace() is None
+        traces = tracer.get_traces()
+        assert [trace["attributes"]["ref"] for trace in traces] == [2, 1]
+        assert [span["name"] for span in traces[0]["spans"]] == ["handle"]
+        assert traces[0]["duration"] >= traces[0]["spans"][0]["duration"]
+        assert tracer.get_stats()["sampled"] == 3
+
+    def test_join_current(self):
+        tracer = Tracer(1, [RingBufferExporter(10)])
+        with tracer.trace("ws") as trace:
+            with tracer.trace("publish") as inner:
+                assert inner is None
+                with span("push"):
+                    pass
+        traces = tracer.get_traces()
+        assert len(traces) == 1
+        assert traces[0]["trace_id"] == trace.trace_id
+        assert traces[0]["spans"][0]["name"] == "push"
+
+    @pytest.mark.asyncio
+    async def test_propagated_to_tasks(self):
+        tracer = Tracer(1, [RingBufferExporter(10)])
+
+        async def handle():
+            with span("handle"):
+                await asyncio.sleep(0)
+
+        with tracer.trace("ws"):
+            await asyncio.ensure_future(handle())
+        assert tracer.get_traces()[0]["spans"][0]["name"] == "handle"
+
+    def test_json_lines_exporter(self, tmp_path):
+        path = str(tmp_path / "traces" / "traces.jsonl")
+        exporter = JsonLinesExporter(path, 10)
+        tracer = Tracer(1, [exporter])
+        with tracer.trace("ws", {"path": "/a"}):
+            pass
+        tracer.close()
+        with open(path) as file:
+            lines = [json.loads(line) for line in file]
+        assert lines[0]["attributes"] == {"path": "/a"}
+
+    def test_close_twice(self, tmp_path):
+        path = str(tmp_path / "traces.jsonl")
+        tracer = Tracer(1, [RingBufferExporter(10), JsonLinesExporter(path, 10)])
+        with tracer.trace("ws"):
+            pass
+        tracer.close()
+        tracer.close()
+        # Still kept in memory, but never written to the closed file.
+        with tracer.trace("ws"):
+            pass
+        assert len(tracer.get_traces()) == 2
+        assert tracer.get_stats()["dropped"] == 1
+        with open(path) as file:
+            assert len(file.readlines()) == 1
+
+    def test_json_lines_exporter_drops_when_behind(self, tmp_path):
+        path = str(tmp_path / "traces.jsonl")
+        writing = threading.Event()
+        unblocked = threading.Event()
+
+        # Stalls the writer, like a slow disk would.
+        class SlowTrace(Trace):
+            def to_dict(self):
+                writing.set()
+                unblocked.wait()
+                return super().to_dict()
+
+        exporter = JsonLinesExporter(path, 1)
+        tracer = Tracer(1, [exporter])
+        exporter.export(SlowTrace("slow", {}))
+        assert writing.wait(5)
+        for _ in range(3):
+            with tracer.trace("ws"):
+                pass
+        # Only one fits in the queue, the others are dropped without blocking.
+        assert tracer.get_stats()["dropped"] == 2
+        unblocked.set()
+        tracer.close()
+        with open(path) as file:
+            names = [json.loads(line)["name"] for line in file]
+        assert names == ["slow", "ws"]
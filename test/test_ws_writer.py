@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from maxwell.service.ws_writer import WsWriter
+
+
+class SlowWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_bytes(self, frame):
+        await asyncio.sleep(0.001)
+        self.frames.append(frame)
+
+
+class TestWsWriter:
+    @pytest.mark.asyncio
+    async def test_send_in_order(self):
+        websocket = SlowWebSocket()
+        writer = WsWriter(websocket, 1024, 256)
+        writer.start()
+        for i in range(10):
+            await writer.send(b"%d" % i)
+        await asyncio.sleep(0.05)
+        assert websocket.frames == [b"%d" % i for i in range(10)]
+        assert writer.get_stats()["sent_frames"] == 10
+        await writer.close()
+
+    @pytest.mark.asyncio
+    async def test_high_water_mark(self):
+        websocket = SlowWebSocket()
+        writer = WsWriter(websocket, 100, 10)
+        writer.start()
+        await asyncio.gather(*[writer.send(b"x" * 50) for _ in range(20)])
+        assert writer.get_stats()["max_queued_bytes"] <= 150
+        assert writer.get_stats()["throttled"] > 0
+        await writer.close()
+        with pytest.raises(ConnectionError):
+            await writer.send(b"x")
+
+    @pytest.mark.asyncio
+    async def test_wait_sent(self):
+        websocket = SlowWebSocket()
+        writer = WsWriter(websocket, 1024, 256)
+        writer.start()
+        await writer.send(b"0")
+        seq = await writer.send(b"1")
+        await writer.wait_sent(seq)
+        assert websocket.frames == [b"0", b"1"]
+        seq = await writer.send(b"2")
+        await writer.close()
+        await asyncio.wait_for(writer.wait_sent(seq), 1)